@@ -2,6 +2,7 @@ const express = require('express');
 const http = require('http');
 const { Server } = require('socket.io');
 const crypto = require('crypto');
+const zlib = require('zlib');
 const { MongoClient, ServerApiVersion, ObjectId } = require('mongodb');
 const bcrypt = require('bcrypt');
 const admin = require('firebase-admin');
@@ -28,6 +29,9 @@ if (process.env.NODE_ENV !== "production") {
 
 const app = express();
 const server = http.createServer(app);
+// Let Raspberry Pis reuse their pooled HTTPS connections between heartbeats (Node's default is 5 s)
+server.keepAliveTimeout = 65000;
+server.headersTimeout = 66000;
 const io = new Server(server, {
     cors: {
         origin: "*",
@@ -63,6 +67,60 @@ function emitAdminDashboardRefresh(dbName = 'KSG', update = {}) {
     });
 }
 
+// Request-body compression on Raspberry Pi uplink routes, advertised to the Pi
+// in the Accept-Encoding response header (RFC 7694). gzip/deflate bodies are
+// inflated by the body parsers; zstd needs a Node.js zlib with zstd support
+// and is decoded here before them.
+const UPLINK_REQUEST_CODECS = typeof zlib.createZstdDecompress === 'function' ? ['zstd', 'gzip'] : ['gzip'];
+const UPLINK_MAX_BODY = 50 * 1024 * 1024; // Decompressed bytes
+const UPLINK_ROUTES = [
+    '/api/opcua/config', '/api/opcua/heartbeat', '/api/opcua/data',
+    '/api/opcua/event-log', '/api/opcua/discovered-nodes', '/api/opcua/device-info'
+];
+
+app.use(UPLINK_ROUTES, (req, res, next) => {
+    res.set('Accept-Encoding', UPLINK_REQUEST_CODECS.join(', '));
+    
+    const encoding = String(req.headers['content-encoding'] || 'identity').toLowerCase();
+    if (encoding !== 'zstd') {
+        return next();
+    }
+    if (!UPLINK_REQUEST_CODECS.includes('zstd')) {
+        return res.status(415).json({ error: 'Unsupported Content-Encoding: zstd' });
+    }
+    
+    const chunks = [];
+    let size = 0;
+    const decompressor = zlib.createZstdDecompress();
+    decompressor.on('data', chunk => {
+        size += chunk.length;
+        if (size > UPLINK_MAX_BODY) {
+            req.unpipe(decompressor);
+            decompressor.destroy(new Error('Request body too large'));
+            return;
+        }
+        chunks.push(chunk);
+    });
+    decompressor.on('error', error => {
+        if (!res.headersSent) {
+            res.status(size > UPLINK_MAX_BODY ? 413 : 400).json({ error: error.message });
+        }
+    });
+    decompressor.on('end', () => {
+        const body = Buffer.concat(chunks);
+        try {
+            // Mark the body as parsed so express.json()/express.raw() skip it
+            req.body = req.is('application/json') ? JSON.parse(body.toString('utf8')) : body;
+            req._body = true;
+            delete req.headers['content-encoding'];
+            next();
+        } catch (error) {
+            res.status(400).json({ error: 'Invalid JSON body' });
+        }
+    });
+    req.pipe(decompressor);
+});
+
 app.use(express.json());
 
 // Serve static files
@@ -4740,6 +4798,271 @@ async function broadcastVariablesToAllTablets(company) {
     }
 }
 
+// 👀 Demand-driven subscriptions: which discovered nodes each Raspberry Pi should monitor.
+// Admin pages (OPC Management, array viewer) report the nodes they display; nodes used by
+// saved variables (opcua_conversions) are always included so tablets keep updating.
+const raspberrySockets = new Map(); // raspberryId -> Pi socket
+const opcuaWatchers = new Map(); // raspberryId -> Map(socketId -> Set(opcNodeId))
+
+// MessagePack for the Pi's binary uplink encoding (Pis that don't offer it stay on JSON)
+const msgpack = require('@msgpack/msgpack');
+const UPLINK_ENCODING = 'msgpack-columnar';
+const QUALITY_CODES = ['Good', 'Uncertain', 'Bad']; // Index = quality enum on the wire
+
+// Decode a columnar uplink frame into { raspberryId, epoch, seq, items }.
+// Columns are parallel arrays: node (index into the node dictionary), ts (epoch ms),
+// quality (QUALITY_CODES index) and cols (value plus any other item fields).
+// nodes is the socket session's dictionary, extended by the frame's defs
+// (HTTP frames are self-contained and get a fresh Map).
+function decodeUplinkFrame(buffer, nodes) {
+    const frame = msgpack.decode(buffer);
+    
+    (frame.defs || []).forEach(([index, opcNodeId, datapointId, equipmentId]) => {
+        nodes.set(index, { opcNodeId, datapointId, equipmentId });
+    });
+    
+    const columns = Object.entries(frame.cols || {});
+    const items = (frame.node || []).map((index, i) => {
+        const node = nodes.get(index);
+        if (!node) {
+            const error = new Error(`Unknown node index ${index}`);
+            error.resync = true; // Pi resends with a fresh dictionary
+            throw error;
+        }
+        
+        const item = {
+            opcNodeId: node.opcNodeId,
+            quality: QUALITY_CODES[frame.quality[i]] || 'Bad',
+            timestamp: frame.ts[i] !== null ? new Date(frame.ts[i]).toISOString() : new Date().toISOString()
+        };
+        if (node.datapointId !== null && node.datapointId !== undefined) {
+            item.datapointId = node.datapointId;
+            item.equipmentId = node.equipmentId;
+        }
+        columns.forEach(([name, column]) => {
+            if (name === 'value' || (column[i] !== null && column[i] !== undefined)) {
+                item[name] = column[i];
+            }
+        });
+        return item;
+    });
+    
+    return { raspberryId: frame.raspberryId, epoch: frame.epoch, seq: frame.seq, items };
+}
+
+// Recently processed uplink data messages per Pi. The Pi numbers spooled
+// batches (seq) within a spool epoch and retransmits anything unacknowledged,
+// so a message is applied once even when it arrives twice.
+const UPLINK_DEDUPE_WINDOW = 4096; // Batch keys remembered per Pi
+const uplinkProcessed = new Map(); // raspberryId -> { epoch, keys: Set }
+
+function uplinkMessageKey(data) {
+    if (!data || data.seq === undefined || data.seq === null) {
+        return null;
+    }
+    return String(data.seq);
+}
+
+function isDuplicateUplink(raspberryId, epoch, key) {
+    const seen = uplinkProcessed.get(raspberryId);
+    return Boolean(key && seen && seen.epoch === epoch && seen.keys.has(key));
+}
+
+function markUplinkProcessed(raspberryId, epoch, key) {
+    if (!key) {
+        return;
+    }
+    let seen = uplinkProcessed.get(raspberryId);
+    if (!seen || seen.epoch !== epoch) {
+        // New spool on the Pi (first message, or its spool was recreated)
+        seen = { epoch, keys: new Set() };
+        uplinkProcessed.set(raspberryId, seen);
+    }
+    seen.keys.add(key);
+    if (seen.keys.size > UPLINK_DEDUPE_WINDOW) {
+        seen.keys.delete(seen.keys.values().next().value);
+    }
+}
+
+// Company a Pi belongs to: { dbName, company } or null
+async function resolveRaspberryCompany(raspberryId) {
+    // First try deviceInfo collection (new system)
+    const masterDB = mongoClient.db(DB_NAME);
+    const masterUsers = await masterDB.collection(COLLECTION_NAME).find({}).toArray();
+    
+    for (const user of masterUsers) {
+        const testDb = mongoClient.db(user.company || user.dbName);
+        const device = await testDb.collection('deviceInfo').findOne({ device_id: raspberryId });
+        if (device) {
+            return { dbName: user.company || user.dbName, company: user.company };
+        }
+    }
+    
+    // Fallback: Try old devices structure
+    const user = await masterDB.collection(COLLECTION_NAME).findOne({
+        'devices': { $elemMatch: { uniqueId: raspberryId } }
+    });
+    return user ? { dbName: user.dbName, company: user.company } : null;
+}
+
+// Company of a connected Pi (resolved once per socket, retried while unknown)
+async function piSocketCompany(piSocket, raspberryId) {
+    if (!piSocket.opcuaCompany) {
+        piSocket.opcuaCompany = await resolveRaspberryCompany(raspberryId);
+    }
+    return piSocket.opcuaCompany;
+}
+
+async function piSocketDbName(piSocket, raspberryId) {
+    const company = await piSocketCompany(piSocket, raspberryId);
+    return company ? company.dbName : null;
+}
+
+// Configuration served to a Pi. version is a hash of the payload, used as the
+// ETag of GET /api/opcua/config and announced in 'config_changed' events.
+async function buildRaspberryConfig(db, raspberryId) {
+    const config = await db.collection('opcua_config').findOne({ raspberryId });
+    
+    if (!config) {
+        return { status: 404, body: { error: 'Configuration not found' } };
+    }
+    
+    if (!config.enabled) {
+        return { status: 403, body: { error: 'Raspberry Pi is disabled' } };
+    }
+    
+    // Get enabled datapoints to monitor
+    const datapoints = await db.collection('opcua_datapoints')
+        .find({ raspberryId, enabled: true })
+        .sort({ equipmentId: 1, sortOrder: 1 })
+        .toArray();
+    
+    // Multi-server Pis: each datapoint belongs to the OPC UA server of its equipment (null = primary server)
+    const servers = config.opcua_servers || [];
+    const equipmentServers = new Map();
+    if (servers.length) {
+        const serverIds = new Set(servers.map(server => server.id));
+        const equipment = await db.collection('opcua_equipment')
+            .find({ raspberryId }, { projection: { equipmentId: 1, opcuaServerId: 1 } })
+            .toArray();
+        equipment
+            .filter(eq => serverIds.has(eq.opcuaServerId))
+            .forEach(eq => equipmentServers.set(eq.equipmentId, eq.opcuaServerId));
+    }
+    
+    const payload = {
+        config: {
+            raspberryId: config.raspberryId,
+            raspberryName: config.raspberryName,
+            opcua_server_ip: config.opcua_server_ip,
+            opcua_server_port: config.opcua_server_port,
+            poll_interval: config.poll_interval,
+            acquisition_mode: config.acquisition_mode || 'subscription',
+            coalesce_mode: config.coalesce_mode || 'all',
+            monitoring_rules: config.monitoring_rules || [],
+            max_items_per_subscription: config.max_items_per_subscription,
+            connection_timeout: config.connection_timeout,
+            ...(servers.length ? { opcua_servers: servers } : {})
+        },
+        datapoints: datapoints.map(dp => ({
+            id: dp._id,
+            equipmentId: dp.equipmentId,
+            opcNodeId: dp.opcNodeId,
+            label: dp.label,
+            dataType: dp.dataType,
+            deadbandType: dp.deadbandType || 'none',
+            deadbandValue: dp.deadbandValue || 0,
+            trigger: dp.trigger || 'StatusValue',
+            queueSize: dp.queueSize || 0,
+            rateClass: dp.rateClass || 'auto',
+            ...(servers.length ? { serverId: equipmentServers.get(dp.equipmentId) || null } : {})
+        }))
+    };
+    
+    const version = crypto.createHash('sha1').update(JSON.stringify(payload)).digest('hex');
+    return { status: 200, version, body: { success: true, version, ...payload } };
+}
+
+// Tell a connected Pi its configuration may have changed; it refetches only if its version is stale
+async function notifyConfigChanged(raspberryId, dbName) {
+    const piSocket = raspberryId && raspberrySockets.get(raspberryId);
+    if (!piSocket) {
+        return;
+    }
+    
+    try {
+        dbName = dbName || await piSocketDbName(piSocket, raspberryId);
+        if (!dbName) {
+            return;
+        }
+        
+        const { version } = await buildRaspberryConfig(mongoClient.db(dbName), raspberryId);
+        piSocket.emit('config_changed', { raspberryId, version: version || null });
+        console.log(`📣 config_changed sent to ${raspberryId} (version ${version || 'none'})`);
+    } catch (error) {
+        console.error(`❌ Failed to notify ${raspberryId} of config change:`, error.message);
+    }
+}
+
+// Send the current watch set to a connected Pi
+async function pushWatchSet(raspberryId) {
+    const piSocket = raspberryId && raspberrySockets.get(raspberryId);
+    if (!piSocket) {
+        return;
+    }
+    
+    try {
+        const nodeIds = new Set();
+        (opcuaWatchers.get(raspberryId) || new Map()).forEach(watched => {
+            watched.forEach(opcNodeId => nodeIds.add(opcNodeId));
+        });
+        
+        const dbName = await piSocketDbName(piSocket, raspberryId);
+        if (dbName) {
+            const pinned = await mongoClient.db(dbName).collection('opcua_conversions')
+                .find({ raspberryId, opcNodeId: { $ne: null } }, { projection: { opcNodeId: 1 } })
+                .toArray();
+            pinned.forEach(conversion => nodeIds.add(conversion.opcNodeId));
+        }
+        
+        piSocket.emit('opcua_watch_set', { raspberryId, nodeIds: Array.from(nodeIds) });
+        console.log(`👀 Watch set for ${raspberryId}: ${nodeIds.size} discovered node(s)`);
+    } catch (error) {
+        console.error(`❌ Failed to push watch set to ${raspberryId}:`, error.message);
+    }
+}
+
+// Replace everything a page socket watches; returns the Pis whose watch set changed
+function setSocketWatches(socketId, nodes) {
+    const byRaspberry = new Map();
+    (nodes || []).forEach(node => {
+        if (node && node.raspberryId && node.opcNodeId) {
+            if (!byRaspberry.has(node.raspberryId)) {
+                byRaspberry.set(node.raspberryId, new Set());
+            }
+            byRaspberry.get(node.raspberryId).add(node.opcNodeId);
+        }
+    });
+    
+    const affected = new Set(byRaspberry.keys());
+    opcuaWatchers.forEach((watchers, raspberryId) => {
+        if (watchers.delete(socketId)) {
+            affected.add(raspberryId);
+        }
+        if (watchers.size === 0) {
+            opcuaWatchers.delete(raspberryId);
+        }
+    });
+    
+    byRaspberry.forEach((watched, raspberryId) => {
+        if (!opcuaWatchers.has(raspberryId)) {
+            opcuaWatchers.set(raspberryId, new Map());
+        }
+        opcuaWatchers.get(raspberryId).set(socketId, watched);
+    });
+    return affected;
+}
+
 // � Socket.IO Connection Handler
 io.on('connection', (socket) => {
     console.log('📱 ESP32 device connected:', socket.id);
@@ -4980,12 +5303,33 @@ io.on('connection', (socket) => {
         }
     });
     
+    // Admin page reports the discovered nodes it displays: { nodes: [{ raspberryId, opcNodeId }] } (empty = none)
+    socket.on('opcua_watch', (data = {}) => {
+        const affected = setSocketWatches(socket.id, data.nodes);
+        affected.forEach(raspberryId => pushWatchSet(raspberryId));
+    });
+    
     // Handle Raspberry Pi registration
     socket.on('raspberry_register', async (data) => {
         console.log('🥧 Raspberry Pi registered:', data);
         socket.raspberryId = data.raspberryId;
         socket.clientType = 'raspberry';
         
+        if (data.status === 'offline') {
+            raspberrySockets.delete(data.raspberryId);
+        } else {
+            raspberrySockets.set(data.raspberryId, socket);
+            pushWatchSet(data.raspberryId);
+            
+            // Binary uplink when both sides support it; the node dictionary lives as long as this socket
+            const encoding = Array.isArray(data.encodings) && data.encodings.includes(UPLINK_ENCODING)
+                ? UPLINK_ENCODING : null;
+            socket.uplinkNodes = new Map();
+            socket.emit('uplink_encoding', { encoding });
+            // Catch up on config edits made while the Pi was disconnected
+            notifyConfigChanged(data.raspberryId);
+        }
+        
         // Update status in MongoDB
         try {
             const db = mongoClient.db(DB_NAME);
@@ -5017,58 +5361,64 @@ io.on('connection', (socket) => {
     });
     
     // Handle OPC UA data changes from Raspberry Pi (real-time via WebSocket)
-    socket.on('opcua_data_change', async (data) => {
+    socket.on('opcua_data_change', async (data, ack) => {
         console.log('📊 OPC UA data change from Raspberry Pi:', socket.raspberryId || socket.id);
         
+        // Sequenced messages are acknowledged once stored; retry tells the Pi to send again
+        const acknowledge = (response) => {
+            if (typeof ack === 'function') {
+                ack({ seq: data && data.seq, ...response });
+            }
+        };
+        
         try {
-            const { raspberryId, equipmentId, data: datapoints, discovered_nodes } = data;
+            if (Buffer.isBuffer(data)) {
+                // Columnar MessagePack frame (negotiated in raspberry_register)
+                socket.uplinkNodes = socket.uplinkNodes || new Map();
+                const decoded = decodeUplinkFrame(data, socket.uplinkNodes);
+                data = { raspberryId: decoded.raspberryId, epoch: decoded.epoch, seq: decoded.seq, data: decoded.items };
+            }
+            
+            const { raspberryId, equipmentId, data: datapoints, discovered_nodes, epoch } = data;
             const deviceId = raspberryId; // device_id from Raspberry Pi
+            const messageKey = uplinkMessageKey(data);
             
-            // Handle discovered nodes (from discovered_nodes key)
-            const nodesToProcess = datapoints || discovered_nodes || [];
+            let nodesToProcess;
+            if (Array.isArray(data.equipment)) {
+                // Batched frame: configured datapoints grouped by equipment, indexed by
+                // [equipmentId, start, count] entries, plus all discovered nodes
+                const configured = datapoints || [];
+                data.equipment.forEach(([groupEquipmentId, start, count]) => {
+                    configured.slice(start, start + count).forEach(item => {
+                        item.equipmentId = groupEquipmentId;
+                    });
+                });
+                nodesToProcess = configured.concat(discovered_nodes || []);
+            } else {
+                // One message per equipment, or one for discovered nodes (older Pi clients)
+                nodesToProcess = datapoints || discovered_nodes || [];
+            }
             
             if (!deviceId || nodesToProcess.length === 0) {
                 console.error('❌ Invalid opcua_data_change payload - no deviceId or data');
+                acknowledge({ success: false, error: 'Invalid payload' });
                 return;
             }
             
-            // Find which company/database this device belongs to
-            // First try deviceInfo collection (new system)
-            let dbName = null;
-            let company = null;
-            
-            // Check all possible companies by looking at deviceInfo
-            const masterDB = mongoClient.db(DB_NAME);
-            const masterUsers = await masterDB.collection(COLLECTION_NAME).find({}).toArray();
-            
-            for (const user of masterUsers) {
-                const testDb = mongoClient.db(user.company || user.dbName);
-                const device = await testDb.collection('deviceInfo').findOne({ device_id: deviceId });
-                
-                if (device) {
-                    dbName = user.company || user.dbName;
-                    company = user.company;
-                    console.log(`✅ Found device ${deviceId} in company: ${company}`);
-                    break;
-                }
+            if (isDuplicateUplink(deviceId, epoch, messageKey)) {
+                console.log(`♻️  Duplicate batch ${messageKey} from ${deviceId} ignored`);
+                acknowledge({ success: true, duplicate: true });
+                return;
             }
             
-            // Fallback: Try old devices structure
-            if (!dbName) {
-                const user = await masterDB.collection(COLLECTION_NAME).findOne({
-                    'devices': {
-                        $elemMatch: { uniqueId: deviceId }
-                    }
-                });
-                
-                if (user) {
-                    dbName = user.dbName;
-                    company = user.company;
-                }
-            }
+            // Find which company/database this device belongs to (cached on the Pi's socket)
+            const owner = await piSocketCompany(socket, deviceId);
+            const dbName = owner ? owner.dbName : null;
+            const company = owner ? owner.company : null;
             
             if (!dbName) {
                 console.error(`❌ Device ${deviceId} not found in any company database`);
+                acknowledge({ success: false, error: 'Unknown device' });
                 return;
             }
             
@@ -5079,6 +5429,7 @@ io.on('connection', (socket) => {
             const discoveredNodesData = nodesToProcess.filter(item => !item.datapointId || !item.equipmentId);
             
             // Save configured datapoints to MongoDB (async, non-blocking)
+            let realtimeSaved = Promise.resolve(true);
             if (configuredDatapoints.length > 0) {
                 const bulkOps = configuredDatapoints.map(item => ({
                     updateOne: {
@@ -5097,6 +5448,7 @@ io.on('connection', (socket) => {
                                 valueString: String(item.value),
                                 quality: item.quality || 'Good',
                                 sourceTimestamp: item.timestamp,
+                                ...coalescedFields(item),
                                 receivedAt: new Date().toISOString(),
                                 updatedAt: new Date().toISOString()
                             }
@@ -5105,9 +5457,10 @@ io.on('connection', (socket) => {
                     }
                 }));
                 
-                // Save to MongoDB in background (don't await - non-blocking)
-                db.collection('opcua_realtime').bulkWrite(bulkOps).catch(err => {
+                // Save to MongoDB in background (awaited only before acknowledging)
+                realtimeSaved = db.collection('opcua_realtime').bulkWrite(bulkOps).then(() => true, err => {
                     console.error('❌ Error saving OPC UA data to MongoDB:', err.message);
+                    return false;
                 });
             }
             
@@ -5124,36 +5477,43 @@ io.on('connection', (socket) => {
             });
             
             // Update all nodes (both configured and discovered) in opcua_discovered_nodes
-            const allNodesUpdates = [];
-            nodesToProcess.forEach(item => {
-                allNodesUpdates.push(
-                    db.collection('opcua_discovered_nodes').updateOne(
-                        { 
-                            raspberryId: deviceId,
-                            opcNodeId: item.opcNodeId 
-                        },
-                        {
-                            $set: {
-                                value: item.value,
-                                currentValue: typeof item.value === 'object' ? JSON.stringify(item.value) : String(item.value),
-                                updatedAt: new Date().toISOString()
-                            }
+            const allNodesUpdates = nodesToProcess.map(item => ({
+                updateOne: {
+                    filter: { 
+                        raspberryId: deviceId,
+                        opcNodeId: item.opcNodeId 
+                    },
+                    update: {
+                        $set: {
+                            value: item.value,
+                            currentValue: typeof item.value === 'object' ? JSON.stringify(item.value) : String(item.value),
+                            updatedAt: new Date().toISOString()
                         }
-                    )
-                );
-            });
+                    }
+                }
+            }));
             
             // Wait for all nodes to be updated
-            await Promise.all(allNodesUpdates).catch(err => {
+            await db.collection('opcua_discovered_nodes').bulkWrite(allNodesUpdates, { ordered: false }).catch(err => {
                 console.error('❌ Error updating discovered nodes:', err.message);
             });
             
+            // Stored - acknowledge before broadcasting (a failed save is sent again by the Pi)
+            if (await realtimeSaved) {
+                markUplinkProcessed(deviceId, epoch, messageKey);
+                acknowledge({ success: true });
+            } else {
+                acknowledge({ success: false, retry: true, error: 'Failed to save data' });
+                return;
+            }
+            
             // Broadcast to company room for OPC Management page
             const broadcastData = {
                 device_id: deviceId,
                 raspberryId: deviceId, // backward compatibility
                 equipmentId,
                 data: nodesToProcess.map(item => ({
+                    equipmentId: item.equipmentId,
                     datapointId: item.datapointId,
                     opcNodeId: item.opcNodeId,
                     value: item.value,
@@ -5188,6 +5548,7 @@ io.on('connection', (socket) => {
         } catch (error) {
             console.error('❌ Error handling OPC UA data change:', error.message);
             console.error(error.stack);
+            acknowledge({ success: false, retry: true, resync: Boolean(error.resync), error: error.message });
         }
     });
     
@@ -5397,6 +5758,12 @@ io.on('connection', (socket) => {
             await updateDeviceStatus(socket.deviceId, 'offline');
         }
         
+        // Drop this page's watched nodes (Pis may unsubscribe after their linger timeout)
+        setSocketWatches(socket.id, []).forEach(raspberryId => pushWatchSet(raspberryId));
+        if (socket.raspberryId && raspberrySockets.get(socket.raspberryId) === socket) {
+            raspberrySockets.delete(socket.raspberryId);
+        }
+        
         // Mark Raspberry Pi as offline
         if (socket.raspberryId) {
             try {
@@ -5644,41 +6011,21 @@ app.get('/api/opcua/config/:raspberryId', validateRaspberryPi, async (req, res)
         const { raspberryId, dbName } = req;
         const db = mongoClient.db(dbName);
         
-        // Get Raspberry Pi configuration
-        const config = await db.collection('opcua_config').findOne({ raspberryId });
+        const result = await buildRaspberryConfig(db, raspberryId);
         
-        if (!config) {
-            return res.status(404).json({ error: 'Configuration not found' });
+        if (result.status !== 200) {
+            return res.status(result.status).json(result.body);
         }
         
-        if (!config.enabled) {
-            return res.status(403).json({ error: 'Raspberry Pi is disabled' });
+        // Conditional GET: the Pi sends the version it already applied
+        const etag = `"${result.version}"`;
+        res.set('ETag', etag);
+        res.set('Cache-Control', 'no-cache');
+        if (req.headers['if-none-match'] === etag) {
+            return res.status(304).end();
         }
         
-        // Get enabled datapoints to monitor
-        const datapoints = await db.collection('opcua_datapoints')
-            .find({ raspberryId, enabled: true })
-            .sort({ equipmentId: 1, sortOrder: 1 })
-            .toArray();
-        
-        res.json({
-            success: true,
-            config: {
-                raspberryId: config.raspberryId,
-                raspberryName: config.raspberryName,
-                opcua_server_ip: config.opcua_server_ip,
-                opcua_server_port: config.opcua_server_port,
-                poll_interval: config.poll_interval,
-                connection_timeout: config.connection_timeout
-            },
-            datapoints: datapoints.map(dp => ({
-                id: dp._id,
-                equipmentId: dp.equipmentId,
-                opcNodeId: dp.opcNodeId,
-                label: dp.label,
-                dataType: dp.dataType
-            }))
-        });
+        res.json(result.body);
         
         console.log(`📡 Config fetched for Raspberry Pi: ${raspberryId}`);
         
@@ -5919,17 +6266,25 @@ app.get('/api/deviceInfo/:deviceId/opcua-data', async (req, res) => {
 app.post('/api/opcua/heartbeat', validateRaspberryPi, async (req, res) => {
     try {
         const { raspberryId, dbName } = req;
-        const { status } = req.body;
+        const { status, uplink, opcuaServers } = req.body;
         const db = mongoClient.db(dbName);
         
+        const heartbeat = {
+            status: status || 'online',
+            lastHeartbeat: new Date().toISOString()
+        };
+        // HTTP transport counters (requests, connections, handshakes avoided)
+        if (uplink && typeof uplink === 'object') {
+            heartbeat.uplinkStats = uplink;
+        }
+        // Per-server connection state of multi-server Pis
+        if (Array.isArray(opcuaServers)) {
+            heartbeat.opcuaServerStatus = opcuaServers;
+        }
+        
         await db.collection('opcua_config').updateOne(
             { raspberryId },
-            {
-                $set: {
-                    status: status || 'online',
-                    lastHeartbeat: new Date().toISOString()
-                }
-            }
+            { $set: heartbeat }
         );
         
         res.json({ success: true });
@@ -5940,17 +6295,44 @@ app.post('/api/opcua/heartbeat', validateRaspberryPi, async (req, res) => {
     }
 });
 
+// Extra realtime fields sent by the Pi in 'latest-plus-count' coalescing mode
+function coalescedFields(item) {
+    if (item.changeCount === undefined) {
+        return {};
+    }
+    const fields = { changeCount: item.changeCount };
+    if (item.minValue !== undefined) {
+        fields.minValue = item.minValue;
+        fields.maxValue = item.maxValue;
+    }
+    return fields;
+}
+
 // POST /api/opcua/data - Push real-time data from Raspberry Pi
-app.post('/api/opcua/data', validateRaspberryPi, async (req, res) => {
+app.post('/api/opcua/data', express.raw({ type: 'application/x-msgpack', limit: '10mb' }), validateRaspberryPi, async (req, res) => {
     try {
         const { raspberryId, dbName } = req;
-        const { data } = req.body; // Array of mixed items: configured datapoints OR discovered nodes
+        
+        let body = req.body;
+        if (Buffer.isBuffer(req.body)) {
+            // Columnar MessagePack frame (self-contained node dictionary)
+            const decoded = decodeUplinkFrame(req.body, new Map());
+            body = { epoch: decoded.epoch, seq: decoded.seq, data: decoded.items };
+        }
+        
+        const { data, epoch } = body; // Array of mixed items: configured datapoints OR discovered nodes
         const db = mongoClient.db(dbName);
         
         if (!Array.isArray(data) || data.length === 0) {
             return res.status(400).json({ error: 'Invalid data format' });
         }
         
+        // Batch already delivered (e.g. over the WebSocket before its ack was lost)
+        const messageKey = uplinkMessageKey(body);
+        if (isDuplicateUplink(raspberryId, epoch, messageKey)) {
+            return res.json({ success: true, duplicate: true, received: 0 });
+        }
+        
         // Separate configured datapoints from discovered nodes
         const configuredDatapoints = [];
         const discoveredNodes = [];
@@ -5979,6 +6361,7 @@ app.post('/api/opcua/data', validateRaspberryPi, async (req, res) => {
                             valueString: String(item.value),
                             quality: item.quality || 'Good',
                             sourceTimestamp: item.timestamp,
+                            ...coalescedFields(item),
                             receivedAt: new Date().toISOString(),
                             updatedAt: new Date().toISOString()
                         }
@@ -6039,6 +6422,8 @@ app.post('/api/opcua/data', validateRaspberryPi, async (req, res) => {
             });
         }
         
+        markUplinkProcessed(raspberryId, epoch, messageKey);
+        
         // Broadcast real-time updates to all subscribed tablets
         await broadcastVariablesToAllTablets(dbName);
         
@@ -6167,42 +6552,109 @@ app.get('/api/opcua/discovered-arrays', async (req, res) => {
     }
 });
 
+// Build the stored document fields for one discovered node
+function buildDiscoveredNodeFields(raspberryId, node, timestamp, version) {
+    let currentValue = node.currentValue;
+    if (currentValue === undefined) {
+        // Protocol 2 clients only send `value`; derive the preview string here
+        currentValue = Array.isArray(node.value) ? JSON.stringify(node.value) : String(node.value);
+        if (!Array.isArray(node.value) && currentValue.length > 1000) {
+            currentValue = currentValue.slice(0, 997) + '...';
+        }
+    }
+    
+    return {
+        raspberryId,
+        namespace: node.namespace,
+        variableName: node.variableName,
+        browseName: node.browseName,
+        opcNodeId: node.opcNodeId,
+        serverId: node.serverId || null,  // Set for nodes of a Pi's non-primary OPC UA servers (opcNodeId is then "<serverId>|<NodeId>")
+        dataType: node.dataType,
+        opcDataType: node.opcDataType || null,  // OPC UA DataType attribute (e.g. Int16, Boolean)
+        type: node.type || 'unknown',  // list, number, string, boolean
+        value: node.value,  // Full value including arrays
+        currentValue,
+        discoveredAt: timestamp,
+        discoveryVersion: version
+    };
+}
+
 // POST /api/opcua/discovered-nodes - Save discovered nodes from Raspberry Pi
+// Body (protocol 2): { mode: 'full', version, nodes } or
+//                    { mode: 'delta', baseVersion, version, added, changed, removed }
+// Legacy body: { nodes } (treated as a full upload)
 app.post('/api/opcua/discovered-nodes', validateRaspberryPi, async (req, res) => {
     try {
         const { raspberryId, dbName } = req;
-        const { nodes, timestamp } = req.body;
+        const { mode, baseVersion, added, changed, removed, timestamp } = req.body;
+        const nodes = req.body.nodes;
+        const version = req.body.version || `legacy-${Date.now()}`;
+        const db = mongoClient.db(dbName);
+        const collection = db.collection('opcua_discovered_nodes');
+        
+        if (mode === 'delta') {
+            if (!Array.isArray(added) || !Array.isArray(changed) || !Array.isArray(removed)) {
+                return res.status(400).json({ error: 'Invalid delta data' });
+            }
+            
+            // A delta only applies on top of the snapshot the client last had acknowledged
+            const config = await db.collection('opcua_config').findOne({ raspberryId }, { projection: { discoveryVersion: 1 } });
+            const currentVersion = config ? config.discoveryVersion : null;
+            if (!currentVersion || currentVersion !== baseVersion) {
+                return res.status(409).json({ success: false, error: 'version_mismatch', currentVersion: currentVersion || null });
+            }
+            
+            const bulkOps = [...added, ...changed].map(node => ({
+                updateOne: {
+                    filter: { raspberryId, opcNodeId: node.opcNodeId },
+                    update: {
+                        $set: { ...buildDiscoveredNodeFields(raspberryId, node, timestamp, version), updatedAt: new Date().toISOString() },
+                        $setOnInsert: { createdAt: new Date().toISOString() }
+                    },
+                    upsert: true
+                }
+            }));
+            
+            if (removed.length > 0) {
+                bulkOps.push({ deleteMany: { filter: { raspberryId, opcNodeId: { $in: removed } } } });
+            }
+            
+            if (bulkOps.length > 0) {
+                await collection.bulkWrite(bulkOps, { ordered: false });
+            }
+            
+            await db.collection('opcua_config').updateOne({ raspberryId }, { $set: { discoveryVersion: version } });
+            
+            console.log(`✅ Applied discovered nodes delta for ${raspberryId}: +${added.length} ~${changed.length} -${removed.length}`);
+            return res.json({ success: true, version, added: added.length, changed: changed.length, removed: removed.length });
+        }
         
         if (!nodes || !Array.isArray(nodes)) {
             return res.status(400).json({ error: 'Invalid nodes data' });
         }
         
-        const db = mongoClient.db(dbName);
-        
-        // Delete old discovered nodes for this Raspberry Pi
-        await db.collection('opcua_discovered_nodes').deleteMany({ raspberryId });
-        
-        // Insert new discovered nodes
-        const nodesToInsert = nodes.map(node => ({
-            raspberryId,
-            namespace: node.namespace,
-            variableName: node.variableName,
-            browseName: node.browseName,
-            opcNodeId: node.opcNodeId,
-            dataType: node.dataType,
-            type: node.type || 'unknown',  // list, number, string, boolean
-            value: node.value,  // Full value including arrays
-            currentValue: node.currentValue,
-            discoveredAt: timestamp,
-            createdAt: new Date().toISOString()
+        // Full upload: upsert everything tagged with the new version, then drop nodes
+        // from older versions (the collection is never empty in between)
+        const bulkOps = nodes.map(node => ({
+            updateOne: {
+                filter: { raspberryId, opcNodeId: node.opcNodeId },
+                update: {
+                    $set: { ...buildDiscoveredNodeFields(raspberryId, node, timestamp, version), updatedAt: new Date().toISOString() },
+                    $setOnInsert: { createdAt: new Date().toISOString() }
+                },
+                upsert: true
+            }
         }));
         
-        if (nodesToInsert.length > 0) {
-            await db.collection('opcua_discovered_nodes').insertMany(nodesToInsert);
+        if (bulkOps.length > 0) {
+            await collection.bulkWrite(bulkOps, { ordered: false });
         }
+        await collection.deleteMany({ raspberryId, discoveryVersion: { $ne: version } });
+        await db.collection('opcua_config').updateOne({ raspberryId }, { $set: { discoveryVersion: version } });
         
         console.log(`✅ Saved ${nodes.length} discovered nodes for ${raspberryId}`);
-        res.json({ success: true, count: nodes.length });
+        res.json({ success: true, count: nodes.length, version });
         
     } catch (error) {
         console.error('❌ Error saving discovered nodes:', error);
@@ -6276,7 +6728,7 @@ app.get('/api/opcua/admin/raspberries', validateAdminUser, async (req, res) => {
 app.post('/api/opcua/admin/raspberry', validateAdminUser, async (req, res) => {
     try {
         const { dbName, company } = req;
-        const { raspberryId, raspberryName, opcua_server_ip, opcua_server_port, poll_interval, enabled } = req.body;
+        const { raspberryId, raspberryName, opcua_server_ip, opcua_server_port, opcua_servers, poll_interval, acquisition_mode, coalesce_mode, monitoring_rules, enabled } = req.body;
         const db = mongoClient.db(dbName);
         
         // Validate raspberryId exists in masterUsers.devices
@@ -6305,17 +6757,59 @@ app.post('/api/opcua/admin/raspberry', validateAdminUser, async (req, res) => {
             updatedAt: new Date().toISOString()
         };
         
+        // 'poll' for PLCs with poor subscription support (only replaced when sent; new Pis subscribe)
+        const insertDefaults = { createdAt: new Date().toISOString() };
+        if (acquisition_mode !== undefined) {
+            configData.acquisition_mode = acquisition_mode === 'poll' ? 'poll' : 'subscription';
+        } else {
+            insertDefaults.acquisition_mode = 'subscription';
+        }
+        
+        // Realtime flush coalescing on the Pi (only replaced when sent; new Pis send every change)
+        if (coalesce_mode !== undefined) {
+            configData.coalesce_mode = ['latest-per-node', 'latest-plus-count'].includes(coalesce_mode) ? coalesce_mode : 'all';
+        } else {
+            insertDefaults.coalesce_mode = 'all';
+        }
+        
+        // Deadband/trigger/queue size for discovered nodes by NodeId pattern (only replaced when sent)
+        if (Array.isArray(monitoring_rules)) {
+            configData.monitoring_rules = monitoring_rules
+                .filter(rule => rule && rule.pattern)
+                .map(rule => ({ pattern: String(rule.pattern), ...monitoringFields(rule) }));
+        }
+        
+        // Several PLCs monitored by one Pi (only replaced when sent); the first entry is the primary server
+        if (Array.isArray(opcua_servers)) {
+            configData.opcua_servers = opcuaServerEntries(opcua_servers, configData.connection_timeout);
+            if (configData.opcua_servers.length) {
+                configData.opcua_server_ip = configData.opcua_servers[0].ip;
+                configData.opcua_server_port = configData.opcua_servers[0].port;
+            }
+        } else if (opcua_server_ip) {
+            // Legacy ip/port edit of a multi-server Pi: move the primary entry along so both stay in step
+            const existing = await db.collection('opcua_config').findOne({ raspberryId }, { projection: { opcua_servers: 1 } });
+            if (existing && Array.isArray(existing.opcua_servers) && existing.opcua_servers.length) {
+                const [primary, ...others] = existing.opcua_servers;
+                configData.opcua_servers = [
+                    { ...primary, ip: configData.opcua_server_ip, port: parseInt(configData.opcua_server_port) || 4840 },
+                    ...others
+                ];
+            }
+        }
+        
         const result = await db.collection('opcua_config').updateOne(
             { raspberryId },
             {
                 $set: configData,
-                $setOnInsert: { createdAt: new Date().toISOString() }
+                $setOnInsert: insertDefaults
             },
             { upsert: true }
         );
         
         res.json({ success: true, raspberryId, isNew: result.upsertedCount > 0 });
         console.log(`✅ Raspberry Pi config saved: ${raspberryId}`);
+        notifyConfigChanged(raspberryId, dbName);
         
     } catch (error) {
         console.error('❌ Error saving raspberry config:', error);
@@ -6323,6 +6817,24 @@ app.post('/api/opcua/admin/raspberry', validateAdminUser, async (req, res) => {
     }
 });
 
+// Sanitize a Pi's OPC UA server list: ids are unique and never contain '|' (the Pi's node key separator)
+function opcuaServerEntries(servers, connectionTimeout) {
+    const seen = new Set();
+    return servers
+        .filter(server => server && server.ip)
+        .map(server => {
+            const port = parseInt(server.port) || 4840;
+            return {
+                id: String(server.id || `${server.ip}:${port}`).replace(/\|/g, '-'),
+                name: server.name ? String(server.name) : `${server.ip}:${port}`,
+                ip: String(server.ip),
+                port,
+                connection_timeout: parseInt(server.connection_timeout) || connectionTimeout
+            };
+        })
+        .filter(server => !seen.has(server.id) && seen.add(server.id));
+}
+
 // DELETE /api/opcua/admin/raspberry/:raspberryId - Remove Raspberry Pi
 app.delete('/api/opcua/admin/raspberry/:raspberryId', validateAdminUser, async (req, res) => {
     try {
@@ -6340,6 +6852,7 @@ app.delete('/api/opcua/admin/raspberry/:raspberryId', validateAdminUser, async (
         
         res.json({ success: true });
         console.log(`🗑️  Raspberry Pi deleted: ${raspberryId}`);
+        notifyConfigChanged(raspberryId, dbName);
         
     } catch (error) {
         console.error('❌ Error deleting raspberry:', error);
@@ -6371,7 +6884,7 @@ app.get('/api/opcua/admin/equipment/:raspberryId', validateAdminUser, async (req
 app.post('/api/opcua/admin/equipment', validateAdminUser, async (req, res) => {
     try {
         const { dbName } = req;
-        const { raspberryId, equipmentId, displayName, description, category, location, sortOrder, enabled } = req.body;
+        const { raspberryId, equipmentId, displayName, description, category, location, sortOrder, enabled, opcuaServerId } = req.body;
         const db = mongoClient.db(dbName);
         
         const equipmentData = {
@@ -6385,6 +6898,10 @@ app.post('/api/opcua/admin/equipment', validateAdminUser, async (req, res) => {
             enabled: enabled !== false,
             updatedAt: new Date().toISOString()
         };
+        // OPC UA server of its datapoints on multi-server Pis (null = primary; only replaced when sent)
+        if (opcuaServerId !== undefined) {
+            equipmentData.opcuaServerId = opcuaServerId || null;
+        }
         
         const result = await db.collection('opcua_equipment').updateOne(
             { raspberryId, equipmentId },
@@ -6396,6 +6913,7 @@ app.post('/api/opcua/admin/equipment', validateAdminUser, async (req, res) => {
         );
         
         res.json({ success: true, equipmentId, isNew: result.upsertedCount > 0 });
+        notifyConfigChanged(raspberryId, dbName);
         
     } catch (error) {
         console.error('❌ Error saving equipment:', error);
@@ -6410,6 +6928,8 @@ app.delete('/api/opcua/admin/equipment/:equipmentId', validateAdminUser, async (
         const { equipmentId } = req.params;
         const db = mongoClient.db(dbName);
         
+        const equipment = await db.collection('opcua_equipment').findOne({ equipmentId });
+        
         // Delete equipment and its datapoints
         await Promise.all([
             db.collection('opcua_equipment').deleteOne({ equipmentId }),
@@ -6418,6 +6938,9 @@ app.delete('/api/opcua/admin/equipment/:equipmentId', validateAdminUser, async (
         ]);
         
         res.json({ success: true });
+        if (equipment) {
+            notifyConfigChanged(equipment.raspberryId, dbName);
+        }
         
     } catch (error) {
         console.error('❌ Error deleting equipment:', error);
@@ -6445,6 +6968,31 @@ app.get('/api/opcua/admin/datapoints/:equipmentId', validateAdminUser, async (re
     }
 });
 
+// Monitoring parameters the Pi applies as OPC UA DataChangeFilters (only fields present in src)
+const DEADBAND_TYPES = ['none', 'absolute', 'percent'];
+const DATA_CHANGE_TRIGGERS = ['Status', 'StatusValue', 'StatusValueTimestamp'];
+const RATE_CLASSES = ['auto', 'fast', 'normal', 'slow']; // 'auto' = assigned by the Pi from observed change rate
+
+function monitoringFields(src) {
+    const fields = {};
+    if (src.deadbandType !== undefined) {
+        fields.deadbandType = DEADBAND_TYPES.includes(src.deadbandType) ? src.deadbandType : 'none';
+    }
+    if (src.deadbandValue !== undefined) {
+        fields.deadbandValue = Math.max(0, Number(src.deadbandValue) || 0);
+    }
+    if (src.trigger !== undefined) {
+        fields.trigger = DATA_CHANGE_TRIGGERS.includes(src.trigger) ? src.trigger : 'StatusValue';
+    }
+    if (src.queueSize !== undefined) {
+        fields.queueSize = Math.max(0, parseInt(src.queueSize) || 0);
+    }
+    if (src.rateClass !== undefined) {
+        fields.rateClass = RATE_CLASSES.includes(src.rateClass) ? src.rateClass : 'auto';
+    }
+    return fields;
+}
+
 // POST /api/opcua/admin/datapoints - Add/update datapoint
 app.post('/api/opcua/admin/datapoints', validateAdminUser, async (req, res) => {
     try {
@@ -6468,6 +7016,7 @@ app.post('/api/opcua/admin/datapoints', validateAdminUser, async (req, res) => {
             enabled: enabled !== false,
             alertEnabled: false,
             alertCondition: null,
+            ...monitoringFields(req.body),
             updatedAt: new Date().toISOString()
         };
         
@@ -6485,6 +7034,7 @@ app.post('/api/opcua/admin/datapoints', validateAdminUser, async (req, res) => {
             datapointId: result.upsertedId || opcNodeId, 
             isNew: result.upsertedCount > 0 
         });
+        notifyConfigChanged(raspberryId, dbName);
         
     } catch (error) {
         console.error('❌ Error saving datapoint:', error);
@@ -6501,7 +7051,7 @@ app.put('/api/opcua/admin/datapoints/:id/toggle', validateAdminUser, async (req,
         const db = mongoClient.db(dbName);
         const { ObjectId } = require('mongodb');
         
-        await db.collection('opcua_datapoints').updateOne(
+        const datapoint = await db.collection('opcua_datapoints').findOneAndUpdate(
             { _id: new ObjectId(id) },
             {
                 $set: {
@@ -6512,6 +7062,9 @@ app.put('/api/opcua/admin/datapoints/:id/toggle', validateAdminUser, async (req,
         );
         
         res.json({ success: true });
+        if (datapoint) {
+            notifyConfigChanged(datapoint.raspberryId, dbName);
+        }
         
     } catch (error) {
         console.error('❌ Error toggling datapoint:', error);
@@ -6865,6 +7418,7 @@ app.post('/api/opcua/conversions', async (req, res) => {
         const result = await db.collection('opcua_conversions').insertOne(conversion);
         
         console.log(`✅ Created variable: ${variableName} (${sourceType}) from device ${raspberryId || 'unknown'}, opcNodeId: ${opcNodeId || 'N/A'}`);
+        pushWatchSet(raspberryId); // Variable source nodes are always monitored
         res.json({ success: true, conversionId: result.insertedId, conversion });
         
     } catch (error) {
@@ -7443,6 +7997,9 @@ app.delete('/api/opcua/conversions/:id', async (req, res) => {
         }
         
         console.log(`🗑️ Deleted variable: ${id}`);
+        if (variable) {
+            pushWatchSet(variable.raspberryId);
+        }
         res.json({ success: true, message: 'Variable deleted successfully' });
         
     } catch (error) {
@@ -189,6 +189,10 @@ function initializeWebSocket() {
             
             // Join company room
             window.opcSocket.emit('join', { room: `opcua_${COMPANY}` });
+            
+            // Server forgets watched nodes on disconnect - report them again
+            lastWatchKey = null;
+            emitWatchSet();
         });
         
         window.opcSocket.on('disconnect', () => {
@@ -212,9 +216,28 @@ function initializeWebSocket() {
         updateConnectionStatus(window.opcSocket.connected);
         // Re-join company room
         window.opcSocket.emit('join', { room: `opcua_${COMPANY}` });
+        emitWatchSet();
     }
 }
 
+// Tell the server which discovered nodes this page displays (the Pi only monitors watched nodes)
+let lastWatchKey = null;
+function emitWatchSet() {
+    if (!window.opcSocket || !window.opcSocket.connected) return;
+    
+    const cache = window.opcManagementState.rawDataCache;
+    const datapoints = (currentRaspberryId && cache && cache.datapoints) || [];
+    const nodes = datapoints
+        .filter(dp => dp.opcNodeId)
+        .map(dp => ({ raspberryId: currentRaspberryId, opcNodeId: dp.opcNodeId }));
+    
+    const watchKey = JSON.stringify(nodes);
+    if (watchKey === lastWatchKey) return;
+    lastWatchKey = watchKey;
+    
+    window.opcSocket.emit('opcua_watch', { company: COMPANY, nodes });
+}
+
 // Update connection status indicator
 function updateConnectionStatus(connected) {
     const statusEl = document.getElementById('opc-connection-status');
@@ -290,6 +313,7 @@ async function handleRaspberryChange(e) {
     } else {
         localStorage.removeItem('opcLastSelectedDevice');
         clearDataDisplay();
+        emitWatchSet();
     }
 }
 
@@ -303,6 +327,7 @@ async function loadRealTimeData(deviceId) {
             window.opcManagementState.rawDataCache = data;
             rawDataCache = data;
             renderRealTimeData(data);
+            emitWatchSet();
         } else {
             showNotification(t('opcManagement.failedToLoadData') + ': ' + (data.error || t('opcManagement.unknown')), 'error');
         }
@@ -8,6 +8,7 @@ let currentRaspberryFilter = null;
 let currentEquipmentFilter = null;
 
 // Store loaded data for editing
+let raspberriesData = [];
 let equipmentData = [];
 let datapointsData = [];
 
@@ -133,6 +134,9 @@ async function loadRaspberries() {
 }
 
 function renderRaspberries(raspberries) {
+    // Store raspberry data for editing
+    raspberriesData = raspberries;
+    
     const container = document.getElementById('raspberry-list');
     
     if (raspberries.length === 0) {
@@ -184,10 +188,26 @@ function openRaspberryModal(raspberryId = null) {
     const form = document.getElementById('raspberry-form');
     form.reset();
     
+    document.getElementById('raspberry-id').readOnly = !!raspberryId;
+    
     if (raspberryId) {
-        // Load existing raspberry data
         document.getElementById('raspberry-modal-title').textContent = 'Edit Raspberry Pi';
-        // TODO: Load and populate form
+        
+        // Find and populate existing raspberry data (saving posts every field, so nothing may fall back to a default)
+        const rpi = raspberriesData.find(r => r.raspberryId === raspberryId);
+        if (rpi) {
+            document.getElementById('raspberry-id').value = rpi.raspberryId || '';
+            document.getElementById('raspberry-name').value = rpi.raspberryName || '';
+            document.getElementById('opcua-ip').value = rpi.opcua_server_ip || '';
+            document.getElementById('opcua-port').value = rpi.opcua_server_port || 4840;
+            document.getElementById('poll-interval').value = rpi.poll_interval || 5000;
+            document.getElementById('acquisition-mode').value = rpi.acquisition_mode === 'poll' ? 'poll' : 'subscription';
+            document.getElementById('coalesce-mode').value =
+                ['latest-per-node', 'latest-plus-count'].includes(rpi.coalesce_mode) ? rpi.coalesce_mode : 'all';
+            document.getElementById('opcua-servers').value = (rpi.opcua_servers || []).slice(1)
+                .map(server => [server.id, server.name, server.ip, server.port].join(', ')).join('\n');
+            document.getElementById('raspberry-enabled').checked = rpi.enabled !== false;
+        }
     } else {
         document.getElementById('raspberry-modal-title').textContent = 'Add Raspberry Pi';
     }
@@ -195,6 +215,14 @@ function openRaspberryModal(raspberryId = null) {
     modal.classList.add('show');
 }
 
+// "id, name, ip, port" lines of the additional servers field -> opcua_servers entries
+function parseOpcuaServers(text) {
+    return text.split('\n')
+        .map(line => line.split(',').map(part => part.trim()))
+        .filter(parts => parts.length >= 3 && parts[2])
+        .map(([id, name, ip, port]) => ({ id: id || undefined, name: name || undefined, ip, port: parseInt(port) || 4840 }));
+}
+
 async function saveRaspberry() {
     const formData = {
         raspberryId: document.getElementById('raspberry-id').value,
@@ -202,9 +230,23 @@ async function saveRaspberry() {
         opcua_server_ip: document.getElementById('opcua-ip').value,
         opcua_server_port: parseInt(document.getElementById('opcua-port').value),
         poll_interval: parseInt(document.getElementById('poll-interval').value),
+        acquisition_mode: document.getElementById('acquisition-mode').value,
+        coalesce_mode: document.getElementById('coalesce-mode').value,
         enabled: document.getElementById('raspberry-enabled').checked
     };
     
+    // Multi-server Pis: the fields above are opcua_servers[0]; its id stays stable so equipment keeps its server
+    const rpi = raspberriesData.find(r => r.raspberryId === formData.raspberryId);
+    const storedServers = (rpi && rpi.opcua_servers) || [];
+    const additionalServers = parseOpcuaServers(document.getElementById('opcua-servers').value);
+    if (additionalServers.length || storedServers.length) {
+        const primary = { ip: formData.opcua_server_ip, port: formData.opcua_server_port };
+        if (storedServers.length) {
+            Object.assign(primary, { id: storedServers[0].id, name: storedServers[0].name });
+        }
+        formData.opcua_servers = [primary, ...additionalServers];
+    }
+    
     try {
         const response = await fetch(`${API_BASE}/api/opcua/admin/raspberry`, {
             method: 'POST',
@@ -296,6 +338,7 @@ async function loadRaspberryFilters() {
         const data = await response.json();
         
         if (data.success) {
+            raspberriesData = data.raspberries;
             const select = document.getElementById('equipment-raspberry-filter');
             select.innerHTML = '<option value="">Select Raspberry Pi...</option>' +
                 data.raspberries.map(rpi => 
@@ -378,6 +421,14 @@ function openEquipmentModal(equipmentId = null) {
     
     document.getElementById('equipment-raspberry-id').value = currentRaspberryFilter;
     
+    // Servers other than the primary one (equipment without opcuaServerId is read from the primary)
+    const rpi = raspberriesData.find(r => r.raspberryId === currentRaspberryFilter);
+    const serverSelect = document.getElementById('equipment-opcua-server');
+    serverSelect.innerHTML = '<option value="">Primary server</option>' +
+        ((rpi && rpi.opcua_servers) || []).slice(1).map(server =>
+            `<option value="${server.id}">${server.name} (${server.ip}:${server.port})</option>`
+        ).join('');
+    
     if (equipmentId) {
         document.getElementById('equipment-modal-title').textContent = 'Edit Equipment';
         
@@ -391,6 +442,7 @@ function openEquipmentModal(equipmentId = null) {
             document.getElementById('equipment-location').value = equipment.location || '';
             document.getElementById('equipment-sort-order').value = equipment.sortOrder || 0;
             document.getElementById('equipment-enabled').checked = equipment.enabled !== false;
+            serverSelect.value = equipment.opcuaServerId || '';
         }
     } else {
         document.getElementById('equipment-modal-title').textContent = 'Add Equipment';
@@ -408,6 +460,7 @@ async function saveEquipment() {
         category: document.getElementById('equipment-category').value,
         location: document.getElementById('equipment-location').value,
         sortOrder: parseInt(document.getElementById('equipment-sort-order').value),
+        opcuaServerId: document.getElementById('equipment-opcua-server').value || null,
         enabled: document.getElementById('equipment-enabled').checked
     };
     
@@ -664,6 +717,11 @@ function openDatapointModal(datapointId = null) {
             document.getElementById('datapoint-unit').value = datapoint.unit || '';
             document.getElementById('datapoint-display-format').value = datapoint.displayFormat || 'Number';
             document.getElementById('datapoint-sort-order').value = datapoint.sortOrder || 0;
+            document.getElementById('datapoint-deadband-type').value = datapoint.deadbandType || 'none';
+            document.getElementById('datapoint-deadband-value').value = datapoint.deadbandValue || 0;
+            document.getElementById('datapoint-trigger').value = datapoint.trigger || 'StatusValue';
+            document.getElementById('datapoint-queue-size').value = datapoint.queueSize || 0;
+            document.getElementById('datapoint-rate-class').value = datapoint.rateClass || 'auto';
             document.getElementById('datapoint-enabled').checked = datapoint.enabled !== false;
             
             // Store the datapoint ID for updating
@@ -688,6 +746,11 @@ async function saveDatapoint() {
         unit: document.getElementById('datapoint-unit').value,
         displayFormat: document.getElementById('datapoint-display-format').value,
         sortOrder: parseInt(document.getElementById('datapoint-sort-order').value),
+        deadbandType: document.getElementById('datapoint-deadband-type').value,
+        deadbandValue: parseFloat(document.getElementById('datapoint-deadband-value').value) || 0,
+        trigger: document.getElementById('datapoint-trigger').value,
+        queueSize: parseInt(document.getElementById('datapoint-queue-size').value) || 0,
+        rateClass: document.getElementById('datapoint-rate-class').value,
         enabled: document.getElementById('datapoint-enabled').checked
     };
     
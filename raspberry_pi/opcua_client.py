@@ -14,14 +14,33 @@ IMPORTANT: Set your Raspberry Pi's unique ID below
 import time
 import requests
 import json
+import hashlib
+import random
+import fnmatch
+import zlib
+import concurrent.futures
+from itertools import chain
+from collections import namedtuple
 from datetime import datetime
-from opcua import Client
+from opcua import Client, ua
+from opcua.client.client import KeepAlive
+from opcua.common.subscription import Subscription
+from opcua.ua.ua_binary import struct_from_binary
 import sys
+import os
+import sqlite3
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 import socket
 import socketio
+import msgpack
 import threading
+from collections import deque, Counter, OrderedDict
+
+try:
+    import zstandard  # Optional: zstd request compression (gzip is used without it)
+except ImportError:
+    zstandard = None
 
 # ==========================================
 # CONFIGURATION - EDIT THIS
@@ -44,17 +63,110 @@ DEVICE_INFO_ENDPOINT = f"{API_BASE_URL}/api/opcua/device-info"
 COMPANY_NAME = "KSG"
 DEVICE_OWNER = "kasugai"
 DEVICE_TYPE = "Raspberry Pi"
-DEVICE_BRAND = "Raspberry Pi"sudo journalctl -u opcua-client -f
+DEVICE_BRAND = "Raspberry Pi"
 
 # Timing Configuration
 HEARTBEAT_INTERVAL = 30  # Send heartbeat every 30 seconds
 RETRY_INTERVAL = 60      # Retry connection every 60 seconds on failure
 NODE_DISCOVERY_TIME = "07:00"  # Daily discovery at 7am
-SUBSCRIPTION_INTERVAL = 100  # Check for data changes every 100ms
+# Subscription rate classes: publishing/sampling interval (ms) per class
+RATE_CLASSES = {
+    'fast': 50,      # Cycle/trigger bits
+    'normal': 500,   # Configured datapoints
+    'slow': 5000,    # Discovered-only nodes
+}
+RATE_CLASS_ORDER = ('fast', 'normal', 'slow')
+
+# Notification Pipeline Configuration
+NOTIFICATION_QUEUE_MAX = 50000     # Max notifications waiting for the worker (newest dropped beyond this)
+NOTIFICATION_BATCH_MAX = 500       # Max notifications processed per worker wakeup
+NOTIFICATION_WORKER_IDLE = 0.05    # Worker wait timeout when queue is empty (seconds)
+OVERFLOW_REPORT_INTERVAL = 10      # Log queue overflow at most every 10 seconds
+
+# Bulk Service Configuration (used when the server reports 0 = no limit, or the limit can't be read)
+DEFAULT_MAX_MONITORED_ITEMS_PER_CALL = 1000
+DEFAULT_MAX_NODES_PER_READ = 500
+DEFAULT_MAX_NODES_PER_BROWSE = 500
+DISCOVERY_MAX_DEPTH = 10
+NODE_KEY_SEPARATOR = '|'  # <serverId>|<NodeId> keys nodes of every server but the first (multi-server configs)
+
+# Rate Class Configuration (datapoint / monitoring rule field rateClass; otherwise assigned from observed change rate)
+DEFAULT_MAX_ITEMS_PER_SUBSCRIPTION = 1000  # Split a class into more subscriptions beyond this (config max_items_per_subscription)
+SUBSCRIPTION_HANDLE_STRIDE = 1000000  # Client handle offset between subscriptions
+RATE_REVIEW_INTERVAL = 60      # Seconds between change-rate reviews
+RATE_PROMOTE_SATURATION = 0.5  # Promote one class when >= 50% of samples carried a change
+RATE_DEMOTE_SATURATION = 0.05  # Step back towards the default class when <= 5% did
+WATCH_LINGER = 60              # Seconds a discovered node stays monitored after its last viewer left
+
+# DataChangeFilter Configuration (datapoint / config['monitoring_rules'] fields deadbandType, deadbandValue, trigger, queueSize)
+DEADBAND_TYPES = ('none', 'absolute', 'percent')  # Index = OPC UA DeadbandType
+DATA_CHANGE_TRIGGERS = ('Status', 'StatusValue', 'StatusValueTimestamp')  # Index = OPC UA DataChangeTrigger
+# Create results meaning "this server/node can't apply the filter" -> recreate unfiltered, filter on the Pi
+FILTER_REJECTED_STATUSES = ('BadMonitoredItemFilterUnsupported', 'BadMonitoredItemFilterInvalid',
+                            'BadFilterNotAllowed', 'BadDeadbandFilterInvalid')
+
+# Polling Mode Configuration (config['acquisition_mode'] == 'poll', for servers with poor subscription support)
+DEFAULT_POLL_INTERVAL = 1000  # ms, used when config has no poll_interval
+MIN_POLL_INTERVAL = 100       # ms
+
+# Session Resumption (after a dropped connection, keep the session and its subscriptions instead of recreating them)
+# ResumableClient drives python-opcua's socket layer directly; False always takes the plain reconnect path
+SESSION_RESUME = True
+SESSION_RESUME_RETRY = 5           # Seconds between resume attempts while the server is unreachable...
+SESSION_RESUME_FAST_WINDOW = 120   # ...for this long after the drop, then every RETRY_INTERVAL
+REPUBLISH_MAX_MESSAGES = 1000      # Missed NotificationMessages fetched again per subscription after a resume
+
+# Discovered node fields compared for delta uploads (value changes flow through realtime updates)
+DISCOVERY_STRUCTURE_FIELDS = ('namespace', 'variableName', 'browseName', 'dataType', 'opcDataType', 'type')
 
-# Retry Configuration
-MAX_RETRY_ATTEMPTS = 3
-RETRY_DELAYS = [30, 60, 120]  # Exponential backoff: 30s, 1min, 2min
+# Server object nodes read for the address-space fingerprint (NamespaceArray + BuildInfo)
+FINGERPRINT_NODES = ['ns=0;i=2255', 'ns=0;i=2264', 'ns=0;i=2265', 'ns=0;i=2266']
+
+# ServerCapabilities.OperationLimits node ids (OPC UA Part 5)
+OPERATION_LIMIT_NODES = {
+    'MaxNodesPerRead': 'ns=0;i=11705',
+    'MaxNodesPerBrowse': 'ns=0;i=11710',
+    'MaxMonitoredItemsPerCall': 'ns=0;i=11714',
+}
+
+# Local State Configuration (survives service restarts)
+STATE_DIR = os.environ.get('OPCUA_STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state'))
+DISCOVERY_SNAPSHOT_FILE = os.path.join(STATE_DIR, 'discovered_nodes.json')
+DISCOVERY_VERIFY_DELAY = 120  # Seconds after a warm boot before the background verification browse
+
+# Uplink Spool Configuration (durable queue for data batches and events during WAN outages)
+SPOOL_FILE = os.path.join(STATE_DIR, 'uplink_spool.db')
+SPOOL_MAX_BYTES = 200 * 1024 * 1024  # Per stream; oldest records are dropped beyond this
+SPOOL_MAX_AGE = 7 * 24 * 3600        # Unsent records older than 7 days are dropped
+SPOOL_SYNC_COUNT = 200               # Commit (fsync) after this many appends...
+SPOOL_SYNC_INTERVAL = 1.0            # ...or this many seconds, whichever comes first
+SPOOL_RETENTION_INTERVAL = 60        # Prune acknowledged/expired records every minute
+SPOOL_DRAIN_BATCHES = 50             # Max data batches sent per drain pass
+
+# Retry Configuration (uplink calls run on the uploader thread, one attempt per breaker window)
+BACKOFF_BASE = 2                # Seconds; doubled per consecutive failure, jittered to 50-100%
+BACKOFF_MAX = 300               # Cap between attempts on a failing endpoint
+BREAKER_FAILURE_THRESHOLD = 3   # Consecutive failures before an endpoint's circuit opens
+RETRY_BUDGET_TOKENS = 20        # Retries allowed in a burst across all endpoints...
+RETRY_BUDGET_REFILL = 0.2       # ...refilled at one token every 5 seconds
+UPLOADER_IDLE = 0.5             # Uploader wakeup interval when nobody signals it
+WS_INFLIGHT_WINDOW = 8          # Data batches sent over the WebSocket awaiting the server's ack
+WS_ACK_TIMEOUT = 10             # Seconds before an unacknowledged batch is sent again
+
+# HTTP transport (one pooled keep-alive session for every uplink call)
+HTTP_POOL_SIZE = 4              # Keep-alive connections kept open to the API host
+HTTP_CONNECT_TIMEOUT = 5        # Seconds to establish TCP+TLS
+HTTP_READ_TIMEOUTS = {          # Seconds to wait for the response, per endpoint (circuit breaker names)
+    'config': 10, 'data': 10, 'events': 10, 'heartbeat': 5, 'device_info': 10, 'discovered_nodes': 30
+}
+HTTP_RESET_AFTER_FAILURES = 3   # Drop pooled connections after this many consecutive connection errors
+
+# Uplink wire format (negotiated with the server at WebSocket registration)
+UPLINK_ENCODING = 'msgpack-columnar'  # Binary columnar frames (JSON when the server doesn't accept them)
+QUALITY_CODES = ('Good', 'Uncertain', 'Bad')  # Index = quality enum on the wire
+HTTP_COMPRESS_THRESHOLD = 1024      # Bytes; smaller request bodies are sent uncompressed
+HTTP_STREAM_CHUNK = 64 * 1024       # JSON is serialized and compressed in pieces of this size
+HTTP_CODEC_PREFERENCE = ('zstd', 'gzip')  # Request-body codecs, best first
 
 # Logging Configuration
 logging.basicConfig(
@@ -68,53 +180,264 @@ logger = logging.getLogger(__name__)
 # ==========================================
 
 opcua_client = None
+operation_limits = {}  # Server OperationLimits read at connect time (0 = no limit)
 config = None
 datapoints = []
 last_heartbeat = 0
 last_config_fetch = 0
-CONFIG_REFRESH_INTERVAL = 300  # Refresh config every 5 minutes
+config_version = None  # Version (ETag) of the last fetched config, sent as If-None-Match
+CONFIG_REFRESH_INTERVAL = 300  # Refresh config every 5 minutes while the WebSocket is down
+CONFIG_PUSH_REFRESH_INTERVAL = 3600  # Safety-net refresh while the server pushes 'config_changed'
 
 # Subscription management
-subscription = None
-subscription_handles = []
-changed_data_buffer = []  # Buffer for changed values
+applied_config_hash = None  # Hash of the config/datapoints currently applied to the subscription
+applied_connection_key = None  # (ip, port, timeout) the current OPC UA session was opened with
+primary_server_id = None  # First server in the config; its NodeIds are used without a server prefix
+unmonitored_servers = []  # Configured servers other than the primary, which this runtime doesn't connect to
 discovered_nodes_cache = []  # Cache of all discovered nodes for subscription
 
 # WebSocket connection
 sio = socketio.Client(reconnection=True, reconnection_attempts=0, reconnection_delay=5)
 websocket_connected = False
+ws_uplink_encoding = None  # Encoding the server accepted on the current connection (None = JSON)
+http_uplink_encoding = None  # Last encoding the server accepted, kept for the HTTP fallback
+http_codec = None  # Request-body compression the server accepts (from its Accept-Encoding response header)
 
 # Pending operations for retry
 pending_discovered_nodes = None
-pending_data_queue = []
+discovery_lock = threading.Lock()  # Only one discovery (boot verification, daily job, retry) at a time
+acquisition_lock = threading.RLock()  # Serializes subscription setup/reconcile/teardown across threads
+discovery_snapshot = None  # Last persisted discovery snapshot (see save_discovery_snapshot)
+discovery_ack = {'version': None, 'index': {}}  # Last server-acknowledged discovery: version + {node_id: digest}
 device_info_uploaded = False  # Track if device info has been uploaded
 
 # Event logging configuration
-EVENT_BUFFER_MAX = 1000  # Maximum events in buffer
 EVENT_FLUSH_INTERVAL = 10  # Flush every 10 seconds
 EVENT_FLUSH_COUNT = 100  # Or when 100 events accumulated
+EVENT_UPLOAD_BATCH = 500  # Max events per upload request
+EVENT_FLUSH_MAX_BATCHES = 10  # Max requests per flush (backlog drains over several flushes)
+
+# Flush scheduler configuration (max time a change may wait before it is spooled and sent)
+FLUSH_LATENCY = {
+    'data': 0.05,                    # Configured datapoints (line dashboards)
+    'discovered': 1.0,               # Discovered node value updates
+    'events': EVENT_FLUSH_INTERVAL,  # Event log
+}
+FLUSH_MAX_COUNT = 1000  # Flush early once this many changes are buffered...
+FLUSH_MAX_BYTES = 256 * 1024  # ...or roughly this much payload
+# Realtime coalescing (config['coalesce_mode']); the event log always keeps every change
+#   all               - every change is sent
+#   latest-per-node   - only the newest value per node within a flush window
+#   latest-plus-count - newest value plus changeCount and minValue/maxValue (numeric values)
+COALESCE_MODES = ('all', 'latest-per-node', 'latest-plus-count')
 EVENT_LOG_ENDPOINT = f"{API_BASE_URL}/api/opcua/event-log"
 
-# Event logging state
-event_buffer = []  # Buffer for event logs
+# Event logging state (events themselves are queued in uplink_spool)
 last_values = {}  # Track previous values for change detection
 last_event_flush = 0
 opcua_connection_status = 'Unknown'  # Unknown, Connected, Disconnected
 last_connection_check = 0
+session_lost_at = None  # When the current OPC UA connection dropped (None = up); cleared by resume or disconnect
+last_resume_attempt = 0
+lost_session_token = None  # Authentication token of the session that dropped, captured with session_lost_at
+last_spool_retention = 0
+last_rate_review = 0
 CONNECTION_CHECK_INTERVAL = 30  # Check connection health every 30 seconds
 
+# ==========================================
+# DURABLE UPLINK SPOOL
+# ==========================================
+
+class UplinkSpool:
+    """
+    Durable write-ahead queue for uplink data and events (SQLite in WAL mode).
+    Records are appended per stream ('data' batches, 'events') and read back in
+    order from an acknowledged cursor, so nothing is held in RAM while the WAN
+    is down and a restart resumes where the uploader left off.
+    Appends are committed in batches (SPOOL_SYNC_COUNT / SPOOL_SYNC_INTERVAL)
+    to keep fsyncs off the hot path; acknowledged rows and rows beyond the
+    size/age retention limits are pruned by enforce_retention().
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._in_txn = False
+        self._pending = 0
+        self._txn_started = 0
+        self._cursors = {}  # stream -> acked id
+        self._backlog = {}  # stream -> [unacked count, unacked bytes]
+        self.dropped = Counter()  # stream -> records dropped by retention
+        self.epoch = None  # Random id of this spool database; record ids are only unique within it
+
+    def _db(self):
+        if self._conn is None:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute('PRAGMA synchronous=FULL')
+            except Exception as e:
+                # Read-only or broken SD card: keep running with a volatile spool
+                logger.error(f"❌ Cannot open uplink spool {self.path}, using memory only: {e}")
+                self._conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+            
+            self._conn.execute('CREATE TABLE IF NOT EXISTS spool ('
+                               'id INTEGER PRIMARY KEY AUTOINCREMENT, stream TEXT NOT NULL, '
+                               'created REAL NOT NULL, size INTEGER NOT NULL, payload TEXT NOT NULL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS spool_stream_id ON spool (stream, id)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cursors (stream TEXT PRIMARY KEY, acked_id INTEGER NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()
+            if row:
+                self.epoch = row[0]
+            else:
+                self.epoch = '%012x' % random.getrandbits(48)
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('epoch', ?)", (self.epoch,))
+            
+            self._cursors = dict(self._conn.execute('SELECT stream, acked_id FROM cursors').fetchall())
+            for stream, in self._conn.execute('SELECT DISTINCT stream FROM spool').fetchall():
+                count, size = self._conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE stream = ? AND id > ?',
+                    (stream, self._cursors.get(stream, 0))).fetchone()
+                self._backlog[stream] = [count, size]
+            
+            if self._backlog:
+                logger.info(f"💾 Uplink spool opened with backlog: "
+                            f"{ {stream: count for stream, (count, _) in self._backlog.items()} }")
+        return self._conn
+
+    def _begin(self, conn):
+        if not self._in_txn:
+            conn.execute('BEGIN')
+            self._in_txn = True
+            self._txn_started = time.time()
+
+    def append(self, stream, record):
+        """Append one record (JSON-serializable) to a stream"""
+        payload = json.dumps(record, default=str)
+        with self._lock:
+            conn = self._db()
+            self._begin(conn)
+            conn.execute('INSERT INTO spool (stream, created, size, payload) VALUES (?, ?, ?, ?)',
+                         (stream, time.time(), len(payload), payload))
+            backlog = self._backlog.setdefault(stream, [0, 0])
+            backlog[0] += 1
+            backlog[1] += len(payload)
+            self._pending += 1
+            if self._pending >= SPOOL_SYNC_COUNT:
+                self.sync()
+        
+        if backlog[1] > SPOOL_MAX_BYTES:
+            self.enforce_retention()
+
+    def sync(self, force=False):
+        """Commit (fsync) pending appends/acks if the batch is due"""
+        with self._lock:
+            if not self._in_txn:
+                return
+            if force or self._pending >= SPOOL_SYNC_COUNT or (time.time() - self._txn_started) >= SPOOL_SYNC_INTERVAL:
+                self._conn.execute('COMMIT')
+                self._in_txn = False
+                self._pending = 0
+
+    def read(self, stream, limit):
+        """Oldest unacknowledged records: [(id, record)]"""
+        with self._lock:
+            rows = self._db().execute(
+                'SELECT id, payload FROM spool WHERE stream = ? AND id > ? ORDER BY id LIMIT ?',
+                (stream, self._cursors.get(stream, 0), limit)).fetchall()
+        return [(entry_id, json.loads(payload)) for entry_id, payload in rows]
+
+    def ack(self, stream, last_id):
+        """Advance the stream's acknowledged cursor up to last_id (inclusive)"""
+        with self._lock:
+            conn = self._db()
+            acked = self._cursors.get(stream, 0)
+            if last_id <= acked:
+                return
+            count, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE stream = ? AND id > ? AND id <= ?',
+                (stream, acked, last_id)).fetchone()
+            self._begin(conn)
+            conn.execute('INSERT OR REPLACE INTO cursors (stream, acked_id) VALUES (?, ?)', (stream, last_id))
+            self._cursors[stream] = last_id
+            backlog = self._backlog.setdefault(stream, [0, 0])
+            backlog[0] = max(0, backlog[0] - count)
+            backlog[1] = max(0, backlog[1] - size)
+            self._pending += 1
+
+    def backlog(self, stream):
+        """Number of unacknowledged records in a stream"""
+        with self._lock:
+            self._db()
+            return self._backlog.get(stream, [0, 0])[0]
+
+    def enforce_retention(self):
+        """Prune acknowledged rows, then drop the oldest unacked rows beyond age/size limits"""
+        with self._lock:
+            conn = self._db()
+            self.sync(force=True)
+            conn.execute('BEGIN')
+            try:
+                for stream, acked in self._cursors.items():
+                    conn.execute('DELETE FROM spool WHERE stream = ? AND id <= ?', (stream, acked))
+                
+                for stream, backlog in self._backlog.items():
+                    acked = self._cursors.get(stream, 0)
+                    cutoff = time.time() - SPOOL_MAX_AGE
+                    expired, expired_size = conn.execute(
+                        'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool WHERE stream = ? AND id > ? AND created < ?',
+                        (stream, acked, cutoff)).fetchone()
+                    if expired:
+                        conn.execute('DELETE FROM spool WHERE stream = ? AND created < ?', (stream, cutoff))
+                        backlog[0] -= expired
+                        backlog[1] -= expired_size
+                        self.dropped[stream] += expired
+                        logger.warning(f"⚠️  Uplink spool: dropped {expired} '{stream}' record(s) older than {SPOOL_MAX_AGE}s")
+                    
+                    # Oldest-first eviction until the stream fits its size budget
+                    while backlog[1] > SPOOL_MAX_BYTES and backlog[0] > 0:
+                        rows = conn.execute(
+                            'SELECT id, size FROM spool WHERE stream = ? AND id > ? ORDER BY id LIMIT 500',
+                            (stream, self._cursors.get(stream, 0))).fetchall()
+                        if not rows:
+                            break
+                        evict = []
+                        for entry_id, size in rows:
+                            evict.append(entry_id)
+                            backlog[0] -= 1
+                            backlog[1] -= size
+                            if backlog[1] <= SPOOL_MAX_BYTES:
+                                break
+                        conn.execute('DELETE FROM spool WHERE stream = ? AND id <= ?', (stream, evict[-1]))
+                        self.dropped[stream] += len(evict)
+                        logger.warning(f"⚠️  Uplink spool over {SPOOL_MAX_BYTES} bytes: dropped {len(evict)} oldest '{stream}' record(s)")
+                conn.execute('COMMIT')
+            except Exception as e:
+                conn.execute('ROLLBACK')
+                logger.error(f"❌ Uplink spool retention failed: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self.sync(force=True)
+                self._conn.close()
+                self._conn = None
+
+uplink_spool = UplinkSpool(SPOOL_FILE)
+
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
 
 def log_event(event_type, opc_node_id=None, variable_name=None, old_value=None, new_value=None, quality='Good', message='', metadata=None):
     """
-    Add an event to the event buffer for batch upload.
+    Add an event to the durable uplink spool for batch upload.
     
     Event types: value_change, node_discovered, connection_lost, connection_restored, quality_degraded
     """
-    global event_buffer
-    
     try:
         event = {
             'device_id': RASPBERRY_ID,
@@ -130,73 +453,81 @@ def log_event(event_type, opc_node_id=None, variable_name=None, old_value=None,
             'metadata': metadata or {}
         }
         
-        # Add to buffer
-        if len(event_buffer) >= EVENT_BUFFER_MAX:
-            # Buffer full, remove oldest event
-            logger.warning(f"⚠️  Event buffer full ({EVENT_BUFFER_MAX}), dropping oldest event")
-            event_buffer.pop(0)
-        
-        event_buffer.append(event)
-        
-        # Immediate flush for critical events
-        if event_type in ['connection_lost', 'connection_restored']:
-            flush_event_buffer(force=True)
+        spool_event(event)
         
     except Exception as e:
         logger.error(f"❌ Failed to log event: {e}")
 
+def spool_event(event):
+    """Queue a built event for upload (also used for events forwarded by shard workers)"""
+    uplink_spool.append('events', event)
+    
+    # Immediate flush for critical events (done by the uploader thread)
+    if event['eventType'] in ['connection_lost', 'connection_restored']:
+        uploader.wake(flush_events=True)
+    else:
+        flush_scheduler.note_event()
+
 def flush_event_buffer(force=False):
     """
-    Flush event buffer to backend API.
+    Flush spooled events to backend API, oldest first (uploader thread).
     Called every 10 seconds or when 100 events accumulated, or immediately for critical events.
+    Events are only removed from the spool once the server acknowledged them.
     """
-    global event_buffer, last_event_flush
+    global last_event_flush
     
     current_time = time.time()
+    backlog = uplink_spool.backlog('events')
     
     # Check if we should flush
     should_flush = force or \
-                   len(event_buffer) >= EVENT_FLUSH_COUNT or \
-                   (len(event_buffer) > 0 and (current_time - last_event_flush) >= EVENT_FLUSH_INTERVAL)
+                   backlog >= EVENT_FLUSH_COUNT or \
+                   (backlog > 0 and (current_time - last_event_flush) >= EVENT_FLUSH_INTERVAL)
     
-    if not should_flush or len(event_buffer) == 0:
+    if not should_flush or backlog == 0:
         return
     
-    try:
-        # Get events to flush
-        events_to_flush = event_buffer.copy()
-        event_buffer.clear()
-        last_event_flush = current_time
-        
-        # Send to backend
-        headers = {
-            'X-Raspberry-ID': RASPBERRY_ID,
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
-            'raspberryId': RASPBERRY_ID,
-            'events': events_to_flush
-        }
-        
-        response = requests.post(EVENT_LOG_ENDPOINT, json=payload, headers=headers, timeout=10)
+    breaker = circuit_breakers['events']
+    if not breaker.allow():
+        return
+    
+    last_event_flush = current_time
+    
+    headers = {
+        'X-Raspberry-ID': RASPBERRY_ID,
+        'Content-Type': 'application/json'
+    }
+    
+    for _ in range(EVENT_FLUSH_MAX_BATCHES):
+        entries = uplink_spool.read('events', EVENT_UPLOAD_BATCH)
+        if not entries:
+            break
         
-        if response.status_code == 200:
+        try:
+            payload = {
+                'raspberryId': RASPBERRY_ID,
+                'events': [event for _, event in entries]
+            }
+            
+            response = post_uplink('events', EVENT_LOG_ENDPOINT, headers, payload)
+            
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code}, keeping {backlog} events spooled")
+            
             result = response.json()
-            if result.get('success'):
-                logger.info(f"📝 Flushed {len(events_to_flush)} events to log")
-            else:
-                # Put events back if upload failed
-                logger.warning(f"⚠️  Event log upload failed: {result.get('error')}")
-                event_buffer = events_to_flush + event_buffer
-        else:
-            logger.warning(f"⚠️  Event log HTTP {response.status_code}, re-buffering events")
-            event_buffer = events_to_flush + event_buffer
+            if not result.get('success'):
+                raise Exception(result.get('error'))
             
-    except Exception as e:
-        logger.error(f"❌ Failed to flush events: {e}")
-        # Put events back on error
-        event_buffer = events_to_flush + event_buffer
+            uplink_spool.ack('events', entries[-1][0])
+            breaker.record(True)
+            logger.info(f"📝 Flushed {len(entries)} events to log")
+            
+        except Exception as e:
+            breaker.record(False, e)
+            break
+        
+        if len(entries) < EVENT_UPLOAD_BATCH:
+            break
 
 def check_connection_health():
     """
@@ -258,26 +589,6 @@ def check_connection_health():
         logger.error(f"❌ Connection health check failed: {e}")
         return False
 
-def retry_with_backoff(func, *args, **kwargs):
-    """
-    Retry a function with exponential backoff
-    Returns (success: bool, result: any)
-    """
-    for attempt in range(MAX_RETRY_ATTEMPTS):
-        try:
-            result = func(*args, **kwargs)
-            return True, result
-        except Exception as e:
-            if attempt < MAX_RETRY_ATTEMPTS - 1:
-                delay = RETRY_DELAYS[attempt]
-                logger.warning(f"⚠️  Attempt {attempt + 1} failed: {e}")
-                logger.info(f"🔄 Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                logger.error(f"❌ All {MAX_RETRY_ATTEMPTS} attempts failed: {e}")
-                return False, None
-    return False, None
-
 def get_local_ip():
     """Get local IP address"""
     try:
@@ -331,7 +642,7 @@ def upload_device_info():
             'Content-Type': 'application/json'
         }
         
-        response = requests.post(DEVICE_INFO_ENDPOINT, json=device_info, headers=headers, timeout=10)
+        response = post_uplink('device_info', DEVICE_INFO_ENDPOINT, headers, device_info)
         logger.info(f"   Response status: {response.status_code}")
         
         if response.status_code == 503:
@@ -371,18 +682,24 @@ def connect():
     websocket_connected = True
     logger.info(f"🔌 WebSocket connected to {API_BASE_URL}")
     
-    # Send initial device info
+    # Send initial device info (and the uplink encodings we can produce)
     sio.emit('raspberry_register', {
         'raspberryId': RASPBERRY_ID,
         'status': 'online',
+        'encodings': [UPLINK_ENCODING],
         'timestamp': datetime.utcnow().isoformat() + 'Z'
     })
+    
+    # Retransmit batches left unacknowledged on the previous connection
+    data_window.resend_all()
+    uploader.wake()
 
 @sio.event
 def disconnect():
     """WebSocket disconnected"""
-    global websocket_connected
+    global websocket_connected, ws_uplink_encoding
     websocket_connected = False
+    ws_uplink_encoding = None  # Renegotiated (with a fresh node dictionary) on reconnect
     logger.warning("⚠️  WebSocket disconnected")
 
 @sio.event
@@ -395,6 +712,35 @@ def raspberry_status_update(data):
     """Receive status update from server"""
     logger.debug(f"📡 Status update from server: {data}")
 
+@sio.on('uplink_encoding')
+def uplink_encoding(data):
+    """Server's answer to the encodings offered in raspberry_register"""
+    global ws_uplink_encoding, http_uplink_encoding
+    encoding = (data or {}).get('encoding')
+    if encoding != UPLINK_ENCODING:
+        encoding = None
+    uplink_encoder.reset()
+    ws_uplink_encoding = http_uplink_encoding = encoding
+    logger.info(f"📦 Uplink encoding: {encoding or 'json'}")
+
+@sio.on('config_changed')
+def config_changed(data):
+    """Server-side config edit; fetch only if the announced version isn't the one we have"""
+    version = (data or {}).get('version')
+    if version and version == config_version:
+        logger.debug(f"Configuration version {version[:8]} already applied")
+        return
+    logger.info("📣 Configuration changed on server, fetching...")
+    uploader.request_config()
+
+@sio.on('opcua_watch_set')
+def opcua_watch_set(data):
+    """Discovered nodes currently shown by a dashboard (or pinned by a saved variable)"""
+    node_ids = (data or {}).get('nodeIds')
+    if isinstance(node_ids, list):
+        watch_set.update(node_ids)
+        logger.debug(f"👀 Watch set from server: {len(node_ids)} node(s)")
+
 def start_websocket():
     """Start WebSocket connection in background thread"""
     def connect_websocket():
@@ -424,202 +770,2026 @@ def stop_websocket():
         logger.debug(f"Error disconnecting WebSocket: {e}")
 
 # ==========================================
-# SUBSCRIPTION HANDLER
+# HTTP TRANSPORT
 # ==========================================
 
-class DataChangeHandler:
+class UplinkTransport:
     """
-    Handler for OPC UA subscription data changes.
-    Only triggers when values actually change.
-    Tracks previous values and logs all changes to event log.
+    Shared requests.Session for all uplink calls, so TCP+TLS handshakes are
+    paid once per pooled connection instead of once per request.
+    Responses are read completely (no stream=True) before a connection goes
+    back to the pool, so it is only ever reused for the next request, never
+    pipelined. Retries are left to the circuit breakers (max_retries=0).
+    Consecutive connection errors (e.g. a NAT dropping idle sockets) reset
+    the pool; stats() reports requests, connections opened and the
+    handshakes avoided by reuse.
     """
     def __init__(self):
-        self.datapoint_map = {}  # Maps monitored item handle to datapoint info
-    
-    def datachange_notification(self, node, val, data):
-        """Called when subscribed node value changes"""
-        global last_values
-        
+        self.lock = threading.Lock()
+        self.session = None
+        self.adapter = None
+        self.requests = 0  # Attempted, including failed ones
+        self.closed_connections = 0  # Connections opened by pools that were reset
+        self.consecutive_failures = 0
+        self.resets = 0
+        self.last_success = None
+
+    def _session(self):
+        with self.lock:
+            if self.session is None:
+                self.adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE,
+                                                             max_retries=0)
+                self.session = requests.Session()
+                self.session.mount('https://', self.adapter)
+                self.session.mount('http://', self.adapter)
+                self.session.headers.update({'X-Raspberry-ID': RASPBERRY_ID})
+            return self.session
+
+    def _opened_connections(self):
+        """Connections opened by the current session's pools"""
+        if self.adapter is None:
+            return 0
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def request(self, method, endpoint, url, **kwargs):
+        """Send one request with the endpoint's timeouts; raises like requests does"""
+        session = self._session()
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUTS[endpoint]))
+        self.requests += 1
         try:
-            # Find which datapoint this belongs to
-            node_id = node.nodeid.to_string()
-            
-            # Determine quality status
-            status_code = data.monitored_item.Value.StatusCode
-            quality = 'Good' if status_code.is_good() else ('Uncertain' if status_code.is_uncertain() else 'Bad')
-            
-            # Check if this is a configured datapoint
-            matching_datapoint = None
-            for dp in datapoints:
-                if dp['opcNodeId'] == node_id:
-                    matching_datapoint = dp
-                    break
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= HTTP_RESET_AFTER_FAILURES:
+                logger.warning(f"🔌 Resetting HTTP connection pool after {self.consecutive_failures} connection errors")
+                self.reset()
+            raise
+        
+        self.consecutive_failures = 0
+        self.last_success = time.time()
+        return response
+
+    def reset(self):
+        """Close pooled connections; the next request starts a fresh session"""
+        with self.lock:
+            if self.session is None:
+                return
+            self.closed_connections += self._opened_connections()
+            self.session.close()
+            self.session = None
+            self.adapter = None
+            self.resets += 1
+            self.consecutive_failures = 0
+
+    def stats(self):
+        with self.lock:
+            connections = self.closed_connections + self._opened_connections()
+        return {
+            'requests': self.requests,
+            'connections': connections,
+            'handshakesAvoided': max(0, self.requests - connections),
+            'poolResets': self.resets,
+            'lastSuccess': datetime.utcfromtimestamp(self.last_success).isoformat() + 'Z' if self.last_success else None
+        }
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+                self.adapter = None
+
+transport = UplinkTransport()
+
+# ==========================================
+# UPLINK ENCODING
+# ==========================================
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+def _epoch_ms(timestamp):
+    """ISO-8601 UTC timestamp ('...Z') -> integer epoch milliseconds (None if unparseable)"""
+    try:
+        return int((datetime.fromisoformat(timestamp.rstrip('Z')) - UNIX_EPOCH).total_seconds() * 1000)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class ColumnarEncoder:
+    """
+    MessagePack columnar encoding of data batches (UPLINK_ENCODING).
+    A frame carries parallel columns instead of one dict per change:
+    'node' indexes into a node dictionary (opcNodeId, datapointId,
+    equipmentId), 'ts' is epoch milliseconds, 'quality' indexes
+    QUALITY_CODES and 'cols' holds value plus any other item fields.
+    Dictionary entries are sent once per WebSocket session in 'defs';
+    reset() starts over (new connection, or the server lost track).
+    Stateless frames (HTTP) define every node they use.
+    """
+    IDENTITY_FIELDS = ('opcNodeId', 'datapointId', 'equipmentId')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}  # (opcNodeId, datapointId, equipmentId) -> index
+
+    def reset(self):
+        with self.lock:
+            self.nodes = {}
+
+    def encode(self, data, header, stateless=False):
+        """Pack a batch of change dicts into one binary frame; header is merged into the frame"""
+        with self.lock:
+            nodes = {} if stateless else self.nodes
+            defs = []
+            node_column = []
+            columns = {'value': []}
             
-            if matching_datapoint:
-                # This is a configured datapoint - send via normal data channel
-                variable_name = matching_datapoint.get('label', node_id)
-                
-                # Get previous value for logging
-                old_value = last_values.get(node_id)
-                
-                # Prepare data for WebSocket push
-                changed_data = {
-                    'datapointId': str(matching_datapoint['id']),
-                    'equipmentId': matching_datapoint['equipmentId'],
-                    'opcNodeId': matching_datapoint['opcNodeId'],
-                    'value': val,
-                    'quality': quality,
-                    'timestamp': datetime.utcnow().isoformat() + 'Z'
-                }
-                
-                # Add to buffer for batch upload
-                changed_data_buffer.append(changed_data)
-                
-                # Only log event if value actually changed (or if it's the first value)
-                if old_value is None or old_value != val:
-                    log_event(
-                        event_type='value_change' if quality == 'Good' else 'quality_degraded',
-                        opc_node_id=node_id,
-                        variable_name=variable_name,
-                        old_value=old_value,
-                        new_value=val,
-                        quality=quality,
-                        message=f"Value changed from {old_value} to {val}" if old_value is not None else f"Initial value: {val}",
-                        metadata={
-                            'dataType': type(val).__name__,
-                            'equipmentId': matching_datapoint['equipmentId'],
-                            'datapointId': str(matching_datapoint['id'])
-                        }
-                    )
-                else:
-                    # Value didn't change, only log if quality degraded
-                    if quality != 'Good':
-                        log_event(
-                            event_type='quality_degraded',
-                            opc_node_id=node_id,
-                            variable_name=variable_name,
-                            old_value=old_value,
-                            new_value=val,
-                            quality=quality,
-                            message=f"Quality degraded to {quality} (value unchanged: {val})",
-                            metadata={
-                                'dataType': type(val).__name__,
-                                'equipmentId': matching_datapoint['equipmentId'],
-                                'datapointId': str(matching_datapoint['id'])
-                            }
-                        )
+            for item in data:
+                key = tuple(item.get(field) for field in self.IDENTITY_FIELDS)
+                index = nodes.get(key)
+                if index is None:
+                    index = nodes[key] = len(nodes)
+                    defs.append([index, *key])
+                node_column.append(index)
                 
-                logger.info(f"📊 Value changed: {variable_name} = {val} (quality: {quality})")
-            else:
-                # This is a discovered node (not configured as datapoint) - update MongoDB directly
-                old_value = last_values.get(node_id)
-                
-                # Only process if value actually changed to avoid spam
-                if old_value is None or old_value != val:
-                    # Send discovered node update via WebSocket
-                    discovered_node_update = {
-                        'opcNodeId': node_id,
-                        'value': val,
-                        'quality': quality,
-                        'timestamp': datetime.utcnow().isoformat() + 'Z'
-                    }
-                    
-                    # Add to buffer for batch upload
-                    changed_data_buffer.append(discovered_node_update)
-                    
-                    logger.info(f"🔍 Discovered node changed: {node_id} = {val} (quality: {quality})")
+                for name, value in item.items():
+                    if name in self.IDENTITY_FIELDS or name in ('quality', 'timestamp'):
+                        continue
+                    if name not in columns:
+                        columns[name] = [None] * (len(node_column) - 1)
+                    columns[name].append(value)
+                for column in columns.values():
+                    if len(column) < len(node_column):
+                        column.append(None)
             
-            # Update last known value
-            last_values[node_id] = val
-                    
-        except Exception as e:
-            logger.error(f"❌ Error in datachange_notification: {e}")
+            frame = dict(header, v=1, defs=defs, node=node_column,
+                         ts=[_epoch_ms(item.get('timestamp')) for item in data],
+                         quality=[QUALITY_CODES.index(item['quality']) if item.get('quality') in QUALITY_CODES
+                                  else len(QUALITY_CODES) - 1 for item in data],
+                         cols=columns)
+            return msgpack.packb(frame, use_bin_type=True)
 
-# ==========================================
-# FUNCTIONS
-# ==========================================
+uplink_encoder = ColumnarEncoder()
 
-def _fetch_config_request():
-    """Internal function to fetch config (used by retry mechanism)"""
-    headers = {'X-Raspberry-ID': RASPBERRY_ID}
-    response = requests.get(CONFIG_ENDPOINT, headers=headers, timeout=10)
-    
-    if response.status_code == 403:
-        raise Exception("Unauthorized: Raspberry Pi not registered in system")
-    
-    if response.status_code == 404:
-        raise Exception("Configuration not found. Please configure device in admin panel")
-    
-    response.raise_for_status()
-    data = response.json()
-    
-    if not data.get('success'):
-        raise Exception(data.get('error', 'Unknown error'))
-    
-    return data
+def note_accept_encoding(response):
+    """
+    Pick the request-body codec from the server's Accept-Encoding response
+    header (RFC 7694). Servers that don't send it get uncompressed bodies.
+    """
+    global http_codec
+    accepted = {codec.split(';')[0].strip().lower()
+                for codec in response.headers.get('Accept-Encoding', '').split(',')}
+    available = [codec for codec in HTTP_CODEC_PREFERENCE
+                 if codec in accepted and (codec != 'zstd' or zstandard)]
+    codec = available[0] if available else None
+    if codec != http_codec:
+        logger.info(f"🗜️  HTTP request compression: {codec or 'none'}")
+        http_codec = codec
 
-def fetch_config():
-    """Fetch configuration from API with retry"""
-    global config, datapoints
+def _json_chunks(payload):
+    """Serialize payload incrementally, yielding pieces of about HTTP_STREAM_CHUNK bytes"""
+    pieces, size = [], 0
+    for piece in json.JSONEncoder(default=str).iterencode(payload):
+        piece = piece.encode('utf-8')
+        pieces.append(piece)
+        size += len(piece)
+        if size >= HTTP_STREAM_CHUNK:
+            yield b''.join(pieces)
+            pieces, size = [], 0
+    if pieces:
+        yield b''.join(pieces)
+
+def _compress_chunks(chunks, codec):
+    if codec == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def post_uplink(endpoint, url, headers, payload=None, body=None):
+    """
+    POST a JSON payload (or a ready body) to the cloud, compressed with the
+    negotiated codec once it reaches HTTP_COMPRESS_THRESHOLD bytes.
+    Large JSON bodies are serialized and compressed as a stream (chunked
+    transfer), so they are never held in memory in both forms.
+    """
+    global http_codec
+    headers = dict(headers)
+    chunks = _json_chunks(payload) if body is None else iter([body])
+    first = next(chunks, b'')
+    codec = http_codec
     
-    logger.info(f"📡 Fetching configuration for Raspberry Pi: {RASPBERRY_ID}")
+    if len(first) < HTTP_COMPRESS_THRESHOLD:
+        # Whole body fits in the first piece (pieces are >= HTTP_STREAM_CHUNK) - not worth compressing
+        data = first
+    elif codec:
+        headers['Content-Encoding'] = codec
+        data = _compress_chunks(chain([first], chunks), codec)
+    else:
+        data = chain([first], chunks)
     
-    success, data = retry_with_backoff(_fetch_config_request)
+    response = transport.request('POST', endpoint, url, data=data, headers=headers)
+    note_accept_encoding(response)
     
-    if success:
-        config = data['config']
-        datapoints = data['datapoints']
-        
-        logger.info(f"✅ Configuration loaded:")
-        logger.info(f"   Raspberry Pi: {config['raspberryName']}")
-        logger.info(f"   OPC UA Server: {config['opcua_server_ip']}:{config['opcua_server_port']}")
-        logger.info(f"   Poll Interval: {config['poll_interval']}ms")
-        logger.info(f"   Datapoints to monitor: {len(datapoints)}")
-        
-        return True
-    else:
-        logger.error("❌ Failed to fetch config after all retries")
-        return False
+    if response.status_code == 415 and codec and 'Content-Encoding' in headers:
+        # Server no longer accepts the codec; next attempt goes uncompressed
+        http_codec = None
+        raise Exception(f"Server rejected {codec} request compression")
+    return response
 
-def connect_opcua():
-    """Connect to OPC UA server"""
-    global opcua_client, opcua_connection_status
+# ==========================================
+# UPLOADER (circuit breakers + retry budget)
+# ==========================================
+
+class RetryBudget:
+    """
+    Token bucket shared by all endpoints. Every retry (an attempt after a failure)
+    spends one token, so a long outage can't turn into a retry storm across endpoints.
+    """
+    def __init__(self, capacity, refill_per_sec):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_sec)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.denied += 1
+            return False
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker with jittered exponential backoff.
+    closed: calls allowed; after a failure the next attempt waits for the backoff.
+    open (BREAKER_FAILURE_THRESHOLD consecutive failures): calls rejected until the
+    backoff expires, then a single half-open probe decides whether to close again.
+    """
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.state = 'closed'
+        self.failures = 0
+        self.retry_at = 0
+        self._lock = threading.Lock()
+
+    def ready(self):
+        """True if allow() could let a call through now (does not change state)"""
+        return self.state != 'half_open' and time.time() >= self.retry_at
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'half_open' or time.time() < self.retry_at:
+                return False
+            if self.failures and not self.budget.try_acquire():
+                return False
+            if self.state == 'open':
+                self.state = 'half_open'
+            return True
+
+    def backoff(self):
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (self.failures - 1)))
+        return random.uniform(delay / 2, delay)
+
+    def record(self, success, error=None):
+        with self._lock:
+            if success:
+                if self.state != 'closed':
+                    logger.info(f"✅ Circuit '{self.name}' closed after {self.failures} failure(s)")
+                self.state = 'closed'
+                self.failures = 0
+                self.retry_at = 0
+                return
+            
+            self.failures += 1
+            delay = self.backoff()
+            self.retry_at = time.time() + delay
+            if self.state == 'half_open' or self.failures >= BREAKER_FAILURE_THRESHOLD:
+                if self.state == 'closed':
+                    logger.warning(f"🚫 Circuit '{self.name}' open after {self.failures} failures")
+                self.state = 'open'
+            logger.warning(f"⚠️  {self.name} request failed ({self.failures}x): {error}. Next attempt in {delay:.0f}s")
+
+retry_budget = RetryBudget(RETRY_BUDGET_TOKENS, RETRY_BUDGET_REFILL)
+circuit_breakers = {name: CircuitBreaker(name, retry_budget)
+                    for name in ('config', 'data', 'events', 'heartbeat', 'device_info', 'discovered_nodes')}
+
+def guarded_call(endpoint, func, *args, **kwargs):
+    """
+    Single attempt through the endpoint's circuit breaker (never sleeps).
+    Returns (success: bool, result: any); (False, None) while the circuit holds calls back.
+    """
+    breaker = circuit_breakers[endpoint]
+    if not breaker.allow():
+        return False, None
     
     try:
-        if not config:
-            logger.error("❌ No configuration loaded. Cannot connect to OPC UA server.")
-            return False
+        result = func(*args, **kwargs)
+        breaker.record(True)
+        return True, result
+    except Exception as e:
+        breaker.record(False, e)
+        return False, None
+
+class DeliveryWindow:
+    """
+    Spooled data batches sent over the WebSocket and not yet acknowledged.
+    A batch goes out as one frame tagged with its spool id (seq) and the
+    spool epoch; the server acks it through a Socket.IO callback once stored
+    and drops repeats of (raspberryId, epoch, seq).
+    Up to `size` batches are pipelined. The spool cursor only advances over
+    the acknowledged prefix; a batch whose ack timed out (or was asked to
+    retry) is sent again, so delivery is at-least-once.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.batches = OrderedDict()  # seq -> {'batch', 'pending', 'deadline'}
+
+    def __len__(self):
+        with self.lock:
+            return len(self.batches)
+
+    def __contains__(self, seq):
+        with self.lock:
+            return seq in self.batches
+
+    def free(self):
+        with self.lock:
+            return max(0, self.size - len(self.batches))
+
+    def add(self, seq, batch):
+        """Track a batch being sent (again): pending, with a fresh ack deadline"""
+        with self.lock:
+            self.batches[seq] = {'batch': batch, 'pending': True,
+                                 'deadline': time.time() + WS_ACK_TIMEOUT}
+
+    def ack(self, seq, response=None):
+        """Socket.IO ack callback (client thread)"""
+        response = response or {}
+        with self.lock:
+            entry = self.batches.get(seq)
+            if entry is None:
+                return
+            if response.get('success') or not response.get('retry'):
+                entry['pending'] = False
+            else:
+                entry['deadline'] = 0  # Server asked for it again
         
-        opcua_url = f"opc.tcp://{config['opcua_server_ip']}:{config['opcua_server_port']}"
-        logger.info(f"🔗 Connecting to OPC UA server: {opcua_url}")
+        if response.get('resync'):
+            # Server doesn't know a node index we used - resend with a fresh dictionary
+            uplink_encoder.reset()
         
-        opcua_client = Client(opcua_url)
+        if not response.get('success'):
+            logger.warning(f"⚠️  Server {'deferred' if response.get('retry') else 'rejected'} "
+                           f"data batch {seq}: {response.get('error')}")
+        uploader.wake()
+
+    def pop_acked(self):
+        """Drop the acknowledged prefix; returns its last seq (None if the oldest batch is still pending)"""
+        last = None
+        with self.lock:
+            while self.batches:
+                seq, entry = next(iter(self.batches.items()))
+                if entry['pending']:
+                    break
+                self.batches.popitem(last=False)
+                last = seq
+        return last
+
+    def due(self):
+        """Batches to send again: [(seq, batch)] whose ack is overdue"""
+        now = time.time()
+        with self.lock:
+            return [(seq, entry['batch']) for seq, entry in self.batches.items()
+                    if entry['pending'] and entry['deadline'] <= now]
+
+    def resend_all(self):
+        """Acks for messages on the previous connection will never arrive - send everything again"""
+        with self.lock:
+            for entry in self.batches.values():
+                if entry['pending']:
+                    entry['deadline'] = 0
+
+    def clear(self):
+        with self.lock:
+            self.batches.clear()
+
+data_window = DeliveryWindow(WS_INFLIGHT_WINDOW)
+
+class Uploader:
+    """
+    Background thread that owns all uplink network I/O: spooled data, event log,
+    heartbeat, config fetch, device info and pending discovered nodes.
+    Producers only append to the spool and call wake(); they never wait on the WAN.
+    """
+    def __init__(self):
+        self.thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_events = False
+        self._config_lock = threading.Lock()
+        self._fetched_config = None
+        self._config_requested = False
+        self.config_ready = threading.Event()  # Set while a fetched config waits for the main loop
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self._stop.clear()
+        self.thread = threading.Thread(target=self.run, name='uplink-uploader', daemon=True)
+        self.thread.start()
+        logger.info("⚙️  Uplink uploader started")
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def wake(self, flush_events=False):
+        if flush_events:
+            self._flush_events = True
+        self._wake.set()
+
+    def request_config(self):
+        """Fetch config on the next pass, regardless of the refresh interval"""
+        self._config_requested = True
+        self._wake.set()
+
+    def take_config(self):
+        """Latest fetched config response, handed over to the main loop exactly once"""
+        with self._config_lock:
+            data, self._fetched_config = self._fetched_config, None
+            self.config_ready.clear()
+        return data
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.wait(UPLOADER_IDLE)
+            self._wake.clear()
+            
+            try:
+                self.run_once(time.time())
+            except Exception as e:
+                logger.error(f"❌ Uploader error: {e}")
+
+    def run_once(self, current_time):
+        global last_heartbeat, last_config_fetch, config_version
         
-        # Set timeout if the method exists (newer versions)
-        if hasattr(opcua_client, 'set_session_timeout'):
-            opcua_client.set_session_timeout(config.get('connection_timeout', 60000))
+        # Fetch config when the server announced a change, else refresh periodically (applied by the main loop)
+        refresh_interval = CONFIG_PUSH_REFRESH_INTERVAL if websocket_connected else CONFIG_REFRESH_INTERVAL
+        if self._config_requested or (current_time - last_config_fetch) > refresh_interval:
+            fetched, data = fetch_config()
+            if fetched:
+                self._config_requested = False
+                last_config_fetch = current_time
+            if data:
+                config_version = data.get('version')
+                with self._config_lock:
+                    self._fetched_config = data
+                    self.config_ready.set()
         
-        opcua_client.connect()
+        if uplink_spool.backlog('data'):
+            drain_data_spool()
         
-        # Log successful connection
-        old_status = opcua_connection_status
-        opcua_connection_status = 'Connected'
-        log_event(
-            event_type='connection_restored',
-            quality='Good',
-            message=f"Connected to OPC UA server {config['opcua_server_ip']}:{config['opcua_server_port']}",
-            metadata={
-                'opcua_server_ip': config['opcua_server_ip'],
-                'opcua_server_port': config['opcua_server_port'],
-                'previous_status': old_status
-            }
-        )
+        flush_event_buffer(force=self._flush_events)
+        self._flush_events = False
         
-        logger.info(f"✅ Connected to OPC UA server: {config['opcua_server_ip']}")
-        return True
+        # Send heartbeat
+        if (current_time - last_heartbeat) > HEARTBEAT_INTERVAL:
+            if send_heartbeat('online'):
+                logger.debug("💓 Heartbeat sent")
+            last_heartbeat = current_time
         
-    except Exception as e:
-        logger.error(f"❌ Failed to connect to OPC UA server: {e}")
+        # Upload device info until the server accepted it
+        if not device_info_uploaded and circuit_breakers['device_info'].allow():
+            circuit_breakers['device_info'].record(upload_device_info(), 'device info not accepted')
+        
+        # Retry pending discovered nodes
+        if pending_discovered_nodes:
+            upload_pending_discovered_nodes()
+
+uploader = Uploader()
+
+# ==========================================
+# DATAPOINT REGISTRY
+# ==========================================
+
+class DatapointRecord:
+    """
+    Precomputed dispatch record for one monitored node.
+    Everything the data change path needs is resolved once here,
+    so a notification never has to search the datapoint list.
+    """
+    __slots__ = ('node_id', 'opc_node_id', 'label', 'equipment_id', 'datapoint_id', 'is_configured', 'metadata')
+
+    def __init__(self, node_id, label=None, equipment_id=None, datapoint_id=None, opc_node_id=None):
+        self.node_id = node_id  # Node key (see node_key)
+        self.opc_node_id = opc_node_id or node_id  # opcNodeId reported to the server
+        self.label = label or node_id
+        self.equipment_id = equipment_id
+        self.datapoint_id = datapoint_id
+        self.is_configured = datapoint_id is not None
+        # Template copied into event metadata (dataType is added per value)
+        self.metadata = {'equipmentId': equipment_id, 'datapointId': datapoint_id} if self.is_configured else {}
+
+    @classmethod
+    def from_datapoint(cls, dp):
+        return cls(
+            node_id=datapoint_key(dp),
+            label=dp.get('label'),
+            equipment_id=dp['equipmentId'],
+            datapoint_id=str(dp['id']),
+            opc_node_id=dp['opcNodeId']
+        )
+
+class DatapointRegistry:
+    """
+    Compiled lookup from monitored-item client handle (and NodeId string)
+    to DatapointRecord. Built when config is fetched and when subscriptions
+    are created; read on every data change notification.
+    """
+    def __init__(self):
+        self.by_node_id = {}
+        self.by_handle = {}
+        self.client_deadbands = {}  # node_id -> (deadband_type, deadband_value) filtered on the Pi
+
+    def compile(self, datapoints, discovered_nodes=None):
+        """Rebuild records from config datapoints and discovered nodes"""
+        by_node_id = {}
+        
+        for node_data in discovered_nodes or []:
+            node_id = node_data['opcNodeId']
+            by_node_id[node_id] = DatapointRecord(node_id, label=node_data.get('variableName'))
+        
+        # Configured datapoints take precedence over discovered nodes (first one wins on duplicates)
+        configured = set()
+        for dp in datapoints or []:
+            node_id = datapoint_key(dp)
+            if node_id not in configured:
+                by_node_id[node_id] = DatapointRecord.from_datapoint(dp)
+                configured.add(node_id)
+        
+        # Keep existing handle bindings pointing at the refreshed records
+        by_handle = {}
+        for handle, record in self.by_handle.items():
+            if record.node_id in by_node_id:
+                by_handle[handle] = by_node_id[record.node_id]
+        
+        # Swap whole dicts so the subscription thread never sees a half-built registry
+        self.by_node_id = by_node_id
+        self.by_handle = by_handle
+        
+        logger.debug(f"Compiled datapoint registry: {len(configured)} configured, {len(by_node_id) - len(configured)} discovered")
+
+    def bind(self, handle, node_id):
+        """Map a monitored-item client handle to the record for node_id"""
+        record = self.by_node_id.get(node_id)
+        if record is None:
+            record = DatapointRecord(node_id)
+            self.by_node_id[node_id] = record
+        self.by_handle[handle] = record
+        return record
+
+    def unbind(self, handle):
+        self.by_handle.pop(handle, None)
+
+    def clear_handles(self):
+        """Forget all handle bindings (client handles are reused by a new subscription)"""
+        self.by_handle = {}
+
+    def resolve(self, handle, node):
+        """Return the record for a notification, binding the handle on first sight (None for a stale poll handle)"""
+        record = self.by_handle.get(handle)
+        if record is None and node is not None:
+            record = self.bind(handle, node.nodeid.to_string())
+        return record
+
+    def get(self, node_id):
+        return self.by_node_id.get(node_id)
+
+    def set_client_deadband(self, node_id, params=None):
+        """Filter node_id on the Pi with params' deadband (None/no deadband clears it)"""
+        if params is None or params.deadband_type == 'none':
+            self.client_deadbands.pop(node_id, None)
+        else:
+            self.client_deadbands[node_id] = (params.deadband_type, params.deadband_value)
+
+datapoint_registry = DatapointRegistry()
+
+# ==========================================
+# SUBSCRIPTION HANDLER
+# ==========================================
+
+class NotificationQueue:
+    """
+    Bounded queue between the OPC UA publish thread (single producer) and
+    the notification worker (single consumer).
+    deque.append/popleft are atomic, so neither side takes a lock. When the
+    queue is full the newest notification is dropped and counted instead of
+    blocking the OPC UA session.
+    """
+    def __init__(self, maxsize=NOTIFICATION_QUEUE_MAX):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._wakeup = threading.Event()
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_watermark = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        size = len(self._items)
+        if size >= self.maxsize:
+            self.dropped += 1
+            return False
+        self._items.append(item)
+        self.enqueued += 1
+        if size >= self.high_watermark:
+            self.high_watermark = size + 1
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+        return True
+
+    def drain(self, max_items):
+        """Pop up to max_items notifications in arrival order"""
+        items = []
+        popleft = self._items.popleft
+        try:
+            while len(items) < max_items:
+                items.append(popleft())
+        except IndexError:
+            pass
+        return items
+
+    def wait(self, timeout):
+        """Block until something is queued (or timeout)"""
+        self._wakeup.clear()
+        if not self._items:
+            self._wakeup.wait(timeout)
+
+    def stats(self):
+        return {
+            'queued': len(self._items),
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'highWatermark': self.high_watermark
+        }
+
+notification_queue = NotificationQueue()
+
+class DataChangeHandler:
+    """
+    Handler for OPC UA subscription data changes.
+    Runs on the python-opcua publish thread, so it only hands the raw
+    notification to the worker; change detection and event logging
+    happen in process_notification().
+    """
+    def __init__(self, queue, handle_offset=0):
+        self.queue = queue
+        self.handle_offset = handle_offset
+    
+    def datachange_notification(self, node, val, data):
+        """Called when subscribed node value changes"""
+        item = data.monitored_item
+        self.queue.put((self.handle_offset + item.ClientHandle, node, item.Value))
+
+def process_notification(handle, node, data_value):
+    """
+    Handle one data change on the worker thread.
+    Only buffers when values actually change.
+    Tracks previous values and logs all changes to event log.
+    """
+    # O(1) lookup of the datapoint this monitored item belongs to
+    record = datapoint_registry.resolve(handle, node)
+    if record is None:
+        # Poll sample queued before the poller was closed and its handles cleared
+        return
+    node_id = record.node_id
+    rate_observer.note(node_id)
+    val = data_value.Value.Value if data_value.Value is not None else None
+    
+    # Determine quality status
+    status_code = data_value.StatusCode
+    quality = 'Good' if status_code.is_good() else ('Uncertain' if status_code.is_uncertain() else 'Bad')
+    
+    # Client-side deadband for items the server couldn't filter (and polling mode)
+    deadband = datapoint_registry.client_deadbands.get(node_id)
+    if deadband and quality == 'Good' and within_deadband(deadband, last_values.get(node_id), val):
+        return
+    
+    if record.is_configured:
+        # This is a configured datapoint - send via normal data channel
+        variable_name = record.label
+        
+        # Get previous value for logging
+        old_value = last_values.get(node_id)
+        
+        # Prepare data for WebSocket push
+        changed_data = {
+            'datapointId': record.datapoint_id,
+            'equipmentId': record.equipment_id,
+            'opcNodeId': record.opc_node_id,
+            'value': val,
+            'quality': quality,
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        }
+        
+        # Add to buffer for batch upload
+        flush_scheduler.add(changed_data, 'data')
+        
+        # Only log event if value actually changed (or if it's the first value)
+        if old_value is None or old_value != val:
+            log_event(
+                event_type='value_change' if quality == 'Good' else 'quality_degraded',
+                opc_node_id=record.opc_node_id,
+                variable_name=variable_name,
+                old_value=old_value,
+                new_value=val,
+                quality=quality,
+                message=f"Value changed from {old_value} to {val}" if old_value is not None else f"Initial value: {val}",
+                metadata=dict(record.metadata, dataType=type(val).__name__)
+            )
+        else:
+            # Value didn't change, only log if quality degraded
+            if quality != 'Good':
+                log_event(
+                    event_type='quality_degraded',
+                    opc_node_id=record.opc_node_id,
+                    variable_name=variable_name,
+                    old_value=old_value,
+                    new_value=val,
+                    quality=quality,
+                    message=f"Quality degraded to {quality} (value unchanged: {val})",
+                    metadata=dict(record.metadata, dataType=type(val).__name__)
+                )
+        
+        logger.info(f"📊 Value changed: {variable_name} = {val} (quality: {quality})")
+    else:
+        # This is a discovered node (not configured as datapoint) - update MongoDB directly
+        old_value = last_values.get(node_id)
+        
+        # Only process if value actually changed to avoid spam
+        if old_value is None or old_value != val:
+            # Send discovered node update via WebSocket
+            discovered_node_update = {
+                'opcNodeId': node_id,
+                'value': val,
+                'quality': quality,
+                'timestamp': datetime.utcnow().isoformat() + 'Z'
+            }
+            
+            # Add to buffer for batch upload
+            flush_scheduler.add(discovered_node_update, 'discovered')
+            
+            logger.info(f"🔍 Discovered node changed: {node_id} = {val} (quality: {quality})")
+    
+    # Update last known value
+    last_values[node_id] = val
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def within_deadband(deadband, previous, value):
+    """True if value is within the deadband of the last reported value (OPC UA semantics: notify only when exceeded)"""
+    deadband_type, deadband_value = deadband
+    if not _is_number(previous) or not _is_number(value):
+        return False
+    
+    delta = abs(value - previous)
+    if deadband_type == 'percent':
+        # The Pi doesn't know the EURange; use a percentage of the last reported value instead
+        return delta <= abs(previous) * deadband_value / 100.0
+    return delta <= deadband_value
+
+def notification_worker():
+    """Drain the notification queue and process changes (runs in its own thread)"""
+    reported_drops = 0
+    last_overflow_report = 0
+    
+    while True:
+        batch = notification_queue.drain(NOTIFICATION_BATCH_MAX)
+        if not batch:
+            notification_queue.wait(NOTIFICATION_WORKER_IDLE)
+            continue
+        
+        for handle, node, data_value in batch:
+            try:
+                process_notification(handle, node, data_value)
+            except Exception as e:
+                logger.error(f"❌ Error processing data change: {e}")
+        
+        # Overflow accounting (reported from here, never from the publish thread)
+        dropped = notification_queue.dropped
+        if dropped != reported_drops and (time.time() - last_overflow_report) >= OVERFLOW_REPORT_INTERVAL:
+            logger.warning(f"⚠️  Notification queue overflow: {dropped - reported_drops} dropped "
+                           f"({dropped} total, high watermark {notification_queue.high_watermark}/{notification_queue.maxsize})")
+            reported_drops = dropped
+            last_overflow_report = time.time()
+
+def start_notification_worker():
+    """Start the notification worker in a background thread"""
+    worker_thread = threading.Thread(target=notification_worker, name='notification-worker', daemon=True)
+    worker_thread.start()
+    return worker_thread
+
+# ==========================================
+# FLUSH SCHEDULER
+# ==========================================
+
+class FlushScheduler:
+    """
+    Condition-variable driven flush of changed values into the uplink spool.
+    Each stream has a max-latency deadline that starts with its first buffered
+    item (FLUSH_LATENCY); the buffer is handed to push_data() as soon as a
+    deadline expires or the count/bytes thresholds are reached.
+    Spooled events get the same treatment: the uploader is woken when the
+    event deadline or EVENT_FLUSH_COUNT is reached instead of being polled.
+    In the latest-* coalescing modes a node that changes again before the flush
+    replaces its buffered item in place (see COALESCE_MODES).
+    """
+    def __init__(self, latencies):
+        self.latencies = latencies  # stream -> max seconds a change may wait
+        self.cond = threading.Condition()
+        self.mode = 'all'
+        self.buffer = []
+        self.index = {}  # coalescing key -> position in buffer (latest-* modes)
+        self.bytes = 0
+        self.coalesced = 0  # changes merged into an already buffered item since the last flush
+        self.deadline = None
+        self.event_count = 0
+        self.event_deadline = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name='flush-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread:
+            self.thread.join(timeout)
+        self.flush()
+
+    def set_mode(self, mode):
+        if mode not in COALESCE_MODES:
+            logger.warning(f"⚠️  Unknown coalesce mode '{mode}', using 'all'")
+            mode = 'all'
+        with self.cond:
+            if mode != self.mode:
+                logger.info(f"🔧 Realtime coalescing: {mode}")
+            self.mode = mode
+            self.index = {}
+
+    def add(self, item, stream='data'):
+        """Buffer one changed value; wakes the scheduler only if it moves a deadline or hits a threshold"""
+        size = len(str(item))
+        with self.cond:
+            if self.mode != 'all':
+                key = item.get('datapointId') or item['opcNodeId']
+                position = self.index.get(key)
+                if position is not None:
+                    if self.mode == 'latest-plus-count':
+                        _merge_change_count(self.buffer[position], item)
+                    self.buffer[position] = item
+                    self.coalesced += 1
+                    return
+                if self.mode == 'latest-plus-count':
+                    _merge_change_count(None, item)
+                self.index[key] = len(self.buffer)
+            
+            self.buffer.append(item)
+            self.bytes += size
+            deadline = time.time() + self.latencies[stream]
+            if self.deadline is None or deadline < self.deadline:
+                self.deadline = deadline
+                self.cond.notify()
+            elif len(self.buffer) >= FLUSH_MAX_COUNT or self.bytes >= FLUSH_MAX_BYTES:
+                self.cond.notify()
+
+    def note_event(self):
+        """An event was spooled; schedule its upload"""
+        with self.cond:
+            self.event_count += 1
+            if self.event_count >= EVENT_FLUSH_COUNT:
+                self.event_deadline = 0
+                self.cond.notify()
+            elif self.event_deadline is None:
+                self.event_deadline = time.time() + self.latencies['events']
+                self.cond.notify()
+
+    def _take(self):
+        batch = self.buffer
+        if self.coalesced:
+            logger.debug(f"🧮 Coalesced {self.coalesced} change(s) into {len(batch)} item(s)")
+        self.buffer = []
+        self.index = {}
+        self.bytes = 0
+        self.coalesced = 0
+        self.deadline = None
+        return batch
+
+    def _data_due(self, now):
+        return bool(self.buffer) and (now >= self.deadline or len(self.buffer) >= FLUSH_MAX_COUNT
+                                      or self.bytes >= FLUSH_MAX_BYTES)
+
+    def run(self):
+        while True:
+            batch = None
+            with self.cond:
+                if not self.running:
+                    return
+                
+                now = time.time()
+                events_due = self.event_deadline is not None and now >= self.event_deadline
+                if events_due:
+                    self.event_deadline = None
+                    self.event_count = 0
+                
+                if self._data_due(now):
+                    batch = self._take()
+                elif not events_due:
+                    deadlines = [d for d in (self.deadline, self.event_deadline) if d is not None]
+                    self.cond.wait(min(deadlines) - now if deadlines else None)
+                    continue
+            
+            if events_due:
+                uploader.wake(flush_events=True)
+            if batch:
+                self._push(batch)
+
+    def flush(self):
+        """Push whatever is buffered right now (shutdown)"""
+        with self.cond:
+            batch = self._take()
+        if batch:
+            self._push(batch)
+
+    def _push(self, batch):
+        try:
+            logger.info(f"📦 Uploading {len(batch)} changed datapoint(s)")
+            push_data(batch)
+        except Exception as e:
+            logger.error(f"❌ Failed to spool {len(batch)} changed datapoint(s): {e}")
+
+def _merge_change_count(previous, item):
+    """latest-plus-count: carry the change count and numeric min/max of the window into the newest item"""
+    value = item['value']
+    numeric = _is_number(value)
+    if previous is None:
+        item['changeCount'] = 1
+        if numeric:
+            item['minValue'] = item['maxValue'] = value
+        return
+    
+    item['changeCount'] = previous['changeCount'] + 1
+    bounds = [v for v in (previous.get('minValue'), previous.get('maxValue'), value) if _is_number(v)]
+    if bounds:
+        item['minValue'] = min(bounds)
+        item['maxValue'] = max(bounds)
+
+flush_scheduler = FlushScheduler(FLUSH_LATENCY)
+
+# ==========================================
+# SUBSCRIPTION MANAGEMENT
+# ==========================================
+
+# Per-item monitoring parameters; items whose params differ from the live ones get modified
+# (or recreated, when the DataChangeFilter part or the rate class differs)
+MonitoringParams = namedtuple('MonitoringParams',
+                              ['sampling_interval', 'queue_size', 'deadband_type', 'deadband_value', 'trigger',
+                               'rate_class'],
+                              defaults=('none', 0.0, 'StatusValue', 'normal'))
+
+def monitoring_params(source=None, rate_class='normal'):
+    """MonitoringParams from a config datapoint / monitoring rule (invalid fields fall back to defaults)"""
+    source = source or {}
+    deadband_type = source.get('deadbandType') or 'none'
+    trigger = source.get('trigger') or 'StatusValue'
+    try:
+        deadband_value = max(0.0, float(source.get('deadbandValue') or 0))
+    except (TypeError, ValueError):
+        deadband_value = 0.0
+    try:
+        queue_size = max(0, int(source.get('queueSize') or 0))
+    except (TypeError, ValueError):
+        queue_size = 0
+    
+    if deadband_type not in DEADBAND_TYPES or not deadband_value:
+        deadband_type, deadband_value = 'none', 0.0
+    if trigger not in DATA_CHANGE_TRIGGERS:
+        trigger = 'StatusValue'
+    return MonitoringParams(RATE_CLASSES[rate_class], queue_size, deadband_type, deadband_value, trigger, rate_class)
+
+def filter_params(params):
+    """The part of MonitoringParams that goes into the DataChangeFilter"""
+    return params.deadband_type, params.deadband_value, params.trigger
+
+def data_change_filter(params):
+    """DataChangeFilter for params, or None when the server default (StatusValue, no deadband) applies"""
+    if params.deadband_type == 'none' and params.trigger == 'StatusValue':
+        return None
+    
+    mfilter = ua.DataChangeFilter()
+    mfilter.Trigger = ua.DataChangeTrigger(DATA_CHANGE_TRIGGERS.index(params.trigger))
+    mfilter.DeadbandType = ua.DeadbandType(DEADBAND_TYPES.index(params.deadband_type))
+    mfilter.DeadbandValue = float(params.deadband_value)
+    return mfilter
+
+class MonitoredItem:
+    """Live monitored item on the server"""
+    __slots__ = ('node_id', 'client_handle', 'server_handle', 'params', 'group')
+
+    def __init__(self, node_id, client_handle, server_handle, params, group):
+        self.node_id = node_id
+        self.client_handle = client_handle
+        self.server_handle = server_handle
+        self.params = params
+        self.group = group
+
+class SubscriptionGroup:
+    """
+    One OPC UA subscription of a rate class. Client handles restart at the
+    same value in every python-opcua Subscription, so each group offsets
+    its handles to keep them unique in the registry.
+    """
+    __slots__ = ('rate_class', 'subscription', 'handle_offset', 'count', 'capacity')
+
+    def __init__(self, rate_class, subscription, handle_offset, capacity):
+        self.rate_class = rate_class
+        self.subscription = subscription
+        self.handle_offset = handle_offset
+        self.count = 0
+        self.capacity = capacity
+
+    @property
+    def free(self):
+        return max(0, self.capacity - self.count)
+
+def status_name(status):
+    """Symbolic name of a StatusCode from either OPC UA library"""
+    return getattr(status, 'name', str(status))
+
+class SubscriptionState:
+    """
+    Bookkeeping shared by SubscriptionManager and the asyncio runtime's
+    AsyncSubscriptionManager: subscription groups per rate class, the live
+    monitored items, failures, and the decisions reconcile() takes from
+    them. Subclasses only add the OPC UA calls (sync or awaited).
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.groups = {}  # rate_class -> [SubscriptionGroup]
+        self.items = {}  # node_id -> MonitoredItem
+        self.failed = {}  # node_id -> status name of the last failed create
+        self.max_items_per_call = DEFAULT_MAX_MONITORED_ITEMS_PER_CALL
+        self.max_items_per_subscription = DEFAULT_MAX_ITEMS_PER_SUBSCRIPTION
+
+    def configure(self, limits, max_items_per_subscription=None):
+        self.max_items_per_call = (limits or {}).get('MaxMonitoredItemsPerCall') or DEFAULT_MAX_MONITORED_ITEMS_PER_CALL
+        self.max_items_per_subscription = max_items_per_subscription or DEFAULT_MAX_ITEMS_PER_SUBSCRIPTION
+
+    def summary(self):
+        """{rate_class: (subscriptions, items)} for logging"""
+        return {rate_class: (len(groups), sum(group.count for group in groups))
+                for rate_class, groups in self.groups.items() if groups}
+
+    def plan(self, desired):
+        """Diff desired against the live items -> (to_remove, to_add, to_modify)"""
+        to_remove = [item for node_id, item in self.items.items() if node_id not in desired]
+        to_add = [(node_id, params) for node_id, params in desired.items() if node_id not in self.items]
+        to_modify = []
+        
+        for node_id, params in desired.items():
+            item = self.items.get(node_id)
+            if item is None or item.params == params:
+                continue
+            if filter_params(item.params) == filter_params(params) and item.params.rate_class == params.rate_class:
+                to_modify.append((item, params))
+            else:
+                # ModifyMonitoredItems can't change the deadband or move subscriptions - recreate the item
+                to_remove.append(item)
+                to_add.append((node_id, params))
+        return to_remove, to_add, to_modify
+
+    @staticmethod
+    def by_rate_class(entries):
+        by_class = {}
+        for node_id, params in entries:
+            by_class.setdefault(params.rate_class, []).append((node_id, params))
+        return by_class
+
+    def free_group(self, rate_class):
+        return next((group for group in self.groups.get(rate_class, []) if group.free), None)
+
+    def add_group(self, group):
+        """Register a new subscription group; its position in the class for logging"""
+        self.groups.setdefault(group.rate_class, []).append(group)
+        return len(self.groups[group.rate_class])
+
+    def fail(self, node_ids, reason, failures, count_as=None):
+        for node_id in node_ids:
+            self.failed[node_id] = reason
+            failures[count_as or reason] += 1
+
+    def split_full(self, group, full, failures):
+        """
+        The server refused items as over its per-subscription limit: cap the
+        group (and new groups) at its current size and return the items to
+        place elsewhere. A group that took nothing at all fails them instead.
+        """
+        if group.count == 0:
+            self.fail([node_id for node_id, _ in full], 'BadTooManyMonitoredItems', failures)
+            return []
+        group.capacity = group.count
+        self.max_items_per_subscription = min(self.max_items_per_subscription, group.count)
+        logger.warning(f"⚠️  Subscription full at {group.count} items, splitting")
+        return full
+
+    def shrink_call(self, chunk, error, chunk_size):
+        """Halved call size when the server rejected the call size despite the advertised limit, else None"""
+        if 'BadTooManyOperations' not in str(error) or chunk_size <= 1:
+            return None
+        chunk_size = max(1, chunk_size // 2)
+        self.max_items_per_call = chunk_size
+        logger.warning(f"⚠️  Server rejected {len(chunk)} items per call, retrying with {chunk_size}")
+        return chunk_size
+
+    def record_results(self, group, chunk, results, use_filter, failures):
+        """
+        Map one CreateMonitoredItems response back to [(node_id, params, request)] by position.
+        Returns (added, [(node_id, params)] whose filter was rejected, [(node_id, params)] refused as full).
+        """
+        added = 0
+        rejected = []
+        full = []
+        for (node_id, params, request), result in zip(chunk, results):
+            # Successes are server handles (ints), failures the item's StatusCode
+            if not isinstance(result, int):
+                name = status_name(result)
+                if use_filter and name in FILTER_REJECTED_STATUSES:
+                    rejected.append((node_id, params))
+                elif name == 'BadTooManyMonitoredItems':
+                    full.append((node_id, params))
+                else:
+                    self.fail([node_id], name, failures)
+                continue
+            client_handle = group.handle_offset + request.RequestedParameters.ClientHandle
+            self.registry.bind(client_handle, node_id)
+            self.registry.set_client_deadband(node_id, None if use_filter else params)
+            self.items[node_id] = MonitoredItem(node_id, client_handle, result, params, group)
+            self.failed.pop(node_id, None)
+            group.count += 1
+            added += 1
+        return added, rejected, full
+
+    def drop(self, item):
+        """Forget a monitored item locally; the server no longer reports it for a removed node"""
+        self.items.pop(item.node_id, None)
+        self.registry.unbind(item.client_handle)
+        self.registry.set_client_deadband(item.node_id, None)
+        item.group.count -= 1
+
+    def prune_groups(self):
+        """Take out the groups that no longer monitor anything; returns them for deletion on the server"""
+        empty = []
+        for groups in self.groups.values():
+            for group in [group for group in groups if group.count <= 0]:
+                groups.remove(group)
+                empty.append(group)
+        return empty
+
+    def log_failures(self, failures, where=''):
+        failed = sum(failures.values())
+        if failed:
+            summary = ', '.join(f"{name}×{count}" for name, count in failures.most_common())
+            logger.warning(f"     ✗ {failed} monitored item(s) failed{where}: {summary}")
+        return failed
+
+class SubscriptionManager(SubscriptionState):
+    """
+    Owns the OPC UA subscriptions and the live set of monitored items.
+    Items are grouped into one subscription per rate class (RATE_CLASSES),
+    split further when a subscription reaches MaxMonitoredItemsPerSubscription.
+    reconcile() diffs a desired {node_id: MonitoringParams} map against the
+    live items and only adds/removes/modifies what changed, keeping the
+    session and all untouched items in place.
+    """
+    def __init__(self, registry, queue):
+        super().__init__(registry)
+        self.queue = queue
+        self.client = None
+        self._next_offset = 0
+
+    @property
+    def active(self):
+        return self.client is not None
+
+    def create(self, client, limits=None, max_items_per_subscription=None):
+        """Attach to a connected client; subscriptions are created per rate class as items arrive"""
+        self.client = client
+        self.configure(limits, max_items_per_subscription)
+        self.groups = {}
+        self.items = {}
+        self._next_offset = 0
+        logger.info(f"📡 Creating subscriptions by rate class "
+                    f"({', '.join(f'{name} {interval}ms' for name, interval in RATE_CLASSES.items())})")
+
+    def close(self):
+        """Delete all subscriptions and forget all items"""
+        for groups in self.groups.values():
+            for group in groups:
+                self._delete_group(group)
+        if self.groups:
+            logger.info("🗑️  Deleted OPC UA subscriptions")
+        self.groups = {}
+        self.client = None
+        self.items = {}
+        self.failed = {}
+        self.registry.clear_handles()
+
+    def _new_group(self, rate_class):
+        self._next_offset += SUBSCRIPTION_HANDLE_STRIDE
+        subscription = self.client.create_subscription(RATE_CLASSES[rate_class],
+                                                       DataChangeHandler(self.queue, self._next_offset))
+        group = SubscriptionGroup(rate_class, subscription, self._next_offset, self.max_items_per_subscription)
+        position = self.add_group(group)
+        logger.info(f"     + {rate_class} subscription #{position} ({RATE_CLASSES[rate_class]}ms)")
+        return group
+
+    def _delete_group(self, group):
+        try:
+            group.subscription.delete()
+        except Exception as e:
+            logger.debug(f"Error deleting subscription: {e}")
+
+    def reconcile(self, desired):
+        """
+        Bring live monitored items in line with desired.
+        Returns (added, removed, modified, failed) counts.
+        """
+        to_remove, to_add, to_modify = self.plan(desired)
+        removed = self._remove(to_remove)
+        modified = self._modify(to_modify)
+        added, failed = self._add(to_add)
+        return added, removed, modified, failed
+
+    def _add(self, entries):
+        """
+        Create monitored items with bulk CreateMonitoredItems calls, chunked to
+        the server's MaxMonitoredItemsPerCall and spread over the subscriptions
+        of each item's rate class. Per-item results are mapped back by position;
+        failures are summarized by status code.
+        Items whose DataChangeFilter is rejected are recreated without it and
+        filtered on the Pi instead (client-side deadband).
+        """
+        failures = Counter()
+        added = 0
+        rejected = []
+        
+        for rate_class, class_entries in self.by_rate_class(entries).items():
+            class_added, class_rejected = self._add_to_class(rate_class, class_entries, True, failures)
+            added += class_added
+            rejected.extend(class_rejected)
+        
+        if rejected:
+            fallback_added = 0
+            for rate_class, class_entries in self.by_rate_class(rejected).items():
+                fallback_added += self._add_to_class(rate_class, class_entries, False, failures)[0]
+            added += fallback_added
+            logger.info(f"     ↳ {fallback_added} item(s) fell back to client-side deadband (filter rejected by server)")
+        
+        return added, self.log_failures(failures)
+
+    def _add_to_class(self, rate_class, entries, use_filter, failures):
+        """Fill the class's subscriptions (opening new ones when full); returns (added, rejected)"""
+        added = 0
+        rejected = []
+        
+        while entries:
+            group = self.free_group(rate_class)
+            try:
+                if group is None:
+                    group = self._new_group(rate_class)
+            except Exception as e:
+                # e.g. BadTooManySubscriptions - nothing more can be added to this class
+                self.fail([node_id for node_id, _ in entries], str(e), failures, type(e).__name__)
+                break
+            
+            batch, entries = entries[:group.free], entries[group.free:]
+            batch_added, batch_rejected, full = self._create(group, batch, use_filter, failures)
+            added += batch_added
+            rejected.extend(batch_rejected)
+            if full:
+                # The server's per-subscription limit is lower than assumed
+                entries = self.split_full(group, full, failures) + entries
+        
+        return added, rejected
+
+    def _create(self, group, entries, use_filter, failures):
+        """
+        One CreateMonitoredItems pass on a group.
+        Returns (added, [(node_id, params)] whose filter was rejected, [(node_id, params)] refused as full).
+        """
+        requests_by_node = []
+        subscription = group.subscription
+        
+        for node_id, params in entries:
+            try:
+                node = self.client.get_node(node_id)
+                request = subscription._make_monitored_item_request(
+                    node, ua.AttributeIds.Value, data_change_filter(params) if use_filter else None, params.queue_size)
+                request.RequestedParameters.SamplingInterval = params.sampling_interval
+                requests_by_node.append((node_id, params, request))
+            except Exception as e:
+                self.fail([node_id], str(e), failures, 'InvalidNodeId')
+        
+        added = 0
+        rejected = []
+        full = []
+        start = 0
+        chunk_size = self.max_items_per_call
+        while start < len(requests_by_node):
+            chunk = requests_by_node[start:start + chunk_size]
+            try:
+                results = subscription.create_monitored_items([request for _, _, request in chunk])
+            except Exception as e:
+                smaller = self.shrink_call(chunk, e, chunk_size)
+                if smaller:
+                    chunk_size = smaller
+                    continue
+                self.fail([node_id for node_id, _, _ in chunk], str(e), failures, type(e).__name__)
+                start += len(chunk)
+                continue
+            
+            chunk_added, chunk_rejected, chunk_full = self.record_results(group, chunk, results, use_filter, failures)
+            added += chunk_added
+            rejected.extend(chunk_rejected)
+            full.extend(chunk_full)
+            start += len(chunk)
+        
+        return added, rejected, full
+
+    def _remove(self, items):
+        removed = 0
+        for item in items:
+            try:
+                item.group.subscription.unsubscribe(item.server_handle)
+                removed += 1
+            except Exception as e:
+                logger.debug(f"     ✗ Could not unsubscribe {item.node_id}: {e}")
+            self.drop(item)
+        
+        # Delete subscriptions that no longer monitor anything
+        for group in self.prune_groups():
+            self._delete_group(group)
+        return removed
+
+    def _modify(self, entries):
+        modified = 0
+        for item, params in entries:
+            try:
+                item.group.subscription.modify_monitored_item(item.server_handle, params.sampling_interval,
+                                                              params.queue_size)
+                item.params = params
+                modified += 1
+            except Exception as e:
+                logger.debug(f"     ✗ Could not modify {item.node_id}: {e}")
+        return modified
+
+subscription_manager = SubscriptionManager(datapoint_registry, notification_queue)
+
+# ==========================================
+# SESSION RESUMPTION
+# ==========================================
+
+class ResumableSubscription(Subscription):
+    """
+    python-opcua Subscription that remembers the last NotificationMessage it
+    delivered. After a session resume the messages after it are fetched again
+    with Republish, and messages that come in twice are acknowledged but not
+    delivered again.
+    """
+    def __init__(self, server, params, handler):
+        self.last_sequence = 0
+        super().__init__(server, params, handler)
+
+    def publish_callback(self, publishresult):
+        message = publishresult.NotificationMessage
+        if message.NotificationData:
+            if message.SequenceNumber <= self.last_sequence:
+                ack = ua.SubscriptionAcknowledgement()
+                ack.SubscriptionId = self.subscription_id
+                ack.SequenceNumber = message.SequenceNumber
+                self.server.publish([ack])
+                return
+            self.last_sequence = message.SequenceNumber
+        super().publish_callback(publishresult)
+
+    def deliver(self, message):
+        """Hand a republished NotificationMessage to the handler; False if it was already delivered"""
+        if message.SequenceNumber <= self.last_sequence:
+            return False
+        self.last_sequence = message.SequenceNumber
+        for notification in message.NotificationData or []:
+            if isinstance(notification, ua.DataChangeNotification):
+                self._call_datachange(notification)
+        return True
+
+class ResumableClient(Client):
+    """
+    python-opcua Client that can pick its session back up after the TCP
+    connection dropped. resume() opens a new secure channel and reactivates
+    the session on it. If the server has closed the session, resume() opens
+    a new session and moves the subscriptions to it with
+    TransferSubscriptions. In both cases every monitored item stays on the
+    server.
+    """
+    def create_subscription(self, period, handler):
+        params = ua.CreateSubscriptionParameters()
+        params.RequestedPublishingInterval = period
+        params.RequestedLifetimeCount = 10000
+        params.RequestedMaxKeepAliveCount = 3000
+        params.MaxNotificationsPerPublish = 10000
+        params.PublishingEnabled = True
+        params.Priority = 0
+        return ResumableSubscription(self.uaclient, params, handler)
+
+    def link_down(self):
+        """True once the receive thread has stopped (socket closed by the server or the network)"""
+        socket_client = self.uaclient._uasocket
+        return socket_client is None or socket_client._thread is None or not socket_client._thread.is_alive()
+
+    def resume(self, token, subscription_ids):
+        """
+        Reconnect without losing the subscriptions.
+        token is the dropped session's authentication token, captured when the drop was noticed:
+        a failed attempt leaves a new socket client with a null token behind.
+        Returns ('reactivated', {}) or ('transferred', {subscription_id: AvailableSequenceNumbers}).
+        Raises ua.UaError when the server has neither the session nor the subscriptions,
+        and network errors when it can't be reached.
+        """
+        self._drop_socket()
+        self.connect_socket()
+        self.send_hello()
+        self.open_secure_channel()
+        
+        self.uaclient._uasocket.authentication_token = token
+        try:
+            self._activate()
+            self.keepalive = KeepAlive(self, min(self.session_timeout, self.secure_channel_timeout) * 0.7)
+            self.keepalive.start()
+            return 'reactivated', {}
+        except ua.UaStatusCodeError as e:
+            logger.info(f"   Session not reactivated ({e}), transferring subscriptions to a new session")
+        
+        self.create_session()
+        self._activate()
+        return 'transferred', self.transfer_subscriptions(subscription_ids)
+
+    def _activate(self):
+        self.activate_session(username=self._username, password=self._password, certificate=self.user_certificate)
+
+    def _drop_socket(self):
+        if self.keepalive:
+            self.keepalive.stop()
+        try:
+            self.disconnect_socket()
+        except Exception as e:
+            logger.debug(f"Error closing dropped socket: {e}")
+
+    def transfer_subscriptions(self, subscription_ids):
+        """TransferSubscriptions to the current session; {subscription_id: AvailableSequenceNumbers} of those moved"""
+        if not subscription_ids:
+            return {}
+        request = ua.TransferSubscriptionsRequest()
+        request.Parameters.SubscriptionIds = subscription_ids
+        request.Parameters.SendInitialValues = False
+        data = self.uaclient._uasocket.send_request(request)
+        response = struct_from_binary(ua.TransferSubscriptionsResponse, data)
+        response.ResponseHeader.ServiceResult.check()
+        return {subscription_id: result.AvailableSequenceNumbers
+                for subscription_id, result in zip(subscription_ids, response.Parameters.Results)
+                if result.StatusCode.is_good()}
+
+    def republish(self, subscription_id, sequence_number):
+        """One NotificationMessage from the server's retransmission queue (None once it is no longer there)"""
+        request = ua.RepublishRequest()
+        request.Parameters.SubscriptionId = subscription_id
+        request.Parameters.RetransmitSequenceNumber = sequence_number
+        try:
+            data = self.uaclient._uasocket.send_request(request)
+        except ua.UaStatusCodeError as e:
+            if e.code == ua.StatusCodes.BadMessageNotAvailable:
+                return None
+            raise
+        response = struct_from_binary(ua.RepublishResponse, data)
+        response.ResponseHeader.ServiceResult.check()
+        return response.NotificationMessage
+
+# ==========================================
+# RATE CLASSES
+# ==========================================
+
+class ChangeRateObserver:
+    """
+    Observed change rate per node, used to move nodes without an explicit
+    rateClass between rate classes. A node whose notifications saturate its
+    current sampling rate is promoted one class; once it goes quiet it steps
+    back towards its default class (configured: normal, discovered: slow).
+    """
+    def __init__(self):
+        self.counts = Counter()  # node_id -> notifications since the last review (worker thread)
+        self.levels = {}  # node_id -> classes promoted above its default
+        self.auto_nodes = set()  # nodes without an explicit rateClass (set by desired_monitored_items)
+        self.last_review = time.time()
+
+    def note(self, node_id):
+        self.counts[node_id] += 1
+
+    def assign(self, node_id, default_class):
+        """Current automatic rate class for node_id"""
+        index = RATE_CLASS_ORDER.index(default_class) - self.levels.get(node_id, 0)
+        return RATE_CLASS_ORDER[max(0, index)]
+
+    def review(self, items):
+        """
+        Re-evaluate promotions from the counts since the last review.
+        items: live {node_id: MonitoredItem}. Returns True if any assignment changed.
+        """
+        now = time.time()
+        window = now - self.last_review
+        counts, self.counts = self.counts, Counter()
+        self.last_review = now
+        if window <= 0:
+            return False
+        
+        changed = False
+        for node_id, item in items.items():
+            if node_id not in self.auto_nodes:
+                continue
+            max_samples = window * 1000.0 / item.params.sampling_interval
+            saturation = counts.get(node_id, 0) / max_samples
+            level = self.levels.get(node_id, 0)
+            
+            if saturation >= RATE_PROMOTE_SATURATION and item.params.rate_class != RATE_CLASS_ORDER[0]:
+                self.levels[node_id] = level + 1
+                changed = True
+            elif saturation <= RATE_DEMOTE_SATURATION and level > 0:
+                if level == 1:
+                    self.levels.pop(node_id)
+                else:
+                    self.levels[node_id] = level - 1
+                changed = True
+        
+        # Forget nodes that are no longer monitored
+        for node_id in [node_id for node_id in self.levels if node_id not in items]:
+            self.levels.pop(node_id)
+        return changed
+
+rate_observer = ChangeRateObserver()
+
+# ==========================================
+# WATCH SET
+# ==========================================
+
+class WatchSet:
+    """
+    Discovered nodes somebody is looking at, pushed by the server as
+    'opcua_watch_set'. Only these discovered nodes are monitored; configured
+    datapoints always are. A node dropped from the set lingers for
+    WATCH_LINGER seconds so flipping between views doesn't churn monitored
+    items. Until the first set arrives (older servers never send one) every
+    discovered node is monitored, as before.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.watched = {}  # node_id -> linger deadline, None while watched
+        self.changed = False
+
+    def update(self, node_ids):
+        now = time.time()
+        node_ids = set(node_ids)
+        with self.lock:
+            self.enabled = True
+            for node_id in node_ids:
+                if node_id not in self.watched:
+                    self.changed = True
+                self.watched[node_id] = None
+            for node_id, expires in self.watched.items():
+                if node_id not in node_ids and expires is None:
+                    self.watched[node_id] = now + WATCH_LINGER
+
+    def expire(self):
+        """Drop nodes whose linger ran out. Returns True if any were dropped."""
+        now = time.time()
+        with self.lock:
+            lapsed = [node_id for node_id, expires in self.watched.items()
+                      if expires is not None and expires <= now]
+            for node_id in lapsed:
+                self.watched.pop(node_id)
+        return bool(lapsed)
+
+    def pop_changed(self):
+        """True once after nodes were added to the set"""
+        with self.lock:
+            changed, self.changed = self.changed, False
+        return changed
+
+    def includes(self, node_id):
+        with self.lock:
+            return not self.enabled or node_id in self.watched
+
+watch_set = WatchSet()
+
+# ==========================================
+# BULK READ / POLLING
+# ==========================================
+
+def _bad_data_value(status=None):
+    data_value = ua.DataValue()
+    data_value.StatusCode = ua.StatusCode(status or ua.StatusCodes.BadCommunicationError)
+    return data_value
+
+def _bulk_read_requests(client, read_value_ids, limits=None):
+    """Send ReadValueIds in chunks of MaxNodesPerRead; a failed chunk yields Bad DataValues"""
+    chunk_size = (limits or {}).get('MaxNodesPerRead') or DEFAULT_MAX_NODES_PER_READ
+    results = []
+    
+    for start in range(0, len(read_value_ids), chunk_size):
+        chunk = read_value_ids[start:start + chunk_size]
+        try:
+            params = ua.ReadParameters()
+            params.TimestampsToReturn = ua.TimestampsToReturn.Both
+            params.NodesToRead = chunk
+            results.extend(client.uaclient.read(params))
+        except Exception as e:
+            logger.warning(f"⚠️  Bulk read of {len(chunk)} attribute(s) failed: {e}")
+            results.extend(_bad_data_value() for _ in chunk)
+    
+    return results
+
+def _read_value_id(node_id, attribute):
+    rv = ua.ReadValueId()
+    rv.NodeId = ua.NodeId.from_string(node_id) if isinstance(node_id, str) else node_id
+    rv.AttributeId = attribute
+    return rv
+
+def bulk_read(client, node_ids, attribute=ua.AttributeIds.Value, limits=None):
+    """
+    Read one attribute of many nodes with one Read request per chunk of
+    ReadValueIds (chunked by the server's MaxNodesPerRead).
+    Returns DataValues aligned with node_ids; a failed chunk yields Bad DataValues.
+    """
+    return _bulk_read_requests(client, [_read_value_id(node_id, attribute) for node_id in node_ids], limits)
+
+def bulk_read_attributes(client, node_ids, attributes, limits=None):
+    """Read several attributes per node in the same Read requests; returns one tuple of DataValues per node"""
+    read_value_ids = [_read_value_id(node_id, attribute) for node_id in node_ids for attribute in attributes]
+    results = _bulk_read_requests(client, read_value_ids, limits)
+    width = len(attributes)
+    return [tuple(results[i:i + width]) for i in range(0, len(results), width)]
+
+class Poller:
+    """
+    Polling alternative to SubscriptionManager for servers whose subscription
+    support is poor. Reads all desired nodes with bulk_read() every poll
+    interval and feeds changed values into the same notification pipeline.
+    Nodes get synthetic negative handles so the worker path is unchanged
+    (server-assigned client handles are always positive).
+    """
+    def __init__(self, registry, queue):
+        self.registry = registry
+        self.queue = queue
+        self.client = None
+        self.limits = None
+        self.interval = DEFAULT_POLL_INTERVAL / 1000.0
+        self.items = {}  # node_id -> synthetic handle
+        self._node_ids = []  # [(handle, ua.NodeId)] snapshot used by the poll thread
+        self._last = {}  # handle -> (value, status) from the previous poll
+        self._next_handle = 0
+        self._stop = None
+        self._thread = None
+
+    @property
+    def active(self):
+        return self._thread is not None
+
+    def start(self, client, limits=None, interval_ms=None):
+        self.client = client
+        self.limits = limits
+        self.interval = max(interval_ms or DEFAULT_POLL_INTERVAL, MIN_POLL_INTERVAL) / 1000.0
+        self.items = {}
+        self._node_ids = []
+        self._last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name='opcua-poller', daemon=True)
+        self._thread.start()
+        logger.info(f"📡 Polling mode (interval: {int(self.interval * 1000)}ms)")
+
+    def close(self, timeout=5):
+        if self._stop:
+            self._stop.set()
+        if self._thread:
+            # Wait out an in-flight bulk_read so it can't use the client after disconnect
+            self._thread.join(timeout)
+        self._thread = None
+        self.client = None
+        self.items = {}
+        self._node_ids = []
+        self.registry.clear_handles()
+
+    def reconcile(self, desired):
+        """Same contract as SubscriptionManager.reconcile (nothing to modify when polling; deadbands apply on the Pi)"""
+        removed = [node_id for node_id in self.items if node_id not in desired]
+        added = [node_id for node_id in desired if node_id not in self.items]
+        
+        for node_id in removed:
+            self.registry.unbind(self.items.pop(node_id))
+            self.registry.set_client_deadband(node_id, None)
+        for node_id in added:
+            self._next_handle -= 1
+            self.items[node_id] = self._next_handle
+            self.registry.bind(self._next_handle, node_id)
+        for node_id, params in desired.items():
+            self.registry.set_client_deadband(node_id, params)
+        
+        # Swap the snapshot the poll thread iterates over
+        self._node_ids = [(handle, ua.NodeId.from_string(node_id)) for node_id, handle in self.items.items()]
+        return len(added), len(removed), 0, 0
+
+    def _run(self, stop):
+        while not stop.is_set():
+            started = time.time()
+            node_ids = self._node_ids
+            if node_ids and self.client:
+                try:
+                    self._poll(node_ids)
+                except Exception as e:
+                    logger.error(f"❌ Poll cycle failed: {e}")
+            stop.wait(max(0.0, self.interval - (time.time() - started)))
+
+    def _poll(self, node_ids):
+        data_values = bulk_read(self.client, [node_id for _, node_id in node_ids], limits=self.limits)
+        last = self._last
+        for (handle, _), data_value in zip(node_ids, data_values):
+            # Only changed value/status is reported, like a subscription would
+            sample = (data_value.Value.Value if data_value.Value else None, data_value.StatusCode.value)
+            if last.get(handle) != sample:
+                last[handle] = sample
+                self.queue.put((handle, None, data_value))
+
+poller = Poller(datapoint_registry, notification_queue)
+
+def acquisition_mode():
+    """'subscription' (default) or 'poll', from the fetched config"""
+    return (config or {}).get('acquisition_mode') or 'subscription'
+
+def acquisition_active():
+    return subscription_manager.active or poller.active
+
+
+def desired_monitored_items(server_id=None):
+    """
+    Build the {node_id: MonitoringParams} map the subscriptions should contain.
+    Configured datapoints carry their own filter fields; discovered nodes are
+    only included while in the watch set and take the first
+    config['monitoring_rules'] entry whose NodeId pattern matches.
+    The rate class is the explicit rateClass, else the observed-rate assignment
+    starting from 'normal' (configured) or 'slow' (discovered-only).
+    server_id limits the map to that OPC UA server's nodes.
+    """
+    desired = {}
+    servers = {}  # node_id -> server id
+    auto_nodes = set()
+    rules = [rule for rule in (config or {}).get('monitoring_rules') or [] if rule.get('pattern')]
+    
+    def rate_class(node_id, source, default_class):
+        explicit = (source or {}).get('rateClass')
+        if explicit in RATE_CLASSES:
+            return explicit
+        auto_nodes.add(node_id)
+        return rate_observer.assign(node_id, default_class)
+    
+    for dp in datapoints:
+        node_id = datapoint_key(dp)
+        if node_id not in desired:
+            desired[node_id] = monitoring_params(dp, rate_class(node_id, dp, 'normal'))
+            servers[node_id] = node_server_id(dp)
+    
+    for node_data in discovered_nodes_cache:
+        node_id = node_data['opcNodeId']
+        if node_id not in desired and watch_set.includes(node_id):
+            rule = next((rule for rule in rules if fnmatch.fnmatchcase(node_id, rule['pattern'])), None)
+            desired[node_id] = monitoring_params(rule, rate_class(node_id, rule, 'slow'))
+            servers[node_id] = node_server_id(node_data)
+    
+    # Rate assignments cover every server, so one session's call doesn't drop another's auto nodes
+    rate_observer.auto_nodes = auto_nodes
+    if server_id is None:
+        return desired
+    return {node_id: params for node_id, params in desired.items() if servers[node_id] == server_id}
+
+def compute_config_hash(cfg, dps):
+    """Stable hash of fetched config + datapoints, used to skip no-op refreshes"""
+    payload = json.dumps({'config': cfg, 'datapoints': dps}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def opcua_servers(cfg):
+    """
+    OPC UA servers of a config, primary first: [{'id', 'name', 'ip', 'port', 'timeout'}].
+    Multi-server configs list them in opcua_servers; otherwise the single
+    opcua_server_ip/port is the primary server.
+    """
+    servers = []
+    for server in cfg.get('opcua_servers') or [{'ip': cfg.get('opcua_server_ip'), 'port': cfg.get('opcua_server_port')}]:
+        if not server.get('ip'):
+            continue
+        address = f"{server['ip']}:{server.get('port') or 4840}"
+        servers.append({
+            'id': str(server.get('id') or address),
+            'name': server.get('name') or address,
+            'ip': server['ip'],
+            'port': server.get('port') or 4840,
+            'timeout': server.get('connection_timeout') or cfg.get('connection_timeout')
+        })
+    return servers
+
+def node_key(server_id, node_id):
+    """
+    Pi-wide key of a node (registry, last values, watch set, discovered opcNodeId).
+    NodeIds of the primary server are used as-is so single-server data stays
+    valid; other servers' NodeIds are prefixed with their server id.
+    """
+    if not server_id or server_id == primary_server_id:
+        return node_id
+    return f"{server_id}{NODE_KEY_SEPARATOR}{node_id}"
+
+def node_server_id(node):
+    """Server a datapoint or discovered node belongs to (no serverId = primary)"""
+    return node.get('serverId') or primary_server_id
+
+def datapoint_key(dp):
+    return node_key(dp.get('serverId'), dp['opcNodeId'])
+
+def primary_server(cfg):
+    """The server this runtime connects to (opcua_servers[0] when listed, so the legacy fields can't go stale)"""
+    servers = opcua_servers(cfg)
+    return servers[0] if servers else None
+
+def connection_key(cfg):
+    """Config fields that require a new OPC UA session when they change"""
+    server = primary_server(cfg) or {}
+    return (server.get('ip'), server.get('port'), server.get('timeout'), cfg.get('acquisition_mode') or 'subscription')
+
+# ==========================================
+# FUNCTIONS
+# ==========================================
+
+def _fetch_config_request():
+    """Internal function to fetch config (called through the 'config' circuit breaker)"""
+    logger.info(f"📡 Fetching configuration for Raspberry Pi: {RASPBERRY_ID}")
+    headers = {'X-Raspberry-ID': RASPBERRY_ID}
+    if config_version:
+        headers['If-None-Match'] = f'"{config_version}"'
+    response = transport.request('GET', 'config', CONFIG_ENDPOINT, headers=headers)
+    note_accept_encoding(response)
+    
+    if response.status_code == 304:
+        logger.debug("Configuration not modified")
+        return None
+    
+    if response.status_code == 403:
+        raise Exception("Unauthorized: Raspberry Pi not registered in system")
+    
+    if response.status_code == 404:
+        raise Exception("Configuration not found. Please configure device in admin panel")
+    
+    response.raise_for_status()
+    data = response.json()
+    
+    if not data.get('success'):
+        raise Exception(data.get('error', 'Unknown error'))
+    
+    if not data.get('version'):
+        data['version'] = response.headers.get('ETag', '').strip('"') or None
+    return data
+
+def fetch_config():
+    """
+    Fetch configuration from API (uploader thread, single attempt per breaker window).
+    Returns (fetched, data); data is None on failure or when the server answered 304.
+    """
+    return guarded_call('config', _fetch_config_request)
+
+def load_config(data):
+    """Install a fetched configuration (main loop)"""
+    global config, datapoints, primary_server_id
+    
+    config = data['config']
+    datapoints = data['datapoints']
+    servers = opcua_servers(config)
+    primary_server_id = servers[0]['id'] if servers else None
+    datapoint_registry.compile(datapoints, discovered_nodes_cache)
+    flush_scheduler.set_mode(config.get('coalesce_mode', 'all'))
+    
+    logger.info(f"✅ Configuration loaded:")
+    logger.info(f"   Raspberry Pi: {config['raspberryName']}")
+    for server in servers:
+        logger.info(f"   OPC UA Server: {server['name']} ({server['ip']}:{server['port']})")
+    logger.info(f"   Poll Interval: {config['poll_interval']}ms")
+    logger.info(f"   Datapoints to monitor: {len(datapoints)}")
+
+def read_operation_limits(client):
+    """Read ServerCapabilities.OperationLimits in a single Read call (missing/unreadable -> 0)"""
+    limits = {name: 0 for name in OPERATION_LIMIT_NODES}
+    
+    try:
+        params = ua.ReadParameters()
+        for node_id in OPERATION_LIMIT_NODES.values():
+            rv = ua.ReadValueId()
+            rv.NodeId = ua.NodeId.from_string(node_id)
+            rv.AttributeId = ua.AttributeIds.Value
+            params.NodesToRead.append(rv)
+        
+        results = client.uaclient.read(params)
+        for name, result in zip(OPERATION_LIMIT_NODES, results):
+            if result.StatusCode.is_good() and result.Value.Value:
+                limits[name] = int(result.Value.Value)
+    except Exception as e:
+        logger.debug(f"Could not read operation limits: {e}")
+    
+    logger.info(f"   Operation limits: {limits}")
+    return limits
+
+def connect_opcua():
+    """Connect to OPC UA server"""
+    global opcua_client, opcua_connection_status, applied_connection_key, operation_limits
+    
+    try:
+        if not config:
+            logger.error("❌ No configuration loaded. Cannot connect to OPC UA server.")
+            return False
+        
+        server = primary_server(config)
+        if not server:
+            logger.error("❌ No OPC UA server configured. Cannot connect.")
+            return False
+        
+        opcua_url = f"opc.tcp://{server['ip']}:{server['port']}"
+        logger.info(f"🔗 Connecting to OPC UA server: {opcua_url}")
+        
+        opcua_client = ResumableClient(opcua_url)
+        
+        # Set timeout if the method exists (newer versions)
+        if hasattr(opcua_client, 'set_session_timeout'):
+            opcua_client.set_session_timeout(server['timeout'] or 60000)
+        
+        opcua_client.connect()
+        applied_connection_key = connection_key(config)
+        operation_limits = read_operation_limits(opcua_client)
+        
+        # Log successful connection
+        old_status = opcua_connection_status
+        opcua_connection_status = 'Connected'
+        log_event(
+            event_type='connection_restored',
+            quality='Good',
+            message=f"Connected to OPC UA server {server['ip']}:{server['port']}",
+            metadata={
+                'opcua_server_ip': server['ip'],
+                'opcua_server_port': server['port'],
+                'previous_status': old_status
+            }
+        )
+        
+        logger.info(f"✅ Connected to OPC UA server: {server['ip']}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Failed to connect to OPC UA server: {e}")
         old_status = opcua_connection_status
         opcua_connection_status = 'Disconnected'
         log_event(
@@ -633,18 +2803,15 @@ def connect_opcua():
 
 def disconnect_opcua():
     """Disconnect from OPC UA server and clean up subscriptions"""
-    global opcua_client, subscription, subscription_handles
+    global opcua_client, applied_connection_key, session_lost_at, lost_session_token
     
-    # Clean up subscriptions first
-    if subscription:
-        try:
-            subscription.delete()
-            logger.info("🗑️  Deleted OPC UA subscription")
-        except Exception as e:
-            logger.debug(f"Error deleting subscription: {e}")
-        finally:
-            subscription = None
-            subscription_handles = []
+    # Clean up subscriptions (or poller) first
+    with acquisition_lock:
+        subscription_manager.close()
+        poller.close()
+    applied_connection_key = None
+    session_lost_at = None
+    lost_session_token = None
     
     # Disconnect client
     if opcua_client:
@@ -652,115 +2819,295 @@ def disconnect_opcua():
             opcua_client.disconnect()
             logger.info("🔌 Disconnected from OPC UA server")
         except Exception as e:
-            logger.error(f"Error disconnecting: {e}")
-        finally:
-            opcua_client = None
+            logger.error(f"Error disconnecting: {e}")
+        finally:
+            opcua_client = None
+
+def resume_opcua_session():
+    """
+    Recover a dropped OPC UA connection without recreating the monitored items.
+    The session is reactivated on a new secure channel, or its subscriptions
+    are transferred to a new session. Notifications the server sent while
+    the link was down are then fetched again with Republish. While the
+    server can't be reached, this retries every SESSION_RESUME_RETRY seconds
+    (every RETRY_INTERVAL after SESSION_RESUME_FAST_WINDOW). Only when the
+    server answers but no longer has the subscriptions are they torn down,
+    and main_loop then rebuilds everything from scratch. Any failure that
+    isn't a network error (including python-opcua internals that changed
+    under ResumableClient) also falls back to that plain reconnect.
+    Returns True once the session is usable again.
+    """
+    global session_lost_at, last_resume_attempt, lost_session_token, opcua_connection_status
+    
+    if not SESSION_RESUME:
+        logger.warning("⚠️  OPC UA connection dropped, reconnecting...")
+        disconnect_opcua()
+        return False
+    
+    current_time = time.time()
+    if session_lost_at is None:
+        session_lost_at = current_time
+        last_resume_attempt = 0
+        lost_session_token = getattr(getattr(opcua_client.uaclient, '_uasocket', None), 'authentication_token', None)
+        if opcua_connection_status != 'Disconnected':
+            old_status = opcua_connection_status
+            opcua_connection_status = 'Disconnected'
+            log_event(
+                event_type='connection_lost',
+                quality='Bad',
+                message='OPC UA connection dropped, resuming session',
+                metadata={'previous_status': old_status}
+            )
+        logger.warning("⚠️  OPC UA connection dropped, resuming session...")
+    
+    retry = SESSION_RESUME_RETRY if current_time - session_lost_at < SESSION_RESUME_FAST_WINDOW else RETRY_INTERVAL
+    if current_time - last_resume_attempt < retry:
+        return False
+    last_resume_attempt = current_time
+    
+    with acquisition_lock:
+        groups = [group for class_groups in subscription_manager.groups.values() for group in class_groups]
+        subscription_ids = [group.subscription.subscription_id for group in groups]
+        try:
+            mode, available = opcua_client.resume(lost_session_token, subscription_ids)
+            if mode == 'transferred' and len(available) < len(subscription_ids):
+                raise ua.UaError(f"server kept {len(available)} of {len(subscription_ids)} subscriptions")
+        except (OSError, concurrent.futures.TimeoutError, concurrent.futures.CancelledError) as e:
+            logger.warning(f"⚠️  OPC UA server still unreachable ({str(e) or type(e).__name__}), next resume attempt in {retry}s")
+            return False
+        except Exception as e:
+            logger.warning(f"⚠️  Session could not be resumed ({str(e) or type(e).__name__}), recreating subscriptions")
+            disconnect_opcua()
+            return False
+        
+        # Fetch what was sent while the link was down, then restart the publish loop of every subscription
+        republished = 0
+        for group in groups:
+            subscription = group.subscription
+            sequence_numbers = available.get(subscription.subscription_id)
+            acks = []
+            try:
+                for sequence_number in missed_sequence_numbers(subscription, sequence_numbers):
+                    message = opcua_client.republish(subscription.subscription_id, sequence_number)
+                    if message is None:
+                        if sequence_numbers is None:
+                            break
+                        continue
+                    if subscription.deliver(message):
+                        republished += 1
+                    ack = ua.SubscriptionAcknowledgement()
+                    ack.SubscriptionId = subscription.subscription_id
+                    ack.SequenceNumber = sequence_number
+                    acks.append(ack)
+            except Exception as e:
+                logger.warning(f"⚠️  Republish on subscription {subscription.subscription_id} stopped: {e}")
+            opcua_client.uaclient.publish(acks)
+    
+    downtime = time.time() - session_lost_at
+    old_status = opcua_connection_status
+    opcua_connection_status = 'Connected'
+    session_lost_at = None
+    lost_session_token = None
+    log_event(
+        event_type='connection_restored',
+        quality='Good',
+        message=f"OPC UA session resumed ({mode}) after {downtime:.1f}s, {republished} missed notification message(s) republished",
+        metadata={'resumed': mode, 'republished': republished, 'downtime': round(downtime, 1),
+                  'previous_status': old_status}
+    )
+    logger.info(f"✅ OPC UA session {mode} after {downtime:.1f}s: {len(groups)} subscription(s) kept, "
+                f"{republished} missed notification message(s) republished")
+    return True
+
+def missed_sequence_numbers(subscription, available=None):
+    """
+    Sequence numbers to Republish for a subscription: the server's list when it
+    gave one (TransferSubscriptions), otherwise the ones after the last delivered
+    message, until the server has no more
+    """
+    if available is not None:
+        return sorted(number for number in available if number > subscription.last_sequence)[:REPUBLISH_MAX_MESSAGES]
+    return range(subscription.last_sequence + 1, subscription.last_sequence + 1 + REPUBLISH_MAX_MESSAGES)
 
 def setup_subscriptions():
     """Setup OPC UA subscriptions for all configured datapoints AND discovered nodes"""
-    global subscription, subscription_handles, discovered_nodes_cache
-    
+    with acquisition_lock:
+        return _setup_subscriptions()
+
+def _setup_subscriptions():
     try:
         if not opcua_client:
             logger.warning("⚠️  Cannot setup subscriptions: No client")
             return False
         
-        # Create subscription with handler
-        handler = DataChangeHandler()
-        subscription = opcua_client.create_subscription(SUBSCRIPTION_INTERVAL, handler)
+        datapoint_registry.compile(datapoints, discovered_nodes_cache)
         
-        logger.info(f"📡 Creating subscription (interval: {SUBSCRIPTION_INTERVAL}ms)")
-        
-        # Subscribe to configured datapoints
-        subscription_handles = []
-        subscribed_node_ids = set()  # Track subscribed nodes to avoid duplicates
+        if acquisition_mode() == 'poll':
+            poller.start(opcua_client, operation_limits, config.get('poll_interval'))
+            added, _, _, _ = poller.reconcile(desired_monitored_items(primary_server_id))
+            logger.info(f"✅ Polling {added} nodes")
+            return True
         
-        if datapoints:
-            logger.info(f"  📍 Subscribing to {len(datapoints)} configured datapoints...")
-            for dp in datapoints:
-                try:
-                    if dp['opcNodeId'] not in subscribed_node_ids:
-                        node = opcua_client.get_node(dp['opcNodeId'])
-                        handle = subscription.subscribe_data_change(node)
-                        subscription_handles.append(handle)
-                        subscribed_node_ids.add(dp['opcNodeId'])
-                        logger.info(f"     ✓ Datapoint: {dp.get('label', dp['opcNodeId'])}")
-                except Exception as e:
-                    logger.error(f"     ✗ Failed to subscribe to {dp['opcNodeId']}: {e}")
+        # Subscriptions are created per rate class as items are added
+        subscription_manager.create(opcua_client, operation_limits, config.get('max_items_per_subscription'))
         
-        # 🔥 NEW: Also subscribe to ALL discovered nodes for real-time monitoring
-        if discovered_nodes_cache:
-            logger.info(f"  🔍 Subscribing to {len(discovered_nodes_cache)} discovered nodes...")
-            discovered_count = 0
-            for node_data in discovered_nodes_cache:
-                try:
-                    node_id = node_data['opcNodeId']
-                    # Skip if already subscribed (via datapoints)
-                    if node_id not in subscribed_node_ids:
-                        node = opcua_client.get_node(node_id)
-                        handle = subscription.subscribe_data_change(node)
-                        subscription_handles.append(handle)
-                        subscribed_node_ids.add(node_id)
-                        discovered_count += 1
-                except Exception as e:
-                    logger.debug(f"     ✗ Could not subscribe to {node_data.get('variableName', node_id)}: {e}")
-            
-            logger.info(f"     ✓ Subscribed to {discovered_count} discovered nodes")
+        logger.info(f"  📍 Subscribing to {len(datapoints)} configured datapoints and {len(discovered_nodes_cache)} discovered nodes...")
+        added, _, _, failed = subscription_manager.reconcile(desired_monitored_items(primary_server_id))
         
-        logger.info(f"✅ Total subscriptions: {len(subscription_handles)} nodes")
+        logger.info(f"✅ Total subscriptions: {added} nodes ({subscription_manager.max_items_per_call} per call), "
+                    f"by rate class (subscriptions, items): {subscription_manager.summary()}")
         return True
         
     except Exception as e:
         logger.error(f"❌ Failed to setup subscriptions: {e}")
         return False
 
+def reconcile_subscriptions():
+    """Apply config/discovery changes to the live subscription without reconnecting"""
+    with acquisition_lock:
+        return _reconcile_subscriptions()
+
+def _reconcile_subscriptions():
+    acquisition = poller if poller.active else subscription_manager
+    if not acquisition.active:
+        return False
+    
+    try:
+        datapoint_registry.compile(datapoints, discovered_nodes_cache)
+        added, removed, modified, failed = acquisition.reconcile(desired_monitored_items(primary_server_id))
+        
+        if added or removed or modified or failed:
+            logger.info(f"🔁 Reconciled subscription: +{added} -{removed} ~{modified} "
+                        f"({failed} failed, {len(acquisition.items)} total)")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Failed to reconcile subscriptions: {e}")
+        return False
+
+def review_rate_classes():
+    """Move auto-assigned nodes between rate classes from their observed change rate"""
+    with acquisition_lock:
+        if not subscription_manager.active:
+            return False
+        if not rate_observer.review(subscription_manager.items):
+            return False
+        logger.info("🔁 Observed change rates moved nodes between rate classes, reconciling...")
+        return _reconcile_subscriptions()
+
+def check_server_support():
+    """
+    This runtime only monitors the primary server; datapoints assigned to any
+    other configured server are never collected. Report that loudly instead
+    of dropping them: an error and a servers_unsupported event whenever the set
+    of unmonitored servers changes, and 'Unsupported' for each of them in the
+    heartbeat (server_status). opcua_client_async.py monitors all servers.
+    """
+    global unmonitored_servers
+    
+    servers = opcua_servers(config)[1:]
+    if servers == unmonitored_servers:
+        return
+    unmonitored_servers = servers
+    if not servers:
+        return
+    
+    skipped = [dp for dp in datapoints if node_server_id(dp) != primary_server_id]
+    names = ', '.join(server['name'] for server in servers)
+    logger.error(f"❌ Config lists {len(servers) + 1} OPC UA servers but opcua_client.py only monitors the primary "
+                 f"server; {len(skipped)} datapoint(s) on {names} are NOT collected. "
+                 f"Run opcua_client_async.py to monitor all of them")
+    log_event(
+        event_type='servers_unsupported',
+        quality='Bad',
+        message=f"{len(skipped)} datapoint(s) on {names} not collected: this runtime only monitors the primary OPC UA server",
+        metadata={'servers': [server['id'] for server in servers], 'datapoints': [str(dp['id']) for dp in skipped]}
+    )
+
+def server_status():
+    """Per-server connection state, reported with the heartbeat (same shape as the asyncio runtime's)"""
+    if not config:
+        return []
+    return [{'id': server['id'], 'name': server['name'],
+             'status': opcua_connection_status if server['id'] == primary_server_id else 'Unsupported'}
+            for server in opcua_servers(config)]
+
+def apply_config():
+    """
+    Apply a freshly fetched config.
+    Unchanged config is a no-op; datapoint changes are reconciled in place;
+    only a changed server endpoint forces a reconnect.
+    Returns False if the OPC UA connection could not be (re)established.
+    """
+    global applied_config_hash
+    
+    check_server_support()
+    new_hash = compute_config_hash(config, datapoints)
+    
+    if opcua_client and applied_connection_key == connection_key(config):
+        if new_hash != applied_config_hash:
+            logger.info("🔁 Configuration changed, reconciling subscriptions in place")
+            if acquisition_active():
+                reconcile_subscriptions()
+            else:
+                datapoint_registry.compile(datapoints, discovered_nodes_cache)
+        else:
+            logger.debug("Configuration unchanged")
+        applied_config_hash = new_hash
+        return True
+    
+    # Server endpoint changed (or not connected yet) - reconnect
+    disconnect_opcua()
+    if not connect_opcua():
+        return False
+    applied_config_hash = new_hash
+    return True
+
 def read_datapoints():
-    """Read all configured datapoints from OPC UA server"""
-    if not opcua_client or not datapoints:
+    """Read all configured datapoints from OPC UA server (bulk Read, one request per chunk)"""
+    primary_datapoints = [dp for dp in datapoints if node_server_id(dp) == primary_server_id]
+    if not opcua_client or not primary_datapoints:
         return []
     
+    data_values = bulk_read(opcua_client, [dp['opcNodeId'] for dp in primary_datapoints], limits=operation_limits)
     data = []
     
-    for dp in datapoints:
-        try:
-            node = opcua_client.get_node(dp['opcNodeId'])
-            value = node.get_data_value()
-            
-            data.append({
-                'datapointId': str(dp['id']),
-                'equipmentId': dp['equipmentId'],
-                'opcNodeId': dp['opcNodeId'],
-                'value': value.Value.Value,
-                'quality': 'Good' if value.StatusCode.is_good() else 'Bad',
-                'timestamp': value.SourceTimestamp.isoformat() + 'Z' if value.SourceTimestamp else datetime.utcnow().isoformat() + 'Z'
-            })
-            
-        except Exception as e:
-            logger.warning(f"⚠️  Failed to read {dp['opcNodeId']}: {e}")
-            data.append({
-                'datapointId': str(dp['id']),
-                'equipmentId': dp['equipmentId'],
-                'opcNodeId': dp['opcNodeId'],
-                'value': None,
-                'quality': 'Bad',
-                'timestamp': datetime.utcnow().isoformat() + 'Z'
-            })
+    for dp, value in zip(primary_datapoints, data_values):
+        status_code = value.StatusCode
+        if not status_code.is_good():
+            logger.warning(f"⚠️  Failed to read {dp['opcNodeId']}: {getattr(status_code, 'name', status_code)}")
+        
+        data.append({
+            'datapointId': str(dp['id']),
+            'equipmentId': dp['equipmentId'],
+            'opcNodeId': dp['opcNodeId'],
+            'value': value.Value.Value if value.Value and status_code.is_good() else None,
+            'quality': 'Good' if status_code.is_good() else ('Uncertain' if status_code.is_uncertain() else 'Bad'),
+            'statusCode': getattr(status_code, 'name', str(status_code)),
+            'timestamp': value.SourceTimestamp.isoformat() + 'Z' if value.SourceTimestamp else datetime.utcnow().isoformat() + 'Z'
+        })
     
     return data
 
-def _upload_data(data):
-    """Internal function to upload data (used by retry mechanism)"""
+def _upload_data(data, seq=None):
+    """Internal function to upload data (called through the 'data' circuit breaker)"""
     headers = {
         'X-Raspberry-ID': RASPBERRY_ID,
         'Content-Type': 'application/json'
     }
     
-    payload = {
+    header = {
         'raspberryId': RASPBERRY_ID,
-        'data': data
+        'epoch': uplink_spool.epoch,
+        'seq': seq
     }
     
-    response = requests.post(DATA_ENDPOINT, json=payload, headers=headers, timeout=10)
+    if http_uplink_encoding == UPLINK_ENCODING:
+        headers['Content-Type'] = 'application/x-msgpack'
+        body = uplink_encoder.encode(data, header, stateless=True)
+        response = post_uplink('data', DATA_ENDPOINT, headers, body=body)
+    else:
+        response = post_uplink('data', DATA_ENDPOINT, headers, dict(header, data=data))
     response.raise_for_status()
     
     result = response.json()
@@ -769,49 +3116,60 @@ def _upload_data(data):
     
     return result
 
-def push_data_websocket(data):
-    """Push data via WebSocket (primary method)"""
+def data_frame(data):
+    """
+    One opcua_data_change frame per batch: configured datapoints of every
+    equipment in 'data', grouped by equipment and indexed by
+    'equipment' = [[equipmentId, start, count], ...] (the items themselves
+    drop equipmentId), plus all discovered nodes in 'discovered_nodes'.
+    """
+    equipment_data = {}
+    discovered_nodes = []
+    
+    for item in data:
+        if 'equipmentId' in item and 'datapointId' in item:
+            # This is a configured datapoint
+            equipment_data.setdefault(item['equipmentId'], []).append(
+                {key: value for key, value in item.items() if key != 'equipmentId'})
+        else:
+            # This is a discovered node (only has opcNodeId, value, quality, timestamp)
+            discovered_nodes.append(item)
+    
+    configured_datapoints = []
+    equipment_index = []
+    for equipment_id, items in equipment_data.items():
+        equipment_index.append([equipment_id, len(configured_datapoints), len(items)])
+        configured_datapoints.extend(items)
+    
+    return {
+        'raspberryId': RASPBERRY_ID,
+        'equipment': equipment_index,
+        'data': configured_datapoints,
+        'discovered_nodes': discovered_nodes
+    }
+
+def push_data_websocket(data, seq):
+    """
+    Send one spooled batch via WebSocket (primary method) without waiting for the server.
+    The frame carries (epoch, seq); data_window collects the ack.
+    """
     try:
         if not websocket_connected or not sio.connected:
             return False
         
-        # Separate configured datapoints from discovered nodes
-        configured_datapoints = []
-        discovered_nodes = []
+        header = {'raspberryId': RASPBERRY_ID, 'epoch': uplink_spool.epoch, 'seq': seq}
+        if ws_uplink_encoding == UPLINK_ENCODING:
+            frame = uplink_encoder.encode(data, header)
+            summary = f"{len(frame)} bytes {UPLINK_ENCODING}"
+        else:
+            frame = dict(data_frame(data), **header)
+            summary = (f"{len(frame['data'])} configured in {len(frame['equipment'])} equipment, "
+                       f"{len(frame['discovered_nodes'])} discovered")
         
-        for item in data:
-            if 'equipmentId' in item and 'datapointId' in item:
-                # This is a configured datapoint
-                configured_datapoints.append(item)
-            else:
-                # This is a discovered node (only has opcNodeId, value, quality, timestamp)
-                discovered_nodes.append(item)
-        
-        # Handle configured datapoints (group by equipmentId)
-        if configured_datapoints:
-            equipment_data = {}
-            for item in configured_datapoints:
-                eq_id = item['equipmentId']
-                if eq_id not in equipment_data:
-                    equipment_data[eq_id] = []
-                equipment_data[eq_id].append(item)
-            
-            # Emit for each equipment group
-            for equipment_id, items in equipment_data.items():
-                sio.emit('opcua_data_change', {
-                    'raspberryId': RASPBERRY_ID,
-                    'equipmentId': equipment_id,
-                    'data': items
-                })
-        
-        # Handle discovered nodes (send as batch with node updates)
-        if discovered_nodes:
-            sio.emit('opcua_data_change', {
-                'raspberryId': RASPBERRY_ID,
-                'discovered_nodes': discovered_nodes
-            })
+        data_window.add(seq, data)  # (Re)arm before emitting so the ack can't be missed
+        sio.emit('opcua_data_change', frame, callback=lambda response=None: data_window.ack(seq, response))
         
-        logger.info(f"📤 Pushed {len(data)} datapoints via WebSocket ({len(configured_datapoints)} configured, {len(discovered_nodes)} discovered)")
+        logger.info(f"📤 Pushed {len(data)} datapoints via WebSocket ({summary})")
         return True
         
     except Exception as e:
@@ -819,57 +3177,85 @@ def push_data_websocket(data):
         return False
 
 def push_data(data):
-    """Push data to cloud (WebSocket first, HTTP fallback)"""
-    global pending_data_queue
+    """
+    Queue data for the cloud (WebSocket first, HTTP fallback).
+    Every batch is written to the durable spool first and only acknowledged
+    once sent, so older batches always go out before newer ones.
+    Sending happens on the uploader thread.
+    """
+    if data:
+        uplink_spool.append('data', data)
     
-    # Try to upload pending data first via HTTP
-    if pending_data_queue:
-        logger.info(f"🔄 Attempting to upload {len(pending_data_queue)} pending data batches...")
-        uploaded_count = 0
-        failed_batches = []
-        
-        for batch in pending_data_queue:
-            success, _ = retry_with_backoff(_upload_data, batch)
-            if success:
-                uploaded_count += 1
-            else:
-                failed_batches.append(batch)
-        
-        if uploaded_count > 0:
-            logger.info(f"✅ Successfully uploaded {uploaded_count} pending batches")
-        
-        pending_data_queue = failed_batches
+    uploader.wake()
+
+def drain_data_spool():
+    """Send spooled data batches in order (uploader thread): pipelined over the WebSocket, else over HTTP"""
+    if websocket_connected and sio.connected:
+        return drain_data_websocket()
     
-    # Try to push current data
-    if data:
-        # Try WebSocket first
-        ws_success = push_data_websocket(data)
+    # Acks for batches sent on the lost socket will never arrive; HTTP resends them from the cursor
+    data_window.clear()
+    
+    if not circuit_breakers['data'].ready():
+        return False
+    
+    entries = uplink_spool.read('data', SPOOL_DRAIN_BATCHES)
+    if not entries:
+        return True
+    
+    if len(entries) > 1:
+        logger.info(f"🔄 Attempting to upload {uplink_spool.backlog('data')} spooled data batches...")
+    
+    sent = 0
+    for entry_id, batch in entries:
+        if not circuit_breakers['data'].allow():
+            return False
+        logger.info("⚠️  WebSocket unavailable, falling back to HTTP POST")
+        try:
+            result = _upload_data(batch, entry_id)
+            circuit_breakers['data'].record(True)
+            logger.info(f"📤 Pushed {result.get('received', 0)} datapoints via HTTP")
+        except Exception as e:
+            circuit_breakers['data'].record(False, e)
+            logger.warning(f"⚠️  {uplink_spool.backlog('data')} data batch(es) kept in spool")
+            return False
         
-        if ws_success:
-            return True
-        else:
-            # Fallback to HTTP POST
-            logger.info("⚠️  WebSocket unavailable, falling back to HTTP POST")
-            success, result = retry_with_backoff(_upload_data, data)
-            
-            if success:
-                logger.info(f"📤 Pushed {result.get('received', 0)} datapoints via HTTP")
-                return True
-            else:
-                # Add to pending queue (limit queue size to prevent memory issues)
-                if len(pending_data_queue) < 100:  # Max 100 pending batches
-                    pending_data_queue.append(data)
-                    logger.warning(f"⚠️  Added data to pending queue ({len(pending_data_queue)} batches pending)")
-                else:
-                    logger.error("❌ Pending queue full, dropping oldest data")
-                    pending_data_queue.pop(0)
-                    pending_data_queue.append(data)
-                return False
+        uplink_spool.ack('data', entry_id)
+        sent += 1
+    
+    if sent > 1:
+        logger.info(f"✅ Successfully uploaded {sent} spooled batches")
+    return True
+
+def drain_data_websocket():
+    """Keep up to WS_INFLIGHT_WINDOW spooled batches in flight; advance the spool over acknowledged ones"""
+    # Advance the spool cursor over the acknowledged prefix
+    acked = data_window.pop_acked()
+    if acked is not None:
+        uplink_spool.ack('data', acked)
+    
+    # Retransmit batches whose ack is overdue
+    due = data_window.due()
+    if due:
+        logger.warning(f"⚠️  Retransmitting {len(due)} unacknowledged data batch(es)")
+    for seq, batch in due:
+        if not push_data_websocket(batch, seq):
+            return False
     
+    # Fill the window with the next spooled batches
+    free = data_window.free()
+    if not free:
+        return True
+    in_flight = len(data_window)
+    for entry_id, batch in uplink_spool.read('data', in_flight + free):
+        if entry_id in data_window:
+            continue
+        if not push_data_websocket(batch, entry_id):
+            return False
     return True
 
 def _send_heartbeat_request(status):
-    """Internal function to send heartbeat (used by retry mechanism)"""
+    """Internal function to send heartbeat (called through the 'heartbeat' circuit breaker)"""
     headers = {
         'X-Raspberry-ID': RASPBERRY_ID,
         'Content-Type': 'application/json'
@@ -878,171 +3264,452 @@ def _send_heartbeat_request(status):
     payload = {
         'raspberryId': RASPBERRY_ID,
         'status': status,
+        'uplink': transport.stats(),
+        'opcuaServers': server_status(),
         'timestamp': datetime.utcnow().isoformat() + 'Z'
     }
     
-    response = requests.post(HEARTBEAT_ENDPOINT, json=payload, headers=headers, timeout=5)
+    response = post_uplink('heartbeat', HEARTBEAT_ENDPOINT, headers, payload)
     response.raise_for_status()
     return True
 
 def send_heartbeat(status='online'):
-    """Send heartbeat to cloud API with retry"""
-    # Heartbeat is less critical, only 1 retry with shorter delay
-    for attempt in range(2):  # Try twice
+    """Send heartbeat to cloud API (next attempt is the next heartbeat slot)"""
+    success, _ = guarded_call('heartbeat', _send_heartbeat_request, status)
+    return success
+
+def _browse_description(node_id, types=ua):
+    """Forward hierarchical browse returning only Objects/Variables with BrowseName + NodeClass"""
+    desc = types.BrowseDescription()
+    desc.NodeId = node_id
+    desc.BrowseDirection = types.BrowseDirection.Forward
+    desc.ReferenceTypeId = types.NodeId(types.ObjectIds.HierarchicalReferences)
+    desc.IncludeSubtypes = True
+    desc.NodeClassMask = types.NodeClass.Object | types.NodeClass.Variable
+    desc.ResultMask = types.BrowseResultMask.NodeClass | types.BrowseResultMask.BrowseName
+    return desc
+
+def browse_parameters(node_ids, types=ua):
+    """
+    Browse request for a chunk of nodes. types is the OPC UA library's ua
+    module (python-opcua here, asyncua in the asyncio runtime).
+    """
+    params = types.BrowseParameters()
+    params.View = types.ViewDescription()
+    params.RequestedMaxReferencesPerNode = 0
+    params.NodesToBrowse = [_browse_description(node_id, types) for node_id in node_ids]
+    return params
+
+def browse_next_parameters(continuation_points, types=ua):
+    params = types.BrowseNextParameters()
+    params.ReleaseContinuationPoints = False
+    params.ContinuationPoints = list(continuation_points)
+    return params
+
+def collect_references(references, indexes, results):
+    """Add Browse/BrowseNext results to references[index]; returns {index: continuation point} still to follow"""
+    pending = {}
+    for index, result in zip(indexes, results):
+        if not result.StatusCode.is_good():
+            continue
+        references[index].extend(result.References)
+        if result.ContinuationPoint:
+            pending[index] = result.ContinuationPoint
+    return pending
+
+def browse_many(client, node_ids, limits=None):
+    """
+    Browse many nodes with multi-node Browse requests (chunked by
+    MaxNodesPerBrowse), following BrowseNext continuation points.
+    Returns a list of ReferenceDescription lists aligned with node_ids.
+    """
+    chunk_size = (limits or {}).get('MaxNodesPerBrowse') or DEFAULT_MAX_NODES_PER_BROWSE
+    references = [[] for _ in node_ids]
+    
+    for start in range(0, len(node_ids), chunk_size):
+        chunk = node_ids[start:start + chunk_size]
         try:
-            return _send_heartbeat_request(status)
+            results = client.uaclient.browse(browse_parameters(chunk))
         except Exception as e:
-            if attempt == 0:
-                logger.debug(f"Heartbeat attempt {attempt + 1} failed: {e}")
-                time.sleep(5)  # Short 5s retry
-            else:
-                logger.debug(f"Heartbeat failed after 2 attempts")
-                return False
-    return False
+            logger.debug(f"Browse of {len(chunk)} node(s) failed: {e}")
+            continue
+        
+        pending = collect_references(references, range(start, start + len(chunk)), results)
+        while pending:
+            try:
+                next_results = client.uaclient.browse_next(browse_next_parameters(pending.values()))
+                next_results = getattr(next_results, 'Results', next_results)
+            except Exception as e:
+                logger.debug(f"BrowseNext failed: {e}")
+                break
+            pending = collect_references(references, list(pending), next_results)
+    
+    return references
+
+def _discovered_node_entry(node_id, browse_name, value, opc_data_type=None):
+    """Build the discovered-node document uploaded to the cloud"""
+    data_type = type(value).__name__
+    
+    # Extract variable name (remove namespace prefix)
+    if ';s=' in node_id:
+        variable_name = node_id.split(';s=')[1]
+    elif ';i=' in node_id:
+        variable_name = f"Identifier_{node_id.split(';i=')[1]}"
+    else:
+        variable_name = browse_name
+    
+    # Extract namespace
+    namespace = node_id.split(';')[0].replace('ns=', '')
+    
+    # Determine type (list, number, string, boolean)
+    value_type = 'unknown'
+    if isinstance(value, list):
+        value_type = 'list'
+    elif isinstance(value, (int, float)):
+        value_type = 'number'
+    elif isinstance(value, bool):
+        value_type = 'boolean'
+    elif isinstance(value, str):
+        value_type = 'string'
+    
+    # Create a dynamic currentValue that shows the complete value
+    current_value_str = str(value)
+    if not isinstance(value, list) and len(current_value_str) > 1000:
+        # For non-arrays, show full value but limit extremely long strings
+        current_value_str = current_value_str[:997] + "..."
+    
+    return {
+        'namespace': int(namespace),
+        'variableName': variable_name,
+        'browseName': browse_name,
+        'opcNodeId': node_id,
+        'dataType': data_type,
+        'opcDataType': opc_data_type,
+        'type': value_type,
+        'value': value,  # Full value including arrays
+        'currentValue': current_value_str  # Dynamic preview showing complete arrays
+    }
+
+class DiscoveryWalk:
+    """
+    Breadth-first walk of the address space from the Objects folder, shared
+    by both runtimes: feed each level's browse results to add() until done,
+    then bulk-read Value and DataType of variable_ids() and build the
+    discovered-node documents with nodes(). types is the OPC UA library's ua module.
+    """
+    def __init__(self, types=ua):
+        objects_node_id = types.NodeId(types.ObjectIds.ObjectsFolder)
+        self.server_node_id = types.NodeId(types.ObjectIds.Server).to_string()
+        self.frontier = [objects_node_id]
+        self.visited = {objects_node_id.to_string()}
+        self.variables = {}  # node_id -> browse name (dict keeps browse order, dedupes)
+        self.depth = 0
+
+    @property
+    def done(self):
+        return not self.frontier or self.depth > DISCOVERY_MAX_DEPTH
+
+    def add(self, level_references):
+        next_frontier = []
+        for refs in level_references:
+            for ref in refs:
+                node_id = ref.NodeId.to_string()
+                if ref.NodeClass == ua.NodeClass.Variable:
+                    self.variables.setdefault(node_id, ref.BrowseName.Name)
+                elif node_id not in self.visited and node_id != self.server_node_id:
+                    # Server object only holds standard diagnostics, skip its subtree
+                    self.visited.add(node_id)
+                    next_frontier.append(ref.NodeId)
+        self.frontier = next_frontier
+        self.depth += 1
+
+    def variable_ids(self):
+        """Only namespaced variables are discovered (namespace 0 is the standard model)"""
+        return [node_id for node_id in self.variables if node_id.startswith('ns=')]
+
+    def nodes(self, node_ids, attributes, server_id=None):
+        """Discovered-node documents from (Value, DataType) reads aligned with node_ids, keyed for server_id"""
+        discovered = []
+        for node_id, (value_dv, type_dv) in zip(node_ids, attributes):
+            if not value_dv.StatusCode.is_good():
+                logger.debug(f"Could not read value for {self.variables[node_id]}: {status_name(value_dv.StatusCode)}")
+                continue
+            try:
+                opc_data_type = None
+                if type_dv.StatusCode.is_good() and type_dv.Value.Value is not None:
+                    type_id = type_dv.Value.Value
+                    opc_data_type = ua.ObjectIdNames.get(type_id.Identifier, type_id.to_string()) \
+                        if type_id.NamespaceIndex == 0 else type_id.to_string()
+                entry = _discovered_node_entry(node_id, self.variables[node_id], value_dv.Value.Value, opc_data_type)
+                key = node_key(server_id, node_id)
+                if key != node_id:
+                    entry.update(opcNodeId=key, serverId=server_id)
+                discovered.append(entry)
+            except Exception as e:
+                logger.debug(f"Error building node {node_id}: {e}")
+        return discovered
 
 def discover_nodes():
-    """Discover all available OPC UA nodes"""
+    """
+    Discover all available OPC UA variables.
+    Browses the address space level by level with multi-node Browse/BrowseNext
+    requests, then reads Value and DataType of all variables in bulk Read calls.
+    """
     try:
         if not opcua_client or not config:
             logger.warning("⚠️  Cannot discover nodes: Not connected to OPC UA server")
             return []
         
         logger.info("🔍 Starting node discovery...")
-        discovered = []
-        seen_node_ids = set()  # Track discovered nodes to prevent duplicates
-        
-        # Get the Objects node (standard OPC UA starting point)
-        objects_node = opcua_client.get_objects_node()
+        started = time.time()
         
-        # Browse recursively to find all variables
-        def browse_node(node, depth=0, max_depth=10):
-            if depth > max_depth:
-                return
-            
-            try:
-                for child in node.get_children():
-                    try:
-                        # Get node info
-                        node_id = child.nodeid.to_string()
-                        browse_name = child.get_browse_name().Name
-                        
-                        # Check if it's a variable
-                        node_class = child.get_node_class()
-                        if node_class.name == 'Variable':
-                            try:
-                                # Try to read the value
-                                data_value = child.get_data_value()
-                                value = data_value.Value.Value
-                                data_type = type(value).__name__
-                                
-                                # Extract variable name (remove namespace prefix)
-                                if ';s=' in node_id:
-                                    variable_name = node_id.split(';s=')[1]
-                                elif ';i=' in node_id:
-                                    variable_name = f"Identifier_{node_id.split(';i=')[1]}"
-                                else:
-                                    variable_name = browse_name
-                                
-                                # Extract namespace
-                                namespace = node_id.split(';')[0].replace('ns=', '')
-                                
-                                # Determine type (list, number, string, boolean)
-                                value_type = 'unknown'
-                                actual_value = value
-                                
-                                if isinstance(value, list):
-                                    value_type = 'list'
-                                    actual_value = value  # Keep full array
-                                elif isinstance(value, (int, float)):
-                                    value_type = 'number'
-                                elif isinstance(value, bool):
-                                    value_type = 'boolean'
-                                elif isinstance(value, str):
-                                    value_type = 'string'
-                                
-                                # Check for duplicates using node_id
-                                if node_id not in seen_node_ids:
-                                    seen_node_ids.add(node_id)
-                                    
-                                    # Create a dynamic currentValue that shows the complete value
-                                    if isinstance(value, list):
-                                        # For arrays, always show all elements (dynamic size)
-                                        current_value_str = str(value)
-                                    else:
-                                        # For non-arrays, show full value but limit extremely long strings
-                                        current_value_str = str(value)
-                                        if len(current_value_str) > 1000:  # Only limit extremely long strings
-                                            current_value_str = current_value_str[:997] + "..."
-                                    
-                                    discovered.append({
-                                        'namespace': int(namespace),
-                                        'variableName': variable_name,
-                                        'browseName': browse_name,
-                                        'opcNodeId': node_id,
-                                        'dataType': data_type,
-                                        'type': value_type,
-                                        'value': actual_value,  # Full value including arrays
-                                        'currentValue': current_value_str  # Dynamic preview showing complete arrays
-                                    })
-                                
-                            except Exception as e:
-                                logger.debug(f"Could not read value for {browse_name}: {e}")
-                        
-                        # Recursively browse child nodes
-                        if node_class.name in ['Object', 'Folder']:
-                            browse_node(child, depth + 1, max_depth)
-                            
-                    except Exception as e:
-                        logger.debug(f"Error browsing node: {e}")
-                        
-            except Exception as e:
-                logger.debug(f"Error getting children: {e}")
+        walk = DiscoveryWalk()
+        while not walk.done:
+            walk.add(browse_many(opcua_client, walk.frontier, operation_limits))
         
-        # Start browsing from Objects node
-        browse_node(objects_node)
+        node_ids = walk.variable_ids()
+        attributes = bulk_read_attributes(opcua_client, node_ids,
+                                          (ua.AttributeIds.Value, ua.AttributeIds.DataType), operation_limits)
+        discovered = walk.nodes(node_ids, attributes)
         
-        logger.info(f"✅ Discovered {len(discovered)} nodes")
+        logger.info(f"✅ Discovered {len(discovered)} nodes in {time.time() - started:.1f}s "
+                    f"({len(walk.visited)} objects browsed)")
         return discovered
         
     except Exception as e:
         logger.error(f"❌ Node discovery failed: {e}")
         return []
 
-def _upload_discovered_nodes(nodes):
-    """Internal function to upload nodes (used by retry mechanism)"""
+def node_digest(node):
+    """Short digest of a discovered node's structural fields"""
+    payload = json.dumps([node.get(field) for field in DISCOVERY_STRUCTURE_FIELDS], default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def compute_discovery_delta(nodes, acked_index):
+    """Diff discovered nodes against the acknowledged index -> (added, changed, removed_ids)"""
+    added = []
+    changed = []
+    current_ids = set()
+    
+    for node in nodes:
+        node_id = node['opcNodeId']
+        current_ids.add(node_id)
+        digest = acked_index.get(node_id)
+        if digest is None:
+            added.append(node)
+        elif digest != node_digest(node):
+            changed.append(node)
+    
+    removed = [node_id for node_id in acked_index if node_id not in current_ids]
+    return added, changed, removed
+
+def _upload_node(node):
+    """Upload form of a node: the server derives currentValue from value"""
+    return {key: value for key, value in node.items() if key != 'currentValue'}
+
+def _post_discovered_nodes(payload):
     headers = {
         'X-Raspberry-ID': RASPBERRY_ID,
         'Content-Type': 'application/json'
     }
+    return post_uplink('discovered_nodes', DISCOVERED_NODES_ENDPOINT, headers, payload)
+
+def discovery_payload(nodes, version, delta=False):
+    """
+    Body of a discovered nodes upload: the delta against the last acknowledged
+    snapshot (discovery_ack), or the full node list.
+    """
+    payload = {'raspberryId': RASPBERRY_ID, 'mode': 'delta' if delta else 'full', 'version': version}
+    if delta:
+        added, changed, removed = compute_discovery_delta(nodes, discovery_ack['index'])
+        payload.update(baseVersion=discovery_ack['version'],
+                       added=[_upload_node(node) for node in added],
+                       changed=[_upload_node(node) for node in changed],
+                       removed=removed)
+    else:
+        payload['nodes'] = [_upload_node(node) for node in nodes]
+    payload['timestamp'] = datetime.utcnow().isoformat() + 'Z'
+    return payload
+
+def accept_discovery_response(response, nodes, payload):
+    """
+    Check the server's answer to discovery_payload() and record the uploaded
+    list as acknowledged. None when a delta was refused because the server
+    holds a different version (send the full list next).
+    """
+    global discovery_ack
     
-    payload = {
-        'raspberryId': RASPBERRY_ID,
-        'nodes': nodes,
-        'timestamp': datetime.utcnow().isoformat() + 'Z'
-    }
-    
-    response = requests.post(DISCOVERED_NODES_ENDPOINT, json=payload, headers=headers, timeout=30)
+    if payload['mode'] == 'delta' and response.status_code == 409:
+        logger.info("🔄 Server discovery version differs, sending full node list")
+        return None
     response.raise_for_status()
     
     result = response.json()
     if not result.get('success'):
         raise Exception(result.get('error', 'Unknown error'))
     
+    discovery_ack = {'version': payload['version'], 'index': {node['opcNodeId']: node_digest(node) for node in nodes}}
+    if payload['mode'] == 'delta':
+        logger.info(f"📤 Discovered nodes delta: +{len(payload['added'])} ~{len(payload['changed'])} -{len(payload['removed'])}")
     return result
 
-def save_discovered_nodes():
-    """Discover nodes and save to cloud with retry"""
+def _upload_discovered_nodes(nodes, version):
+    """
+    Internal function to upload nodes (called through the 'discovered_nodes' circuit breaker).
+    Sends only the delta against the last acknowledged snapshot; falls back to
+    a full upload when nothing was acknowledged yet or the server's version differs.
+    """
+    if discovery_ack['version']:
+        payload = discovery_payload(nodes, version, delta=True)
+        result = accept_discovery_response(_post_discovered_nodes(payload), nodes, payload)
+        if result is not None:
+            return result
+    
+    payload = discovery_payload(nodes, version)
+    return accept_discovery_response(_post_discovered_nodes(payload), nodes, payload)
+
+def read_server_fingerprint(client):
+    """Cheap address-space fingerprint: NamespaceArray plus server BuildInfo, one Read call"""
+    values = []
+    for data_value in bulk_read(client, FINGERPRINT_NODES, limits=operation_limits):
+        values.append(data_value.Value.Value if data_value.StatusCode.is_good() else None)
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def discovery_fingerprint(server_fingerprint, nodes):
+    """Full fingerprint: server fingerprint plus the discovered structure (node ids and types)"""
+    structure = sorted((n['opcNodeId'], n.get('dataType'), n.get('opcDataType') or '') for n in nodes)
+    payload = json.dumps([server_fingerprint, structure], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def server_key():
+    """Identifies the configured OPC UA server(s) a discovery snapshot belongs to"""
+    return ','.join(f"{server['ip']}:{server['port']}" for server in opcua_servers(config)) if config else None
+
+def load_discovery_snapshot():
+    """Load the on-disk discovery snapshot if it belongs to the configured OPC UA server"""
+    global discovery_snapshot, discovery_ack
+    
+    try:
+        with open(DISCOVERY_SNAPSHOT_FILE, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️  Ignoring unreadable discovery snapshot: {e}")
+        return None
+    
+    if snapshot.get('server') != server_key() or not snapshot.get('nodes'):
+        logger.info("💾 Discovery snapshot is for a different server, ignoring it")
+        return None
+    
+    discovery_snapshot = snapshot
+    discovery_ack = snapshot.get('ack') or {'version': None, 'index': {}}
+    return snapshot
+
+def save_discovery_snapshot(nodes, server_fingerprint, fingerprint):
+    """Atomically persist the discovery result (write temp file, fsync, rename)"""
+    global discovery_snapshot
+    
+    snapshot = {
+        'server': server_key(),
+        'serverFingerprint': server_fingerprint,
+        'fingerprint': fingerprint,
+        'ack': discovery_ack,
+        'savedAt': datetime.utcnow().isoformat() + 'Z',
+        'nodes': nodes
+    }
+    
+    try:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        tmp_path = DISCOVERY_SNAPSHOT_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, DISCOVERY_SNAPSHOT_FILE)
+        logger.info(f"💾 Saved discovery snapshot ({len(nodes)} nodes)")
+    except Exception as e:
+        logger.warning(f"⚠️  Failed to save discovery snapshot: {e}")
+    
+    discovery_snapshot = snapshot
+
+def warm_start_discovery():
+    """
+    Use the on-disk snapshot to subscribe immediately on boot.
+    Returns True if the snapshot was used; a background verification browse
+    is then scheduled and only re-uploads if the fingerprint changed.
+    """
+    global discovered_nodes_cache
+    
+    snapshot = load_discovery_snapshot()
+    if not snapshot:
+        return False
+    
+    discovered_nodes_cache = snapshot['nodes']
+    datapoint_registry.compile(datapoints, discovered_nodes_cache)
+    
+    # Verify right away if the server already looks different, otherwise let startup settle first
+    delay = DISCOVERY_VERIFY_DELAY
+    if opcua_client and read_server_fingerprint(opcua_client) != snapshot.get('serverFingerprint'):
+        logger.info("🔍 Server fingerprint changed since snapshot, verifying now")
+        delay = 0
+    
+    logger.info(f"💾 Warm start from snapshot: {len(discovered_nodes_cache)} discovered nodes "
+                f"(saved {snapshot.get('savedAt')}), verification in {delay}s")
+    
+    verify_timer = threading.Timer(delay, save_discovered_nodes)
+    verify_timer.daemon = True
+    verify_timer.start()
+    return True
+
+def save_discovered_nodes(upload=True):
+    """
+    Discover nodes and save to cloud (upload skipped if the fingerprint is unchanged).
+    upload=False (main loop) only discovers; the upload is left to the uploader thread.
+    """
+    if not discovery_lock.acquire(blocking=False):
+        logger.info("🔍 Node discovery already running, skipping")
+        return False
+    
+    try:
+        return _save_discovered_nodes(upload)
+    finally:
+        discovery_lock.release()
+
+def upload_pending_discovered_nodes():
+    """Retry the last discovered nodes upload that failed (uploader thread)"""
+    if not discovery_lock.acquire(blocking=False):
+        return False
+    
+    try:
+        return _upload_pending_discovered_nodes()
+    finally:
+        discovery_lock.release()
+
+def _upload_pending_discovered_nodes():
+    global pending_discovered_nodes
+    
+    if not pending_discovered_nodes:
+        return True
+    
+    success, _ = guarded_call('discovered_nodes', _upload_discovered_nodes, pending_discovered_nodes,
+                              discovery_snapshot['fingerprint'])
+    if success:
+        logger.info(f"✅ Successfully uploaded {len(pending_discovered_nodes)} pending nodes")
+        save_discovery_snapshot(pending_discovered_nodes, discovery_snapshot['serverFingerprint'],
+                                discovery_snapshot['fingerprint'])
+        pending_discovered_nodes = None
+    return success
+
+def _save_discovered_nodes(upload=True):
     global pending_discovered_nodes, discovered_nodes_cache
     
     try:
         # Try to upload pending nodes first if any
-        if pending_discovered_nodes:
+        if upload and pending_discovered_nodes:
             logger.info("🔄 Attempting to upload pending discovered nodes...")
-            success, _ = retry_with_backoff(_upload_discovered_nodes, pending_discovered_nodes)
-            if success:
-                logger.info(f"✅ Successfully uploaded {len(pending_discovered_nodes)} pending nodes")
-                pending_discovered_nodes = None
-            else:
+            if not _upload_pending_discovered_nodes():
                 logger.warning("⚠️  Still unable to upload pending nodes, will retry later")
         
         # Discover new nodes
@@ -1052,23 +3719,39 @@ def save_discovered_nodes():
             logger.warning("⚠️  No nodes discovered")
             return False
         
+        server_fingerprint = read_server_fingerprint(opcua_client)
+        fingerprint = discovery_fingerprint(server_fingerprint, nodes)
+        unchanged = discovery_ack['version'] == fingerprint and bool(discovery_snapshot) \
+            and discovery_snapshot.get('server') == server_key()
+        
         # 🔥 NEW: Cache discovered nodes for subscription
         discovered_nodes_cache = nodes
+        datapoint_registry.compile(datapoints, discovered_nodes_cache)
         logger.info(f"💾 Cached {len(nodes)} discovered nodes for monitoring")
         
-        # Try to upload with retry
-        success, result = retry_with_backoff(_upload_discovered_nodes, nodes)
+        # Reconcile subscriptions to include newly discovered nodes
+        if acquisition_active():
+            logger.info("🔄 Reconciling subscription with discovered nodes...")
+            reconcile_subscriptions()
+        
+        if unchanged:
+            logger.info("✅ Address space unchanged since last upload, skipping discovered nodes upload")
+            return True
+        
+        if not upload:
+            # Hand the upload to the uploader thread (same path as a failed upload's retry)
+            save_discovery_snapshot(nodes, server_fingerprint, fingerprint)
+            pending_discovered_nodes = nodes
+            uploader.wake()
+            logger.info(f"📤 Queued {len(nodes)} discovered nodes for upload")
+            return True
+        
+        # Try to upload (delta against the last acknowledged snapshot); failures are retried by the uploader
+        success, result = guarded_call('discovered_nodes', _upload_discovered_nodes, nodes, fingerprint)
+        save_discovery_snapshot(nodes, server_fingerprint, fingerprint)
         
         if success:
             logger.info(f"📤 Saved {len(nodes)} discovered nodes to cloud")
-            
-            # 🔥 NEW: Re-setup subscriptions to include newly discovered nodes
-            if subscription:
-                logger.info("🔄 Re-subscribing with new discovered nodes...")
-                disconnect_opcua()  # This will clear old subscription
-                connect_opcua()     # Reconnect
-                setup_subscriptions()  # Re-setup with new nodes
-            
             return True
         else:
             # Save to pending for later retry
@@ -1082,7 +3765,7 @@ def save_discovered_nodes():
 
 def main_loop():
     """Main monitoring loop"""
-    global last_heartbeat, last_config_fetch
+    global last_spool_retention, last_rate_review, last_connection_check
     
     logger.info("=" * 60)
     logger.info("🏭 OPC UA Monitoring Client Starting")
@@ -1090,9 +3773,12 @@ def main_loop():
     logger.info(f"🌐 API Server: {API_BASE_URL}")
     logger.info("=" * 60)
     
-    # Upload device info on startup
-    logger.info("📤 Uploading device information...")
-    upload_device_info()
+    # Start uploader (config fetch, device info, heartbeat, data and event uploads)
+    uploader.start()
+    
+    # Start worker that processes OPC UA notifications off the subscription thread
+    start_notification_worker()
+    flush_scheduler.start()
     
     # Start WebSocket connection for real-time status
     logger.info("🔌 Starting WebSocket connection...")
@@ -1111,27 +3797,27 @@ def main_loop():
         try:
             current_time = time.time()
             
-            # Fetch or refresh config
-            if not config or (current_time - last_config_fetch) > CONFIG_REFRESH_INTERVAL:
-                if fetch_config():
-                    last_config_fetch = current_time
-                    # Reconnect to OPC UA if config changed
-                    disconnect_opcua()
-                    if not connect_opcua():
-                        logger.error(f"❌ Retrying in {RETRY_INTERVAL} seconds...")
-                        time.sleep(RETRY_INTERVAL)
-                        continue
-                    
-                    # Run initial node discovery after first successful connection
-                    if not initial_discovery_done:
-                        logger.info("🔍 Running initial node discovery...")
-                        save_discovered_nodes()
-                        initial_discovery_done = True
-                        
-                else:
-                    logger.error(f"❌ Config fetch failed. Retrying in {RETRY_INTERVAL} seconds...")
+            # Apply config fetched by the uploader
+            fetched_config = uploader.take_config()
+            if fetched_config:
+                load_config(fetched_config)
+                # Reconcile subscriptions (reconnects only if the server endpoint changed)
+                if not apply_config():
+                    logger.error(f"❌ Retrying in {RETRY_INTERVAL} seconds...")
                     time.sleep(RETRY_INTERVAL)
                     continue
+                
+                # Run initial node discovery after first successful connection
+                if not initial_discovery_done:
+                    if not warm_start_discovery():
+                        logger.info("🔍 Running initial node discovery...")
+                        save_discovered_nodes(upload=False)
+                    initial_discovery_done = True
+            
+            if not config:
+                # Still waiting for the first config (uploader retries with backoff)
+                uploader.config_ready.wait(1)
+                continue
             
             # Ensure OPC UA connection and subscriptions
             if not opcua_client:
@@ -1141,52 +3827,41 @@ def main_loop():
                     continue
             
             # Setup subscriptions if not already done
-            if not subscription and datapoints:
+            if not acquisition_active() and datapoints:
                 if not setup_subscriptions():
                     logger.error(f"❌ Failed to setup subscriptions. Retrying in {RETRY_INTERVAL} seconds...")
                     time.sleep(RETRY_INTERVAL)
                     continue
             
-            # Check if any data has changed (buffered by subscription handler)
-            if changed_data_buffer:
-                # Get all changed data and clear buffer
-                data_to_upload = changed_data_buffer.copy()
-                changed_data_buffer.clear()
-                
-                logger.info(f"📦 Uploading {len(data_to_upload)} changed datapoint(s)")
-                push_data(data_to_upload)
-            
-            # Try to upload pending data even if no new data
-            if pending_data_queue:
-                push_data([])  # Empty data triggers pending queue retry
-            
-            # Send heartbeat
-            if (current_time - last_heartbeat) > HEARTBEAT_INTERVAL:
-                if send_heartbeat('online'):
-                    logger.debug("💓 Heartbeat sent")
-                last_heartbeat = current_time
-            
-            # Retry device info upload if not yet uploaded
-            if not device_info_uploaded and (current_time - last_config_fetch) > 60:
-                logger.info("🔄 Retrying device info upload...")
-                upload_device_info()
+            # Connection health check: periodic, and on every pass once the socket has dropped;
+            # a lost connection resumes the session (full rebuild only if the server lost it)
+            if session_lost_at is not None or opcua_client.link_down():
+                resume_opcua_session()
+            elif (current_time - last_connection_check) >= CONNECTION_CHECK_INTERVAL:
+                if not check_connection_health():
+                    resume_opcua_session()
+                last_connection_check = current_time
             
-            # Retry pending discovered nodes periodically
-            if pending_discovered_nodes and (current_time - last_config_fetch) > 60:
-                logger.info("🔄 Retrying pending discovered nodes upload...")
-                save_discovered_nodes()
+            # Periodic rate class review (subscription mode)
+            if (current_time - last_rate_review) >= RATE_REVIEW_INTERVAL:
+                review_rate_classes()
+                last_rate_review = current_time
             
-            # Periodic connection health check
-            global last_connection_check
-            if (current_time - last_connection_check) >= CONNECTION_CHECK_INTERVAL:
-                check_connection_health()
-                last_connection_check = current_time
+            # Follow dashboard demand for discovered nodes
+            watch_added = watch_set.pop_changed()
+            watch_expired = watch_set.expire()
+            if watch_added or watch_expired:
+                reconcile_subscriptions()
             
-            # Periodic event buffer flush
-            flush_event_buffer()
+            # Commit batched spool writes; prune acknowledged/expired records
+            uplink_spool.sync()
+            if (current_time - last_spool_retention) >= SPOOL_RETENTION_INTERVAL:
+                uplink_spool.enforce_retention()
+                last_spool_retention = current_time
             
-            # Short sleep to prevent tight loop (subscriptions handle timing)
-            time.sleep(1)
+            # Housekeeping interval (changes are flushed by flush_scheduler, not by this loop);
+            # a pushed config change cuts the wait short
+            uploader.config_ready.wait(1)
             
         except KeyboardInterrupt:
             logger.info("\n⚠️  Shutdown signal received...")
@@ -1201,14 +3876,19 @@ def main_loop():
     logger.info("🛑 Shutting down...")
     scheduler.shutdown()
     disconnect_opcua()
+    flush_scheduler.stop()
+    uploader.stop()
     send_heartbeat('offline')
     stop_websocket()
     
     # Log pending operations
     if pending_discovered_nodes:
         logger.warning(f"⚠️  {len(pending_discovered_nodes)} discovered nodes not uploaded")
-    if pending_data_queue:
-        logger.warning(f"⚠️  {len(pending_data_queue)} data batches not uploaded")
+    if uplink_spool.backlog('data') or uplink_spool.backlog('events'):
+        logger.warning(f"⚠️  {uplink_spool.backlog('data')} data batches and {uplink_spool.backlog('events')} events "
+                       f"kept in spool for next start")
+    uplink_spool.close()
+    transport.close()
     
     logger.info("👋 OPC UA Monitoring Client stopped")
 
@@ -0,0 +1,1892 @@
+"""
+OPC UA Monitoring Client for Raspberry Pi - asyncio runtime
+===========================================================
+
+Alternative runtime for opcua_client.py. Instead of the blocking main
+loop plus uploader/worker/scheduler threads, everything runs as
+cooperating tasks on one event loop:
+1. One task per OPC UA server session (asyncua): subscriptions, health
+   checks, reconnects and node discovery. A config may list several
+   servers (opcua_servers); all of them share the pipeline below
+2. Flush scheduler feeding the durable uplink spool (its SQLite I/O
+   runs on one dedicated thread, never on the event loop)
+3. Uplink task: config, data (Socket.IO AsyncClient, aiohttp fallback),
+   event log, heartbeat and device info
+4. Housekeeping: spool commits/retention, watch set, rate classes
+
+Configuration, the uplink spool, circuit breakers, the datapoint
+registry and all wire formats are shared with opcua_client.py, so a Pi
+can switch between both runtimes without losing spooled data.
+Tasks are cancelled together on SIGINT/SIGTERM or when one of them dies.
+
+Sharded mode (OPCUA_SHARD_WORKERS=N, N > 1) moves the OPC UA sessions
+into N worker processes, so notification processing uses more than one
+core. Each worker subscribes to a stable crc32 share of the nodes and
+writes its changes and events to a shared-memory ring; this process
+keeps the uplink, spool and discovery upload.
+
+Run with: python3 opcua_client_async.py
+"""
+
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import signal
+import struct
+import sys
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import chain
+from multiprocessing import shared_memory
+
+import aiohttp
+import socketio
+from asyncua import Client, ua
+
+import opcua_client as core
+from opcua_client import (
+    RASPBERRY_ID, API_BASE_URL, CONFIG_ENDPOINT, DATA_ENDPOINT, HEARTBEAT_ENDPOINT,
+    DISCOVERED_NODES_ENDPOINT, DEVICE_INFO_ENDPOINT, EVENT_LOG_ENDPOINT,
+    HEARTBEAT_INTERVAL, RETRY_INTERVAL, NODE_DISCOVERY_TIME, RATE_CLASSES, RATE_REVIEW_INTERVAL,
+    DEFAULT_MAX_NODES_PER_READ, DEFAULT_MAX_NODES_PER_BROWSE, SUBSCRIPTION_HANDLE_STRIDE,
+    DEADBAND_TYPES, DATA_CHANGE_TRIGGERS, FINGERPRINT_NODES,
+    OPERATION_LIMIT_NODES, DISCOVERY_VERIFY_DELAY, SPOOL_RETENTION_INTERVAL, SPOOL_DRAIN_BATCHES,
+    UPLOADER_IDLE, WS_INFLIGHT_WINDOW, WS_ACK_TIMEOUT, HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUTS, HTTP_RESET_AFTER_FAILURES, UPLINK_ENCODING, HTTP_COMPRESS_THRESHOLD,
+    CONFIG_REFRESH_INTERVAL, CONFIG_PUSH_REFRESH_INTERVAL, EVENT_FLUSH_INTERVAL, EVENT_FLUSH_COUNT,
+    EVENT_UPLOAD_BATCH, EVENT_FLUSH_MAX_BATCHES, FLUSH_LATENCY, CONNECTION_CHECK_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+
+HEALTH_CHECK_TIMEOUT = 10  # Seconds a ServerState read may take before the session counts as lost
+OPCUA_REQUEST_TIMEOUT = 10  # Seconds asyncua waits for any single service response
+SHUTDOWN_TIMEOUT = 15       # Seconds the final flush/offline heartbeat may take on shutdown
+
+# Sharded mode: OPC UA sessions in worker processes, changes back through shared memory
+SHARD_WORKERS = int(os.environ.get('OPCUA_SHARD_WORKERS', '1'))  # > 1 enables sharded mode
+SHARD_RING_BYTES = 8 * 1024 * 1024  # Shared-memory ring per worker
+SHARD_FLUSH_INTERVAL = 0.01  # Seconds between ring writes (workers) and ring reads (uplink process)
+SHARD_BATCH_MAX = 2000       # Changes/events per ring record
+SHARD_PENDING_MAX = 100000   # Changes a worker holds while its ring is full; oldest are dropped beyond this
+SHARD_STOP_TIMEOUT = 10      # Seconds a worker gets to stop before it is terminated
+SHARD_LOCK_TIMEOUT = 0.1     # Seconds a ring index access waits for the lock before giving up for this round
+
+# Client handle offsets are unique across all sessions, so every monitored item
+# of every server resolves through the one shared datapoint registry
+handle_offsets = itertools.count(SUBSCRIPTION_HANDLE_STRIDE, SUBSCRIPTION_HANDLE_STRIDE)
+
+# ==========================================
+# HTTP TRANSPORT
+# ==========================================
+
+class HttpResponse:
+    """Fully read aiohttp response with the parts of requests.Response the shared helpers use"""
+    __slots__ = ('status_code', 'headers', 'content')
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+class AsyncTransport:
+    """
+    aiohttp counterpart of opcua_client.UplinkTransport: one keep-alive
+    ClientSession (created on the loop) for every uplink call, per-endpoint
+    read timeouts, pool reset after consecutive connection errors and the
+    same stats() for the heartbeat.
+    """
+    def __init__(self):
+        self.session = None
+        self.requests = 0
+        self.connections = 0  # Opened by this transport, counted by a trace hook
+        self.consecutive_failures = 0
+        self.resets = 0
+        self.last_success = None
+
+    def _session(self):
+        if self.session is None:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._connection_opened)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=HTTP_POOL_SIZE),
+                headers={'X-Raspberry-ID': RASPBERRY_ID},
+                trace_configs=[trace])
+        return self.session
+
+    async def _connection_opened(self, session, context, params):
+        self.connections += 1
+
+    async def request(self, method, endpoint, url, **kwargs):
+        """Send one request with the endpoint's timeouts and read the whole response"""
+        session = self._session()
+        timeout = aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUTS[endpoint])
+        self.requests += 1
+        try:
+            async with session.request(method, url, timeout=timeout, **kwargs) as response:
+                content = await response.read()
+                result = HttpResponse(response.status, response.headers, content)
+        except aiohttp.ClientConnectionError:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= HTTP_RESET_AFTER_FAILURES:
+                logger.warning(f"🔌 Resetting HTTP connection pool after {self.consecutive_failures} connection errors")
+                await self.reset()
+            raise
+        
+        self.consecutive_failures = 0
+        self.last_success = time.time()
+        return result
+
+    async def reset(self):
+        """Close pooled connections; the next request opens a fresh session"""
+        if self.session is None:
+            return
+        session, self.session = self.session, None
+        await session.close()
+        self.resets += 1
+        self.consecutive_failures = 0
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'connections': self.connections,
+            'handshakesAvoided': max(0, self.requests - self.connections),
+            'poolResets': self.resets,
+            'lastSuccess': datetime.utcfromtimestamp(self.last_success).isoformat() + 'Z' if self.last_success else None
+        }
+
+    async def close(self):
+        if self.session is not None:
+            session, self.session = self.session, None
+            await session.close()
+
+transport = AsyncTransport()
+
+async def _stream(chunks):
+    """Feed a (compressing) chunk generator to aiohttp, yielding to the loop between chunks"""
+    for chunk in chunks:
+        yield chunk
+        await asyncio.sleep(0)
+
+async def post_uplink(endpoint, url, headers, payload=None, body=None):
+    """Async opcua_client.post_uplink(): negotiated request compression, large bodies streamed"""
+    headers = dict(headers)
+    chunks = core._json_chunks(payload) if body is None else iter([body])
+    first = next(chunks, b'')
+    codec = core.http_codec
+    
+    if len(first) < HTTP_COMPRESS_THRESHOLD:
+        data = first
+    elif codec:
+        headers['Content-Encoding'] = codec
+        data = _stream(core._compress_chunks(chain([first], chunks), codec))
+    else:
+        data = _stream(chain([first], chunks))
+    
+    response = await transport.request('POST', endpoint, url, data=data, headers=headers)
+    core.note_accept_encoding(response)
+    
+    if response.status_code == 415 and codec and 'Content-Encoding' in headers:
+        core.http_codec = None
+        raise Exception(f"Server rejected {codec} request compression")
+    return response
+
+async def guarded_call(endpoint, func, *args):
+    """Async opcua_client.guarded_call(): single attempt through the endpoint's circuit breaker"""
+    breaker = core.circuit_breakers[endpoint]
+    if not breaker.allow():
+        return False, None
+    
+    try:
+        result = await func(*args)
+        breaker.record(True)
+        return True, result
+    except Exception as e:
+        breaker.record(False, e)
+        return False, None
+
+JSON_HEADERS = {
+    'X-Raspberry-ID': RASPBERRY_ID,
+    'Content-Type': 'application/json'
+}
+
+# ==========================================
+# UPLINK SPOOL
+# ==========================================
+
+class AsyncSpool:
+    """
+    opcua_client's UplinkSpool with all SQLite I/O on one dedicated thread.
+    Installed as opcua_client.uplink_spool: append() (from the flush
+    scheduler and log_event()) queues the write and returns; the uplink
+    and housekeeping tasks await everything else. One thread keeps the
+    calls in order, so a read always sees the appends queued before it.
+    """
+    def __init__(self, spool):
+        self.spool = spool
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='uplink-spool')
+
+    @property
+    def epoch(self):
+        return self.spool.epoch
+
+    def _call(self, method, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, method, *args)
+
+    def append(self, stream, record):
+        self.executor.submit(self.spool.append, stream, record).add_done_callback(self._append_done)
+
+    @staticmethod
+    def _append_done(future):
+        if future.exception():
+            logger.error(f"❌ Uplink spool append failed: {future.exception()}")
+
+    async def read(self, stream, limit):
+        return await self._call(self.spool.read, stream, limit)
+
+    async def ack(self, stream, last_id):
+        await self._call(self.spool.ack, stream, last_id)
+
+    async def backlog(self, stream):
+        return await self._call(self.spool.backlog, stream)
+
+    async def sync(self, force=False):
+        await self._call(self.spool.sync, force)
+
+    async def enforce_retention(self):
+        await self._call(self.spool.enforce_retention)
+
+    async def close(self):
+        await self._call(self.spool.close)
+        self.executor.shutdown()
+
+# ==========================================
+# FLUSH SCHEDULER
+# ==========================================
+
+class LoopSignal:
+    """
+    Stands in for FlushScheduler's threading.Condition on the event loop.
+    Everything runs on one thread, so entering it takes no lock and
+    notify() only wakes the scheduler task.
+    """
+    def __init__(self):
+        self.event = asyncio.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def notify(self):
+        self.event.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+class AsyncFlushScheduler(core.FlushScheduler):
+    """
+    FlushScheduler (same deadlines, thresholds and coalescing modes) driven
+    by a task instead of a thread. Installed as opcua_client.flush_scheduler,
+    so process_notification() and log_event() feed it unchanged.
+    """
+    def __init__(self, latencies):
+        super().__init__(latencies)
+        self.cond = LoopSignal()
+
+    async def run(self):
+        while True:
+            self.cond.event.clear()
+            now = time.time()
+            events_due = self.event_deadline is not None and now >= self.event_deadline
+            if events_due:
+                self.event_deadline = None
+                self.event_count = 0
+                core.uploader.wake(flush_events=True)
+            
+            if self._data_due(now):
+                self._push(self._take())
+            elif not events_due:
+                deadlines = [d for d in (self.deadline, self.event_deadline) if d is not None]
+                await self.cond.wait(max(0, min(deadlines) - now) if deadlines else None)
+
+# ==========================================
+# UPLINK
+# ==========================================
+
+class AsyncUplink:
+    """
+    Uplink task: the async Uploader. Owns the Socket.IO AsyncClient and all
+    cloud I/O. Installed as opcua_client.uploader, so log_event(), the flush
+    scheduler and the shared WebSocket handlers wake it unchanged.
+    Data batches are pipelined over the WebSocket with one ack-awaiting call
+    per batch (up to WS_INFLIGHT_WINDOW); the spool cursor only advances
+    over the acknowledged prefix, as in DeliveryWindow.
+    """
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.sio = socketio.AsyncClient(reconnection=True, reconnection_attempts=0, reconnection_delay=5)
+        self._wake = asyncio.Event()
+        self._flush_events = False
+        self._config_requested = False
+        self.inflight = OrderedDict()  # seq -> (batch, task resolving to the server's ack)
+        self.last_config_fetch = 0
+        self.last_heartbeat = 0
+        self.last_event_flush = 0
+        self.device_info_uploaded = False
+        
+        self.sio.on('connect', self.on_connect)
+        self.sio.on('disconnect', self.on_disconnect)
+        self.sio.on('connect_error', core.connect_error)
+        self.sio.on('raspberry_status_update', core.raspberry_status_update)
+        self.sio.on('uplink_encoding', core.uplink_encoding)
+        self.sio.on('config_changed', core.config_changed)
+        self.sio.on('opcua_watch_set', core.opcua_watch_set)
+
+    def wake(self, flush_events=False):
+        if flush_events:
+            self._flush_events = True
+        self._wake.set()
+
+    def request_config(self):
+        self._config_requested = True
+        self._wake.set()
+    
+    # ---- WebSocket ----
+
+    @property
+    def connected(self):
+        return core.websocket_connected and self.sio.connected
+
+    async def on_connect(self):
+        core.websocket_connected = True
+        logger.info(f"🔌 WebSocket connected to {API_BASE_URL}")
+        # Acks for batches sent on the previous connection will never arrive - resend from the spool cursor
+        self.clear_inflight()
+        await self.sio.emit('raspberry_register', {
+            'raspberryId': RASPBERRY_ID,
+            'status': 'online',
+            'encodings': [UPLINK_ENCODING],
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        })
+        self.wake()
+
+    async def on_disconnect(self, *args):
+        core.websocket_connected = False
+        core.ws_uplink_encoding = None
+        logger.warning("⚠️  WebSocket disconnected")
+
+    async def connect_websocket(self):
+        """First connect (AsyncClient reconnects by itself once it was connected)"""
+        while not self.sio.connected:
+            try:
+                logger.info(f"🔄 Connecting WebSocket to {API_BASE_URL}...")
+                await self.sio.connect(API_BASE_URL, auth={'raspberryId': RASPBERRY_ID},
+                                       transports=['websocket', 'polling'])
+            except Exception as e:
+                logger.error(f"❌ WebSocket connection failed: {e}")
+                await asyncio.sleep(RETRY_INTERVAL)
+
+    async def disconnect_websocket(self):
+        try:
+            if self.sio.connected:
+                await self.sio.emit('raspberry_register', {
+                    'raspberryId': RASPBERRY_ID,
+                    'status': 'offline',
+                    'timestamp': datetime.utcnow().isoformat() + 'Z'
+                })
+                await self.sio.disconnect()
+                logger.info("🔌 WebSocket disconnected gracefully")
+        except Exception as e:
+            logger.debug(f"Error disconnecting WebSocket: {e}")
+    
+    # ---- Task ----
+
+    async def run(self):
+        ws_task = asyncio.ensure_future(self.connect_websocket())
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), UPLOADER_IDLE)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                
+                try:
+                    await self.run_once(time.time())
+                except Exception as e:
+                    logger.error(f"❌ Uploader error: {e}")
+        finally:
+            ws_task.cancel()
+            self.clear_inflight()
+
+    async def run_once(self, current_time):
+        refresh_interval = CONFIG_PUSH_REFRESH_INTERVAL if self.connected else CONFIG_REFRESH_INTERVAL
+        if self._config_requested or (current_time - self.last_config_fetch) > refresh_interval:
+            fetched, data = await guarded_call('config', self.fetch_config)
+            if fetched:
+                self._config_requested = False
+                self.last_config_fetch = current_time
+            if data:
+                core.config_version = data.get('version')
+                self.runtime.apply_config(data)
+        
+        if await core.uplink_spool.backlog('data') or self.inflight:
+            await self.drain_data()
+        
+        await self.flush_events(force=self._flush_events)
+        self._flush_events = False
+        
+        if (current_time - self.last_heartbeat) > HEARTBEAT_INTERVAL:
+            if await self.send_heartbeat('online'):
+                logger.debug("💓 Heartbeat sent")
+            self.last_heartbeat = current_time
+        
+        if not self.device_info_uploaded:
+            await guarded_call('device_info', self.upload_device_info)
+        
+        if core.pending_discovered_nodes:
+            await self.upload_pending_discovered_nodes()
+    
+    # ---- Config ----
+
+    async def fetch_config(self):
+        """GET the config (If-None-Match: current version); None when unchanged"""
+        logger.info(f"📡 Fetching configuration for Raspberry Pi: {RASPBERRY_ID}")
+        headers = {}
+        if core.config_version:
+            headers['If-None-Match'] = f'"{core.config_version}"'
+        response = await transport.request('GET', 'config', CONFIG_ENDPOINT, headers=headers)
+        core.note_accept_encoding(response)
+        
+        if response.status_code == 304:
+            logger.debug("Configuration not modified")
+            return None
+        if response.status_code == 403:
+            raise Exception("Unauthorized: Raspberry Pi not registered in system")
+        if response.status_code == 404:
+            raise Exception("Configuration not found. Please configure device in admin panel")
+        
+        response.raise_for_status()
+        data = response.json()
+        if not data.get('success'):
+            raise Exception(data.get('error', 'Unknown error'))
+        if not data.get('version'):
+            data['version'] = response.headers.get('ETag', '').strip('"') or None
+        return data
+    
+    # ---- Data ----
+
+    async def drain_data(self):
+        if self.connected:
+            return await self.drain_data_websocket()
+        
+        # Acks for batches sent on the lost socket will never arrive; HTTP resends them from the cursor
+        self.clear_inflight()
+        
+        if not core.circuit_breakers['data'].ready():
+            return False
+        
+        for entry_id, batch in await core.uplink_spool.read('data', SPOOL_DRAIN_BATCHES):
+            logger.info("⚠️  WebSocket unavailable, falling back to HTTP POST")
+            success, result = await guarded_call('data', self.upload_data, batch, entry_id)
+            if not success:
+                logger.warning(f"⚠️  {await core.uplink_spool.backlog('data')} data batch(es) kept in spool")
+                return False
+            logger.info(f"📤 Pushed {result.get('received', 0)} datapoints via HTTP")
+            await core.uplink_spool.ack('data', entry_id)
+        return True
+
+    async def drain_data_websocket(self):
+        """Keep up to WS_INFLIGHT_WINDOW batches in flight; advance the spool over the acknowledged prefix"""
+        acked = None
+        retransmit = []
+        
+        for seq, (batch, task) in list(self.inflight.items()):
+            if not task.done():
+                continue
+            response = task.result()
+            if response.get('resync'):
+                # Server doesn't know a node index we used - resend with a fresh dictionary
+                core.uplink_encoder.reset()
+            if response.get('success') or not response.get('retry'):
+                if not response.get('success'):
+                    logger.warning(f"⚠️  Server rejected data batch {seq}: {response.get('error')}")
+                continue
+            retransmit.append((seq, batch))
+        
+        if retransmit:
+            logger.warning(f"⚠️  Retransmitting {len(retransmit)} unacknowledged data batch(es)")
+        for seq, batch in retransmit:
+            self.send_batch(seq, batch)
+        
+        while self.inflight:
+            seq, (_, task) = next(iter(self.inflight.items()))
+            if not task.done():
+                break
+            self.inflight.popitem(last=False)
+            acked = seq
+        if acked is not None:
+            await core.uplink_spool.ack('data', acked)
+        
+        free = WS_INFLIGHT_WINDOW - len(self.inflight)
+        if free > 0:
+            for entry_id, batch in await core.uplink_spool.read('data', len(self.inflight) + free):
+                if entry_id not in self.inflight:
+                    self.send_batch(entry_id, batch)
+        return True
+
+    def send_batch(self, seq, batch):
+        """Emit one batch frame and track the call awaiting its ack"""
+        header = {'raspberryId': RASPBERRY_ID, 'epoch': core.uplink_spool.epoch, 'seq': seq}
+        if core.ws_uplink_encoding == UPLINK_ENCODING:
+            frame = core.uplink_encoder.encode(batch, header)
+            summary = f"{len(frame)} bytes {UPLINK_ENCODING}"
+        else:
+            frame = dict(core.data_frame(batch), **header)
+            summary = (f"{len(frame['data'])} configured in {len(frame['equipment'])} equipment, "
+                       f"{len(frame['discovered_nodes'])} discovered")
+        
+        task = asyncio.ensure_future(self._call('opcua_data_change', frame))
+        task.add_done_callback(lambda _: self.wake())
+        self.inflight[seq] = (batch, task)
+        logger.info(f"📤 Pushed {len(batch)} datapoints via WebSocket ({summary})")
+
+    async def _call(self, event, frame):
+        """Emit and wait for the server's ack; timeouts and lost sockets ask for a retransmit"""
+        try:
+            return await self.sio.call(event, frame, timeout=WS_ACK_TIMEOUT) or {}
+        except Exception as e:
+            return {'retry': True, 'error': str(e) or type(e).__name__}
+
+    def clear_inflight(self):
+        for _, task in self.inflight.values():
+            task.cancel()
+        self.inflight.clear()
+
+    async def upload_data(self, data, seq):
+        header = {'raspberryId': RASPBERRY_ID, 'epoch': core.uplink_spool.epoch, 'seq': seq}
+        if core.http_uplink_encoding == UPLINK_ENCODING:
+            headers = dict(JSON_HEADERS, **{'Content-Type': 'application/x-msgpack'})
+            body = core.uplink_encoder.encode(data, header, stateless=True)
+            response = await post_uplink('data', DATA_ENDPOINT, headers, body=body)
+        else:
+            response = await post_uplink('data', DATA_ENDPOINT, JSON_HEADERS, dict(header, data=data))
+        response.raise_for_status()
+        
+        result = response.json()
+        if not result.get('success'):
+            raise Exception(result.get('error', 'Unknown error'))
+        return result
+    
+    # ---- Events, heartbeat, device info ----
+
+    async def flush_events(self, force=False):
+        """Async flush_event_buffer(): spooled events, oldest first, acked once the server stored them"""
+        current_time = time.time()
+        backlog = await core.uplink_spool.backlog('events')
+        should_flush = force or backlog >= EVENT_FLUSH_COUNT or \
+            (backlog > 0 and (current_time - self.last_event_flush) >= EVENT_FLUSH_INTERVAL)
+        if not should_flush or backlog == 0:
+            return
+        
+        breaker = core.circuit_breakers['events']
+        if not breaker.allow():
+            return
+        self.last_event_flush = current_time
+        
+        for _ in range(EVENT_FLUSH_MAX_BATCHES):
+            entries = await core.uplink_spool.read('events', EVENT_UPLOAD_BATCH)
+            if not entries:
+                break
+            
+            try:
+                payload = {'raspberryId': RASPBERRY_ID, 'events': [event for _, event in entries]}
+                response = await post_uplink('events', EVENT_LOG_ENDPOINT, JSON_HEADERS, payload)
+                if response.status_code != 200:
+                    raise Exception(f"HTTP {response.status_code}, keeping {backlog} events spooled")
+                result = response.json()
+                if not result.get('success'):
+                    raise Exception(result.get('error'))
+                
+                await core.uplink_spool.ack('events', entries[-1][0])
+                breaker.record(True)
+                logger.info(f"📝 Flushed {len(entries)} events to log")
+            except Exception as e:
+                breaker.record(False, e)
+                break
+            
+            if len(entries) < EVENT_UPLOAD_BATCH:
+                break
+
+    async def _heartbeat_request(self, status):
+        payload = {
+            'raspberryId': RASPBERRY_ID,
+            'status': status,
+            'uplink': transport.stats(),
+            'opcuaServers': self.runtime.server_status(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        }
+        response = await post_uplink('heartbeat', HEARTBEAT_ENDPOINT, JSON_HEADERS, payload)
+        response.raise_for_status()
+        return True
+
+    async def send_heartbeat(self, status='online'):
+        success, _ = await guarded_call('heartbeat', self._heartbeat_request, status)
+        return success
+
+    async def upload_device_info(self):
+        device_info = core.get_device_info()
+        if not device_info:
+            raise Exception("Failed to collect device info")
+        
+        logger.info(f"📤 Uploading device info to {DEVICE_INFO_ENDPOINT}")
+        response = await post_uplink('device_info', DEVICE_INFO_ENDPOINT, JSON_HEADERS, device_info)
+        if response.status_code == 503:
+            raise Exception("Server database not ready yet")
+        response.raise_for_status()
+        
+        result = response.json()
+        if not result.get('success'):
+            raise Exception(result.get('error'))
+        logger.info("✅ Device info uploaded successfully!")
+        self.device_info_uploaded = True
+    
+    # ---- Discovered nodes ----
+
+    async def upload_pending_discovered_nodes(self):
+        async with self.runtime.discovery_lock:
+            nodes = core.pending_discovered_nodes
+            if not nodes:
+                return True
+            snapshot = core.discovery_snapshot
+            success, _ = await guarded_call('discovered_nodes', upload_discovered_nodes, nodes, snapshot['fingerprint'])
+            if success:
+                logger.info(f"✅ Successfully uploaded {len(nodes)} pending nodes")
+                core.pending_discovered_nodes = None
+                await asyncio.get_running_loop().run_in_executor(
+                    None, core.save_discovery_snapshot, nodes, snapshot['serverFingerprint'], snapshot['fingerprint'])
+            return success
+
+async def _post_discovered_nodes(payload):
+    return await post_uplink('discovered_nodes', DISCOVERED_NODES_ENDPOINT, JSON_HEADERS, payload)
+
+async def upload_discovered_nodes(nodes, version):
+    """Async opcua_client._upload_discovered_nodes(): delta against the acknowledged snapshot, else full"""
+    if core.discovery_ack['version']:
+        payload = core.discovery_payload(nodes, version, delta=True)
+        result = core.accept_discovery_response(await _post_discovered_nodes(payload), nodes, payload)
+        if result is not None:
+            return result
+    
+    payload = core.discovery_payload(nodes, version)
+    return core.accept_discovery_response(await _post_discovered_nodes(payload), nodes, payload)
+
+# ==========================================
+# OPC UA SESSIONS
+# ==========================================
+
+def data_change_filter(params):
+    """opcua_client.data_change_filter() built from asyncua's ua types"""
+    if params.deadband_type == 'none' and params.trigger == 'StatusValue':
+        return None
+    
+    mfilter = ua.DataChangeFilter()
+    mfilter.Trigger = ua.DataChangeTrigger(DATA_CHANGE_TRIGGERS.index(params.trigger))
+    mfilter.DeadbandType = DEADBAND_TYPES.index(params.deadband_type)
+    mfilter.DeadbandValue = float(params.deadband_value)
+    return mfilter
+
+def _bad_data_value():
+    return ua.DataValue(None, ua.StatusCode(ua.StatusCodes.BadCommunicationError))  # Value, StatusCode
+
+def _read_value_id(node_id, attribute):
+    rv = ua.ReadValueId()
+    rv.NodeId = ua.NodeId.from_string(node_id) if isinstance(node_id, str) else node_id
+    rv.AttributeId = attribute
+    return rv
+
+class NotificationHandler:
+    """
+    asyncua subscription handler. Callbacks already run on the event loop,
+    so each notification goes straight to process_notification() - no
+    queue or worker thread in between.
+    """
+    def __init__(self, session, handle_offset):
+        self.session = session
+        self.handle_offset = handle_offset
+
+    def datachange_notification(self, node, val, data):
+        item = data.monitored_item
+        try:
+            core.process_notification(self.handle_offset + item.ClientHandle, node, item.Value)
+        except Exception as e:
+            logger.error(f"❌ Error processing data change: {e}")
+
+    def status_change_notification(self, status):
+        status = getattr(status, 'Status', status)
+        if not status.is_good():
+            self.session.lost(f"subscription status {core.status_name(status)}")
+
+class AsyncSubscriptionManager(core.SubscriptionState):
+    """
+    SubscriptionManager for one asyncua session: the same rate-class groups,
+    chunking, filter fallback and reconcile() decisions (shared in
+    opcua_client.SubscriptionState), with awaited OPC UA calls. Items are
+    removed with one DeleteMonitoredItems call per subscription.
+    """
+    def __init__(self, session):
+        super().__init__(core.datapoint_registry)
+        self.session = session
+
+    def forget(self):
+        """Drop local state after the session is gone (the server deletes its subscriptions with it)"""
+        for item in self.items.values():
+            self.registry.unbind(item.client_handle)
+        self.groups = {}
+        self.items = {}
+        self.failed = {}
+
+    async def close(self):
+        for groups in self.groups.values():
+            for group in groups:
+                await self._delete_group(group)
+        self.forget()
+
+    async def _new_group(self, rate_class):
+        offset = next(handle_offsets)
+        subscription = await self.session.client.create_subscription(RATE_CLASSES[rate_class],
+                                                                     NotificationHandler(self.session, offset))
+        group = core.SubscriptionGroup(rate_class, subscription, offset, self.max_items_per_subscription)
+        position = self.add_group(group)
+        logger.info(f"     + {rate_class} subscription #{position} ({RATE_CLASSES[rate_class]}ms) on {self.session.name}")
+        return group
+
+    async def _delete_group(self, group):
+        try:
+            await group.subscription.delete()
+        except Exception as e:
+            logger.debug(f"Error deleting subscription: {e}")
+
+    async def reconcile(self, desired):
+        """Returns (added, removed, modified, failed) counts"""
+        to_remove, to_add, to_modify = self.plan(desired)
+        removed = await self._remove(to_remove)
+        modified = await self._modify(to_modify)
+        added, failed = await self._add(to_add)
+        return added, removed, modified, failed
+
+    async def _add(self, entries):
+        failures = Counter()
+        added = 0
+        rejected = []
+        
+        for rate_class, class_entries in self.by_rate_class(entries).items():
+            class_added, class_rejected = await self._add_to_class(rate_class, class_entries, True, failures)
+            added += class_added
+            rejected.extend(class_rejected)
+        
+        if rejected:
+            fallback_added = 0
+            for rate_class, class_entries in self.by_rate_class(rejected).items():
+                fallback_added += (await self._add_to_class(rate_class, class_entries, False, failures))[0]
+            added += fallback_added
+            logger.info(f"     ↳ {fallback_added} item(s) fell back to client-side deadband (filter rejected by server)")
+        
+        return added, self.log_failures(failures, f" on {self.session.name}")
+
+    async def _add_to_class(self, rate_class, entries, use_filter, failures):
+        added = 0
+        rejected = []
+        
+        while entries:
+            group = self.free_group(rate_class)
+            try:
+                if group is None:
+                    group = await self._new_group(rate_class)
+            except Exception as e:
+                self.fail([node_id for node_id, _ in entries], str(e), failures, type(e).__name__)
+                break
+            
+            batch, entries = entries[:group.free], entries[group.free:]
+            batch_added, batch_rejected, full = await self._create(group, batch, use_filter, failures)
+            added += batch_added
+            rejected.extend(batch_rejected)
+            if full:
+                entries = self.split_full(group, full, failures) + entries
+        
+        return added, rejected
+
+    async def _create(self, group, entries, use_filter, failures):
+        requests_by_node = []
+        subscription = group.subscription
+        
+        for node_id, params in entries:
+            try:
+                node = self.session.client.get_node(self.session.opc_node_id(node_id))
+                request = subscription._make_monitored_item_request(
+                    node, ua.AttributeIds.Value, data_change_filter(params) if use_filter else None,
+                    params.queue_size, ua.MonitoringMode.Reporting, params.sampling_interval)
+                requests_by_node.append((node_id, params, request))
+            except Exception as e:
+                self.fail([node_id], str(e), failures, 'InvalidNodeId')
+        
+        added = 0
+        rejected = []
+        full = []
+        start = 0
+        chunk_size = self.max_items_per_call
+        while start < len(requests_by_node):
+            chunk = requests_by_node[start:start + chunk_size]
+            try:
+                results = await subscription.create_monitored_items([request for _, _, request in chunk])
+            except Exception as e:
+                smaller = self.shrink_call(chunk, e, chunk_size)
+                if smaller:
+                    chunk_size = smaller
+                    continue
+                self.fail([node_id for node_id, _, _ in chunk], str(e), failures, type(e).__name__)
+                start += len(chunk)
+                continue
+            
+            chunk_added, chunk_rejected, chunk_full = self.record_results(group, chunk, results, use_filter, failures)
+            added += chunk_added
+            rejected.extend(chunk_rejected)
+            full.extend(chunk_full)
+            start += len(chunk)
+        
+        return added, rejected, full
+
+    async def _remove(self, items):
+        removed = 0
+        by_group = {}
+        for item in items:
+            by_group.setdefault(id(item.group), (item.group, []))[1].append(item)
+            self.drop(item)
+        
+        # One DeleteMonitoredItems call per subscription
+        for group, group_items in by_group.values():
+            try:
+                await group.subscription.unsubscribe([item.server_handle for item in group_items])
+                removed += len(group_items)
+            except Exception as e:
+                logger.debug(f"     ✗ Could not unsubscribe {len(group_items)} item(s): {e}")
+        
+        for group in self.prune_groups():
+            await self._delete_group(group)
+        return removed
+
+    async def _modify(self, entries):
+        modified = 0
+        for item, params in entries:
+            try:
+                await item.group.subscription.modify_monitored_item(item.server_handle, params.sampling_interval,
+                                                                    params.queue_size)
+                item.params = params
+                modified += 1
+            except Exception as e:
+                logger.debug(f"     ✗ Could not modify {item.node_id}: {e}")
+        return modified
+
+class PlcSession:
+    """
+    One OPC UA server: its asyncua session, subscriptions, health state and
+    discovery. run() connects, subscribes and then supervises the session
+    (periodic ServerState reads, reconcile requests) until it is lost, then
+    reconnects after RETRY_INTERVAL. Discovery runs as a child task; the
+    nodes it finds are merged with the other servers' by the runtime.
+    """
+    def __init__(self, runtime, endpoint):
+        self.runtime = runtime
+        self.endpoint = endpoint  # opcua_client.opcua_servers() entry
+        self.server_id = endpoint['id']
+        self.name = endpoint['name']
+        self.client = None
+        self.limits = {}
+        self.status = 'Unknown'
+        self.subscriptions = AsyncSubscriptionManager(self)
+        self.connected = asyncio.Event()
+        self._reconcile = asyncio.Event()
+        self._lost = None
+        self.nodes = []  # This server's discovered nodes (opcNodeId = node key)
+        self.fingerprint = None  # Server fingerprint the nodes were discovered under
+
+    def request_reconcile(self):
+        self._reconcile.set()
+
+    def lost(self, reason):
+        """Session failure reported from a callback; the supervisor reconnects"""
+        if self._lost is None:
+            self._lost = reason
+            self._reconcile.set()
+
+    def _set_status(self, status, event_type, quality, message, metadata=None):
+        old_status, self.status = self.status, status
+        core.log_event(event_type=event_type, quality=quality, message=message,
+                       metadata=dict(metadata or {}, opcua_server=self.name, opcua_server_id=self.server_id,
+                                     previous_status=old_status))
+        self.runtime.status_changed(self)
+
+    def opc_node_id(self, node_id):
+        """NodeId string on this server for a node key (drops the server prefix)"""
+        prefix = core.node_key(self.server_id, '')
+        return node_id[len(prefix):] if prefix and node_id.startswith(prefix) else node_id
+
+    async def run(self):
+        discovery = asyncio.ensure_future(self.discovery_loop()) if self.runtime.runs_discovery else None
+        try:
+            while True:
+                try:
+                    await self.connect()
+                    await self.setup()
+                    await self.supervise()
+                except Exception as e:
+                    logger.error(f"❌ OPC UA session {self.name} failed: {e}")
+                    if self.status != 'Disconnected':
+                        self._set_status('Disconnected', 'connection_lost', 'Bad',
+                                         f"OPC UA server {self.name} not responding: {e}", {'error': str(e)})
+                await self.disconnect()
+                logger.error(f"❌ Reconnecting to {self.name} in {RETRY_INTERVAL} seconds...")
+                await asyncio.sleep(RETRY_INTERVAL)
+        finally:
+            if discovery:
+                discovery.cancel()
+            await asyncio.shield(self.disconnect())
+
+    async def connect(self):
+        url = f"opc.tcp://{self.endpoint['ip']}:{self.endpoint['port']}"
+        logger.info(f"🔗 Connecting to OPC UA server: {url}")
+        self.client = Client(url, timeout=OPCUA_REQUEST_TIMEOUT)
+        self.client.session_timeout = self.endpoint.get('timeout') or 60000
+        await self.client.connect()
+        self._lost = None
+        self.limits = await self.read_operation_limits()
+        self._set_status('Connected', 'connection_restored', 'Good', f"Connected to OPC UA server {self.name}",
+                         {'opcua_server_ip': self.endpoint['ip'], 'opcua_server_port': self.endpoint['port']})
+        logger.info(f"✅ Connected to OPC UA server: {self.name}")
+        self.connected.set()
+
+    async def disconnect(self):
+        self.connected.clear()
+        self.subscriptions.forget()
+        if self.client is not None:
+            client, self.client = self.client, None
+            try:
+                await asyncio.wait_for(client.disconnect(), HEALTH_CHECK_TIMEOUT)
+                logger.info(f"🔌 Disconnected from OPC UA server {self.name}")
+            except Exception as e:
+                logger.debug(f"Error disconnecting from {self.name}: {e}")
+
+    async def setup(self):
+        if core.acquisition_mode() == 'poll':
+            logger.warning("⚠️  Polling acquisition is only available in the threaded runtime, using subscriptions")
+        self.subscriptions.configure(self.limits, (core.config or {}).get('max_items_per_subscription'))
+        logger.info(f"📡 Creating subscriptions by rate class "
+                    f"({', '.join(f'{name} {interval}ms' for name, interval in RATE_CLASSES.items())})")
+        added, _, _, _ = await self.subscriptions.reconcile(self.desired_items())
+        logger.info(f"✅ Total subscriptions on {self.name}: {added} nodes ({self.subscriptions.max_items_per_call} "
+                    f"per call), by rate class (subscriptions, items): {self.subscriptions.summary()}")
+
+    def desired_items(self):
+        desired = core.desired_monitored_items(self.server_id)
+        if self.runtime.shard:
+            index, count = self.runtime.shard
+            desired = {node_id: params for node_id, params in desired.items() if shard_of(node_id, count) == index}
+        return desired
+
+    async def supervise(self):
+        """Health checks every CONNECTION_CHECK_INTERVAL; reconcile whenever asked"""
+        next_check = time.time() + CONNECTION_CHECK_INTERVAL
+        while True:
+            try:
+                await asyncio.wait_for(self._reconcile.wait(), max(0, next_check - time.time()))
+            except asyncio.TimeoutError:
+                pass
+            
+            if self._lost:
+                raise Exception(self._lost)
+            
+            if self._reconcile.is_set():
+                self._reconcile.clear()
+                core.datapoint_registry.compile(core.datapoints, core.discovered_nodes_cache)
+                added, removed, modified, failed = await self.subscriptions.reconcile(self.desired_items())
+                if added or removed or modified or failed:
+                    logger.info(f"🔁 Reconciled subscription on {self.name}: +{added} -{removed} ~{modified} "
+                                f"({failed} failed, {len(self.subscriptions.items)} total)")
+            
+            if time.time() >= next_check:
+                await self.check_health()
+                next_check = time.time() + CONNECTION_CHECK_INTERVAL
+
+    async def check_health(self):
+        """Read ServerState; raises (ending the session) when the server doesn't answer"""
+        node = self.client.get_node(ua.NodeId(ua.ObjectIds.Server_ServerStatus_State))
+        state = await asyncio.wait_for(node.read_value(), HEALTH_CHECK_TIMEOUT)
+        if self.status != 'Connected':
+            self._set_status('Connected', 'connection_restored', 'Good',
+                             f"OPC UA connection to {self.name} restored", {'server_state': str(state)})
+            logger.info(f"✅ Connection health check: {self.name} restored")
+    
+    # ---- Bulk services ----
+
+    async def read_operation_limits(self):
+        limits = {name: 0 for name in OPERATION_LIMIT_NODES}
+        try:
+            results = await self.bulk_read(list(OPERATION_LIMIT_NODES.values()))
+            for name, result in zip(OPERATION_LIMIT_NODES, results):
+                if result.StatusCode.is_good() and result.Value.Value:
+                    limits[name] = int(result.Value.Value)
+        except Exception as e:
+            logger.debug(f"Could not read operation limits: {e}")
+        logger.info(f"   Operation limits: {limits}")
+        return limits
+
+    async def _read_requests(self, read_value_ids):
+        chunk_size = self.limits.get('MaxNodesPerRead') or DEFAULT_MAX_NODES_PER_READ
+        results = []
+        for start in range(0, len(read_value_ids), chunk_size):
+            chunk = read_value_ids[start:start + chunk_size]
+            try:
+                params = ua.ReadParameters()
+                params.TimestampsToReturn = ua.TimestampsToReturn.Both
+                params.NodesToRead = chunk
+                results.extend(await self.client.uaclient.read(params))
+            except Exception as e:
+                logger.warning(f"⚠️  Bulk read of {len(chunk)} attribute(s) failed: {e}")
+                results.extend(_bad_data_value() for _ in chunk)
+        return results
+
+    async def bulk_read(self, node_ids, attribute=ua.AttributeIds.Value):
+        return await self._read_requests([_read_value_id(node_id, attribute) for node_id in node_ids])
+
+    async def bulk_read_attributes(self, node_ids, attributes):
+        results = await self._read_requests([_read_value_id(node_id, attribute)
+                                             for node_id in node_ids for attribute in attributes])
+        width = len(attributes)
+        return [tuple(results[i:i + width]) for i in range(0, len(results), width)]
+
+    async def browse_many(self, node_ids):
+        """Multi-node Browse + BrowseNext, chunked by MaxNodesPerBrowse (see opcua_client.browse_many)"""
+        chunk_size = self.limits.get('MaxNodesPerBrowse') or DEFAULT_MAX_NODES_PER_BROWSE
+        references = [[] for _ in node_ids]
+        
+        for start in range(0, len(node_ids), chunk_size):
+            chunk = node_ids[start:start + chunk_size]
+            try:
+                results = await self.client.uaclient.browse(core.browse_parameters(chunk, ua))
+            except Exception as e:
+                logger.debug(f"Browse of {len(chunk)} node(s) failed: {e}")
+                continue
+            
+            pending = core.collect_references(references, range(start, start + len(chunk)), results)
+            while pending:
+                try:
+                    next_results = await self.client.uaclient.browse_next(core.browse_next_parameters(pending.values(), ua))
+                except Exception as e:
+                    logger.debug(f"BrowseNext failed: {e}")
+                    break
+                pending = core.collect_references(references, list(pending), next_results)
+        
+        return references
+    
+    # ---- Discovery ----
+
+    async def discover_nodes(self):
+        """opcua_client.DiscoveryWalk driven by this session's bulk Browse and Read calls"""
+        logger.info(f"🔍 Starting node discovery on {self.name}...")
+        started = time.time()
+        
+        walk = core.DiscoveryWalk(ua)
+        while not walk.done:
+            walk.add(await self.browse_many(walk.frontier))
+        
+        node_ids = walk.variable_ids()
+        attributes = await self.bulk_read_attributes(node_ids, (ua.AttributeIds.Value, ua.AttributeIds.DataType))
+        discovered = walk.nodes(node_ids, attributes, self.server_id)
+        
+        logger.info(f"✅ Discovered {len(discovered)} nodes on {self.name} in {time.time() - started:.1f}s "
+                    f"({len(walk.visited)} objects browsed)")
+        return discovered
+
+    async def read_server_fingerprint(self):
+        values = [dv.Value.Value if dv.StatusCode.is_good() else None for dv in await self.bulk_read(FINGERPRINT_NODES)]
+        return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    async def discovery_loop(self):
+        """Warm start from the snapshot (verified later) or discover now; then daily at NODE_DISCOVERY_TIME"""
+        await self.connected.wait()
+        
+        snapshot = await self.runtime.load_discovery_snapshot()
+        nodes = [node for node in (snapshot or {}).get('nodes') or [] if core.node_server_id(node) == self.server_id]
+        if nodes:
+            self.nodes = nodes
+            self.fingerprint = snapshot_fingerprints(snapshot).get(self.server_id)
+            self.runtime.publish_discovered_nodes()
+            delay = DISCOVERY_VERIFY_DELAY
+            if await self.read_server_fingerprint() != self.fingerprint:
+                logger.info(f"🔍 Server fingerprint of {self.name} changed since snapshot, verifying now")
+                delay = 0
+            logger.info(f"💾 Warm start from snapshot: {len(nodes)} discovered nodes on {self.name} "
+                        f"(saved {snapshot.get('savedAt')}), verification in {delay}s")
+            await asyncio.sleep(delay)
+        else:
+            logger.info(f"🔍 Running initial node discovery on {self.name}...")
+        
+        while True:
+            await self.connected.wait()
+            try:
+                await self.save_discovered_nodes()
+            except Exception as e:
+                logger.error(f"❌ Unexpected error in node discovery on {self.name}: {e}")
+            await asyncio.sleep(seconds_until(NODE_DISCOVERY_TIME))
+
+    async def save_discovered_nodes(self):
+        """Discover this server's nodes, then let the runtime cache and upload the merged list"""
+        nodes = await self.discover_nodes()
+        if not nodes:
+            logger.warning(f"⚠️  No nodes discovered on {self.name}")
+            return False
+        
+        self.fingerprint = await self.read_server_fingerprint()
+        self.nodes = nodes
+        return await self.runtime.save_discovered_nodes()
+
+def snapshot_fingerprints(snapshot):
+    """{server_id: fingerprint} of a discovery snapshot (single-server snapshots store a plain string)"""
+    fingerprints = snapshot.get('serverFingerprint')
+    return fingerprints if isinstance(fingerprints, dict) else {core.primary_server_id: fingerprints}
+
+def seconds_until(hh_mm):
+    """Seconds until the next local HH:MM"""
+    hour, minute = (int(part) for part in hh_mm.split(':'))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+def endpoint_key(endpoint):
+    """Endpoint fields that require a new session when they change"""
+    return endpoint['id'], endpoint['ip'], endpoint['port'], endpoint.get('timeout')
+
+# ==========================================
+# RUNTIME
+# ==========================================
+
+class AsyncRuntime:
+    """
+    Owns the tasks. The flush scheduler and uplink are installed in place of
+    opcua_client's thread-based ones so the shared notification/event code
+    feeds them. If any long-lived task dies, or on SIGINT/SIGTERM, all
+    tasks are cancelled together and the spool is closed.
+    """
+    def __init__(self):
+        self.flush = AsyncFlushScheduler(FLUSH_LATENCY)
+        self.uplink = AsyncUplink(self)
+        self.sessions = {}  # endpoint_key -> (PlcSession, task)
+        self.applied_config_hash = None
+        self.discovery_lock = asyncio.Lock()  # Merged discovery cache/upload, one server at a time
+        self.snapshot_loaded = False
+        self.shard = None  # (index, count) in a shard worker: only that share of the nodes is subscribed
+        self.runs_discovery = True
+        self.last_rate_review = time.time()
+        self.stopping = asyncio.Event()
+        core.flush_scheduler = self.flush
+        core.uploader = self.uplink
+        core.uplink_spool = AsyncSpool(core.uplink_spool)
+
+    def apply_config(self, data):
+        """Install a fetched config: start/stop sessions for changed endpoints, reconcile the rest"""
+        core.load_config(data)
+        new_hash = core.compute_config_hash(core.config, core.datapoints)
+        endpoints = {endpoint_key(endpoint): endpoint for endpoint in core.opcua_servers(core.config)}
+        
+        removed = [key for key in self.sessions if key not in endpoints]
+        for key in removed:
+            session, task = self.sessions.pop(key)
+            logger.info(f"🔁 OPC UA server {session.name} removed from config, disconnecting")
+            task.cancel()
+        if removed:
+            self.publish_discovered_nodes()
+        
+        for key, endpoint in endpoints.items():
+            if key not in self.sessions:
+                session = PlcSession(self, endpoint)
+                self.sessions[key] = (session, asyncio.ensure_future(session.run()))
+            elif new_hash != self.applied_config_hash:
+                logger.info("🔁 Configuration changed, reconciling subscriptions in place")
+                self.sessions[key][0].request_reconcile()
+        self.applied_config_hash = new_hash
+
+    def reconcile_all(self):
+        for session, _ in self.sessions.values():
+            session.request_reconcile()
+
+    def status_changed(self, session):
+        """A session's connection state changed (reported by shard workers)"""
+
+    def server_status(self):
+        """Per-server connection state, reported with the heartbeat"""
+        return [{'id': session.server_id, 'name': session.name, 'status': session.status}
+                for session, _ in self.sessions.values()]
+    
+    # ---- Discovery (merged across servers) ----
+
+    async def load_discovery_snapshot(self):
+        """Read the on-disk snapshot once; every session warm-starts from its own part of it"""
+        async with self.discovery_lock:
+            if not self.snapshot_loaded:
+                self.snapshot_loaded = True
+                await asyncio.get_running_loop().run_in_executor(None, core.load_discovery_snapshot)
+        return core.discovery_snapshot
+
+    def publish_discovered_nodes(self):
+        """Merge every session's discovered nodes into the shared cache and resubscribe"""
+        core.discovered_nodes_cache = list(chain.from_iterable(session.nodes for session, _ in self.sessions.values()))
+        self.reconcile_all()
+
+    async def save_discovered_nodes(self):
+        """
+        Cache the merged node list for subscription and upload it (skipped while the
+        fingerprint is unchanged). The server keeps one discovered node list per
+        Raspberry Pi, so all servers' nodes always go up together.
+        """
+        async with self.discovery_lock:
+            self.publish_discovered_nodes()
+            nodes = core.discovered_nodes_cache
+            server_fingerprints = {session.server_id: session.fingerprint
+                                   for session, _ in self.sessions.values() if session.nodes}
+            fingerprint = core.discovery_fingerprint(server_fingerprints, nodes)
+            unchanged = core.discovery_ack['version'] == fingerprint and bool(core.discovery_snapshot) \
+                and core.discovery_snapshot.get('server') == core.server_key()
+            logger.info(f"💾 Cached {len(nodes)} discovered nodes for monitoring")
+            
+            if unchanged:
+                logger.info("✅ Address space unchanged since last upload, skipping discovered nodes upload")
+                return True
+            
+            success, _ = await guarded_call('discovered_nodes', upload_discovered_nodes, nodes, fingerprint)
+            await asyncio.get_running_loop().run_in_executor(
+                None, core.save_discovery_snapshot, nodes, server_fingerprints, fingerprint)
+            if not success:
+                core.pending_discovered_nodes = nodes
+                logger.warning(f"⚠️  Saved {len(nodes)} nodes to pending queue for later upload")
+                return False
+            
+            logger.info(f"📤 Saved {len(nodes)} discovered nodes to cloud")
+            return True
+
+    def review_subscriptions(self):
+        """Watch set changes and rate class review; reconciles the sessions when either moved nodes"""
+        watch_added = core.watch_set.pop_changed()
+        watch_expired = core.watch_set.expire()
+        if watch_added or watch_expired:
+            self.reconcile_all()
+        
+        if (time.time() - self.last_rate_review) >= RATE_REVIEW_INTERVAL:
+            items = {}
+            for session, _ in self.sessions.values():
+                items.update(session.subscriptions.items)
+            if core.rate_observer.review(items):
+                logger.info("🔁 Observed change rates moved nodes between rate classes, reconciling...")
+                self.reconcile_all()
+            self.last_rate_review = time.time()
+
+    async def housekeeping(self):
+        """Spool commits/retention, watch set and rate class review (the main loop's periodic work)"""
+        last_retention = time.time()
+        while True:
+            await asyncio.sleep(1)
+            current_time = time.time()
+            self.review_subscriptions()
+            
+            await core.uplink_spool.sync()
+            if (current_time - last_retention) >= SPOOL_RETENTION_INTERVAL:
+                await core.uplink_spool.enforce_retention()
+                last_retention = current_time
+
+    async def run(self):
+        logger.info("=" * 60)
+        logger.info("🏭 OPC UA Monitoring Client Starting (asyncio runtime)")
+        logger.info(f"📱 Raspberry Pi ID: {RASPBERRY_ID}")
+        logger.info(f"🌐 API Server: {API_BASE_URL}")
+        logger.info("=" * 60)
+        logger.info(f"⏰ Daily node discovery at {NODE_DISCOVERY_TIME}")
+        
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        
+        tasks = [asyncio.ensure_future(coro) for coro in self.tasks()]
+        stop = asyncio.ensure_future(self.stopping.wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [stop], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stop and not task.cancelled() and task.exception():
+                    logger.error(f"❌ Fatal error in runtime task: {task.exception()}")
+            if self.stopping.is_set():
+                logger.info("\n⚠️  Shutdown signal received...")
+        finally:
+            stop.cancel()
+            await self.shutdown(tasks)
+
+    def tasks(self):
+        return [self.uplink.run(), self.flush.run(), self.housekeeping()]
+
+    async def shutdown(self, tasks):
+        logger.info("🛑 Shutting down...")
+        session_tasks = [task for _, task in self.sessions.values() if task]
+        for task in tasks + session_tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *session_tasks, return_exceptions=True)
+        await self.stop_workers()
+        
+        # Final flush into the spool and offline notice, bounded so a dead WAN can't hold up the exit
+        self.flush.flush()
+        try:
+            await asyncio.wait_for(self.uplink.send_heartbeat('offline'), SHUTDOWN_TIMEOUT)
+            await asyncio.wait_for(self.uplink.disconnect_websocket(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️  Uplink did not answer during shutdown")
+        
+        if core.pending_discovered_nodes:
+            logger.warning(f"⚠️  {len(core.pending_discovered_nodes)} discovered nodes not uploaded")
+        data_backlog = await core.uplink_spool.backlog('data')
+        event_backlog = await core.uplink_spool.backlog('events')
+        if data_backlog or event_backlog:
+            logger.warning(f"⚠️  {data_backlog} data batches and {event_backlog} events kept in spool for next start")
+        await core.uplink_spool.close()
+        await transport.close()
+        logger.info("👋 OPC UA Monitoring Client stopped")
+
+    async def stop_workers(self):
+        """Sharded mode: stop the worker processes before the final flush"""
+
+# ==========================================
+# SHARDED MODE
+# ==========================================
+
+def shard_of(node_id, count):
+    """Worker owning a node key; crc32 (not hash()) so the assignment survives restarts"""
+    return zlib.crc32(node_id.encode('utf-8')) % count
+
+class ShardRing:
+    """
+    Single-producer/single-consumer byte ring in shared memory (one shard
+    worker -> the uplink process). Records are length-prefixed; head and
+    tail are byte counters that only grow. They are read and written under
+    the ring's lock, which also orders the payload copy against the index
+    update on weakly ordered CPUs, so a reader never sees a half-written
+    record. One lock round trip per batch, not per change. The lock is only
+    ever taken with a timeout: a worker SIGKILLed while holding it must not
+    hang the uplink process, which gives the restarted worker a new lock
+    (reset()) instead.
+    """
+    INDEX = struct.Struct('<QQ')  # head (bytes written), tail (bytes read)
+    LENGTH = struct.Struct('<I')
+
+    def __init__(self, shm, capacity, lock):
+        self.shm = shm
+        self.capacity = capacity
+        self.lock = lock
+        self.buf = shm.buf
+
+    @classmethod
+    def create(cls, capacity, lock):
+        shm = shared_memory.SharedMemory(create=True, size=cls.INDEX.size + capacity)
+        cls.INDEX.pack_into(shm.buf, 0, 0, 0)
+        return cls(shm, capacity, lock)
+
+    @classmethod
+    def attach(cls, name, capacity, lock):
+        # Spawned workers share the uplink process's resource tracker, which unlinks the segment on close()
+        return cls(shared_memory.SharedMemory(name=name), capacity, lock)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _copy_in(self, position, data):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        start = self.INDEX.size + offset
+        self.buf[start:start + first] = data[:first]
+        if first < len(data):
+            self.buf[self.INDEX.size:self.INDEX.size + len(data) - first] = data[first:]
+
+    def _copy_out(self, position, length):
+        offset = position % self.capacity
+        first = min(length, self.capacity - offset)
+        start = self.INDEX.size + offset
+        data = bytes(self.buf[start:start + first])
+        if first < length:
+            data += bytes(self.buf[self.INDEX.size:self.INDEX.size + length - first])
+        return data
+
+    def _index(self):
+        """(head, tail), or None if the lock can't be had right now"""
+        if not self.lock.acquire(timeout=SHARD_LOCK_TIMEOUT):
+            return None
+        try:
+            return self.INDEX.unpack_from(self.buf, 0)
+        finally:
+            self.lock.release()
+
+    def _publish(self, offset, value):
+        """Store head (offset 0) or tail (offset 8); False if the lock can't be had right now"""
+        if not self.lock.acquire(timeout=SHARD_LOCK_TIMEOUT):
+            return False
+        try:
+            struct.pack_into('<Q', self.buf, offset, value)
+            return True
+        finally:
+            self.lock.release()
+
+    def write(self, payload):
+        """Append one record; False if it doesn't fit (or can't be published) right now"""
+        size = self.LENGTH.size + len(payload)
+        index = self._index()
+        if index is None:
+            return False
+        head, tail = index
+        if size > self.capacity - (head - tail):
+            return False
+        
+        self._copy_in(head, self.LENGTH.pack(len(payload)) + payload)
+        return self._publish(0, head + size)
+
+    def read(self, max_records=64):
+        """Take up to max_records complete records, oldest first"""
+        index = self._index()
+        if index is None:
+            return []
+        head, tail = index
+        records = []
+        while tail < head and len(records) < max_records:
+            (length,) = self.LENGTH.unpack(self._copy_out(tail, self.LENGTH.size))
+            records.append(self._copy_out(tail + self.LENGTH.size, length))
+            tail += self.LENGTH.size + length
+        # Records whose tail can't be stored stay in the ring, so they are not taken twice
+        if records and not self._publish(8, tail):
+            return []
+        return records
+
+    def reset(self, lock):
+        """Switch to a new lock (the old one may have died held with its worker) and take the leftovers"""
+        self.lock = lock
+        try:
+            head, tail = self.INDEX.unpack_from(self.buf, 0)
+            return self.read(max_records=sys.maxsize) if 0 <= head - tail <= self.capacity else []
+        finally:
+            self.INDEX.pack_into(self.buf, 0, 0, 0)
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class ShardSink:
+    """
+    Worker-side stand-in for the flush scheduler, spool and uploader.
+    Changes from process_notification() and events from log_event() are
+    buffered and written to the ring in batches every SHARD_FLUSH_INTERVAL;
+    the uplink process feeds them into its own flush scheduler and spool.
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.pending = []  # ('data', stream, item) / ('event', event)
+        self.dropped = 0
+
+    def _put(self, record):
+        if len(self.pending) >= SHARD_PENDING_MAX:
+            drop = SHARD_PENDING_MAX // 10
+            del self.pending[:drop]
+            self.dropped += drop
+            logger.warning(f"⚠️  Shard ring full, dropped {drop} oldest change(s) ({self.dropped} total)")
+        self.pending.append(record)
+
+    # opcua_client.flush_scheduler (coalescing happens in the uplink process)
+    def add(self, item, stream='data'):
+        self._put(('data', stream, item))
+
+    def note_event(self):
+        pass
+
+    def set_mode(self, mode):
+        pass
+
+    # opcua_client.uplink_spool
+    def append(self, stream, record):
+        self._put(('event', record))
+
+    # opcua_client.uploader
+    def wake(self, flush_events=False):
+        pass
+
+    def flush(self):
+        """Write buffered records to the ring; whatever doesn't fit stays for the next round"""
+        while self.pending:
+            batch = self.pending[:SHARD_BATCH_MAX]
+            try:
+                record = pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                logger.error(f"❌ Dropping {len(batch)} change(s) that cannot be passed to the uplink process: {e}")
+                del self.pending[:len(batch)]
+                continue
+            if not self.ring.write(record):
+                return False
+            del self.pending[:len(batch)]
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(SHARD_FLUSH_INTERVAL)
+            self.flush()
+
+class ShardWorker(AsyncRuntime):
+    """
+    Runtime of one worker process: a PlcSession per server, subscribed to
+    the nodes whose shard_of() is this worker. Config, the merged discovered
+    nodes and the watch set arrive over the control pipe; status changes and
+    discovery results (worker 0 only) go back over it.
+    """
+    def __init__(self, index, count, ring, conn):
+        super().__init__()
+        self.shard = (index, count)
+        self.runs_discovery = index == 0
+        self.conn = conn
+        self.sink = ShardSink(ring)
+        self.snapshot = None
+        self.snapshot_ready = asyncio.Event()
+        self.reported = {}  # server_id -> node list last sent to the uplink process
+        core.flush_scheduler = self.sink
+        core.uplink_spool = self.sink
+        core.uploader = self.sink
+
+    def send(self, *message):
+        try:
+            self.conn.send(message)
+        except (OSError, EOFError) as e:
+            logger.debug(f"Control pipe closed: {e}")
+            self.stopping.set()
+
+    def on_message(self):
+        try:
+            while self.conn.poll():
+                kind, *args = self.conn.recv()
+                if kind == 'config':
+                    self.apply_config(args[0])
+                elif kind == 'nodes':
+                    core.discovered_nodes_cache = args[0]
+                    self.reconcile_all()
+                elif kind == 'watch':
+                    core.opcua_watch_set(args[0])
+                elif kind == 'snapshot':
+                    self.snapshot = args[0]
+                    self.snapshot_ready.set()
+                elif kind == 'stop':
+                    self.stopping.set()
+        except (OSError, EOFError):
+            # Uplink process is gone
+            self.stopping.set()
+
+    def status_changed(self, session):
+        self.send('status', session.server_id, session.status)
+
+    async def load_discovery_snapshot(self):
+        await self.snapshot_ready.wait()
+        return self.snapshot
+
+    def publish_discovered_nodes(self):
+        # The uplink process merges and sends the node list back ('nodes')
+        pass
+
+    async def save_discovered_nodes(self):
+        """Hand freshly discovered nodes to the uplink process, which merges and uploads them"""
+        for session, _ in self.sessions.values():
+            if session.nodes and self.reported.get(session.server_id) is not session.nodes:
+                self.reported[session.server_id] = session.nodes
+                self.send('discovered', session.server_id, session.fingerprint, session.nodes)
+        return True
+
+    async def housekeeping(self):
+        while True:
+            await asyncio.sleep(1)
+            self.review_subscriptions()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.conn.fileno(), self.on_message)
+        # SIGTERM (ShardProcess.stop after SHARD_STOP_TIMEOUT, or an init system) still gets the final flush
+        loop.add_signal_handler(signal.SIGTERM, self.stopping.set)
+        tasks = [asyncio.ensure_future(coro) for coro in (self.sink.run(), self.housekeeping())]
+        try:
+            await self.stopping.wait()
+        finally:
+            loop.remove_reader(self.conn.fileno())
+            session_tasks = [task for _, task in self.sessions.values()]
+            for task in tasks + session_tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, *session_tasks, return_exceptions=True)
+            if not self.sink.flush():
+                logger.warning(f"⚠️  {len(self.sink.pending)} change(s) did not fit into the shard ring on exit")
+            self.sink.ring.close()
+
+def shard_main(index, count, ring_name, ring_capacity, ring_lock, conn):
+    """Worker process entry point"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The uplink process stops the workers
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(processName)s] %(message)s'))
+    asyncio.run(run_shard(index, count, ShardRing.attach(ring_name, ring_capacity, ring_lock), conn))
+
+async def run_shard(index, count, ring, conn):
+    await ShardWorker(index, count, ring, conn).run()
+
+class ShardProcess:
+    """Uplink-process handle of one worker: its process, ring and control pipe"""
+    def __init__(self, index, count, context):
+        self.index = index
+        self.count = count
+        self.context = context
+        self.ring = ShardRing.create(SHARD_RING_BYTES, context.Lock())
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=shard_main, name=f'shard-{self.index}', daemon=True,
+            args=(self.index, self.count, self.ring.name, self.ring.capacity, self.ring.lock, child_conn))
+        self.process.start()
+        child_conn.close()
+        logger.info(f"🧩 Started {self.process.name} of {self.count} shard workers (pid {self.process.pid})")
+
+    def send(self, *message):
+        try:
+            self.conn.send(message)
+        except (OSError, EOFError) as e:
+            logger.debug(f"shard-{self.index} control pipe closed: {e}")
+
+    def stop(self):
+        self.send('stop')
+        self.process.join(SHARD_STOP_TIMEOUT)
+        if self.process.is_alive():
+            logger.warning(f"⚠️  {self.process.name} did not stop, terminating")
+            self.process.terminate()
+            self.process.join(SHARD_STOP_TIMEOUT)
+        if self.process.is_alive():
+            logger.warning(f"⚠️  {self.process.name} ignored SIGTERM, killing")
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class ShardedServer:
+    """Uplink-process view of one OPC UA server: merged discovery input and per-worker state"""
+    def __init__(self, endpoint):
+        self.server_id = endpoint['id']
+        self.name = endpoint['name']
+        self.nodes = []
+        self.fingerprint = None
+        self.shard_status = {}  # worker index -> status
+
+    def status_of(self, count):
+        statuses = [self.shard_status.get(index, 'Unknown') for index in range(count)]
+        if all(status == 'Connected' for status in statuses):
+            return 'Connected'
+        return 'Disconnected' if 'Disconnected' in statuses else 'Unknown'
+
+class ShardedRuntime(AsyncRuntime):
+    """
+    Uplink process of sharded mode. Keeps the uplink, flush scheduler,
+    spool and discovery upload; the OPC UA sessions run in SHARD_WORKERS
+    worker processes. Changes and events are read from the workers' rings
+    into the flush scheduler and spool; a worker that dies is restarted
+    and sent the current config, nodes and watch set again.
+    """
+    def __init__(self, count):
+        super().__init__()
+        context = multiprocessing.get_context('spawn')
+        self.workers = [ShardProcess(index, count, context) for index in range(count)]
+        self.config_data = None
+        self.watch_data = None
+        self.warm_started = False
+        self.uplink.sio.on('opcua_watch_set', self.on_watch_set)
+
+    def on_watch_set(self, data):
+        core.opcua_watch_set(data)
+        self.watch_data = data
+        self.broadcast('watch', data)
+
+    def broadcast(self, *message):
+        for worker in self.workers:
+            worker.send(*message)
+
+    def apply_config(self, data):
+        """Keep the per-server views in step with the config and pass it to every worker"""
+        core.load_config(data)
+        self.config_data = data
+        servers = {server['id']: server for server in core.opcua_servers(core.config)}
+        removed = [server_id for server_id in self.sessions if server_id not in servers]
+        for server_id in removed:
+            self.sessions.pop(server_id)
+        for server_id, server in servers.items():
+            if server_id not in self.sessions:
+                self.sessions[server_id] = (ShardedServer(server), None)
+        self.broadcast('config', data)
+        if removed:
+            self.publish_discovered_nodes()
+        
+        if not self.warm_started:
+            self.warm_started = True
+            asyncio.ensure_future(self.warm_start())
+
+    async def warm_start(self):
+        """Seed the views from the discovery snapshot and send it to worker 0 (it verifies and rediscovers)"""
+        snapshot = await self.load_discovery_snapshot()
+        if snapshot:
+            fingerprints = snapshot_fingerprints(snapshot)
+            for view, _ in self.sessions.values():
+                view.nodes = [node for node in snapshot['nodes'] if core.node_server_id(node) == view.server_id]
+                view.fingerprint = fingerprints.get(view.server_id)
+            self.publish_discovered_nodes()
+        self.workers[0].send('snapshot', snapshot)
+
+    def reconcile_all(self):
+        pass
+
+    def review_subscriptions(self):
+        # Watch set and rate classes are handled in the workers
+        pass
+
+    def status_changed(self, session):
+        pass
+
+    def server_status(self):
+        return [{'id': view.server_id, 'name': view.name, 'status': view.status_of(len(self.workers))}
+                for view, _ in self.sessions.values()]
+
+    def publish_discovered_nodes(self):
+        core.discovered_nodes_cache = list(chain.from_iterable(view.nodes for view, _ in self.sessions.values()))
+        self.broadcast('nodes', core.discovered_nodes_cache)
+
+    def on_message(self, worker):
+        try:
+            while worker.conn.poll():
+                kind, *args = worker.conn.recv()
+                view = self.sessions.get(args[0], (None, None))[0]
+                if view is None:
+                    continue
+                if kind == 'status':
+                    view.shard_status[worker.index] = args[1]
+                elif kind == 'discovered':
+                    view.fingerprint, view.nodes = args[1], args[2]
+                    asyncio.ensure_future(self.save_discovered_nodes())
+        except (OSError, EOFError):
+            asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+
+    def start_worker(self, worker):
+        worker.start()
+        asyncio.get_running_loop().add_reader(worker.conn.fileno(), self.on_message, worker)
+        if self.config_data:
+            worker.send('config', self.config_data)
+            worker.send('nodes', core.discovered_nodes_cache)
+            if self.watch_data:
+                worker.send('watch', self.watch_data)
+            if worker.index == 0 and self.warm_started:
+                worker.send('snapshot', core.discovery_snapshot)
+
+    def feed(self, records):
+        """Put ring records into the flush scheduler (changes) and the spool (events)"""
+        count = 0
+        for record in records:
+            for entry in pickle.loads(record):
+                if entry[0] == 'data':
+                    self.flush.add(entry[2], entry[1])
+                else:
+                    core.spool_event(entry[1])
+                count += 1
+        return count
+
+    def drain_rings(self):
+        """Feed every worker's ring; number of changes/events taken"""
+        return sum(self.feed(worker.ring.read()) for worker in self.workers)
+
+    def restart_worker(self, worker):
+        """Restart a dead worker on an empty ring with a new lock, keeping what it had already written"""
+        try:
+            self.feed(worker.ring.reset(worker.context.Lock()))
+        except Exception as e:
+            logger.warning(f"⚠️  Discarding the rest of {worker.process.name}'s ring: {e}")
+        self.start_worker(worker)
+
+    async def shards(self):
+        for worker in self.workers:
+            self.start_worker(worker)
+        
+        last_check = time.time()
+        while True:
+            if not self.drain_rings():
+                await asyncio.sleep(SHARD_FLUSH_INTERVAL)
+            
+            if time.time() - last_check >= 1:
+                last_check = time.time()
+                for worker in self.workers:
+                    if not worker.process.is_alive():
+                        logger.error(f"❌ {worker.process.name} exited ({worker.process.exitcode}), restarting")
+                        asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+                        worker.conn.close()
+                        for view, _ in self.sessions.values():
+                            view.shard_status.pop(worker.index, None)
+                        self.restart_worker(worker)
+
+    def tasks(self):
+        return super().tasks() + [self.shards()]
+
+    async def stop_workers(self):
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is not None:
+                loop.remove_reader(worker.conn.fileno())
+        await asyncio.gather(*(loop.run_in_executor(None, worker.stop) for worker in self.workers
+                               if worker.process is not None))
+        self.drain_rings()
+        for worker in self.workers:
+            worker.ring.close(unlink=True)
+
+async def main():
+    await (ShardedRuntime(SHARD_WORKERS) if SHARD_WORKERS > 1 else AsyncRuntime()).run()
+
+# ==========================================
+# ENTRY POINT
+# ==========================================
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        logger.error(f"❌ Fatal error: {e}")
+        sys.exit(1)